@@ -0,0 +1,184 @@
+import torch
+import torchaudio.transforms as T
+from torch.utils.data import default_collate, get_worker_info
+from bucketing import lengths_to_mask
+from augmentor import pitch_shifts
+
+# ---------------------------------------------------
+# Section 1: Batched Random Augmentation
+# ---------------------------------------------------
+class BatchAugmenter:
+    def __init__(self, sample_rate=16000, p=0.5, noise_factor=0.005, gain_db=3.0, shift_max=0.1,
+                 stretch_rates=(0.9, 1.1), pitch_steps=(-2, 2)):
+        """
+        The augmentations of augmentor.py, drawn at random per clip and applied to whole
+        batches, so every epoch sees fresh variants and nothing is written to disk.
+        Args:
+        - sample_rate (int): Sample rate of the batches.
+        - p (float): Probability that each augmentation is applied to a given clip.
+        - noise_factor (float): Standard deviation of the added Gaussian noise.
+        - gain_db (float): Gain is drawn uniformly from [-gain_db, gain_db].
+        - shift_max (float): Fraction of the clip that a time shift may crop from the start or end.
+        - stretch_rates (tuple): Resampling rates a stretched clip is drawn from (1.1 = 10% slower).
+        - pitch_steps (tuple): Semitone shifts a pitch-shifted clip is drawn from.
+        """
+        self.p = p
+        self.noise_factor = noise_factor
+        self.gain_db = gain_db
+        self.shift_max = shift_max
+        self.sample_rate = sample_rate
+        self.pitch_steps = tuple(pitch_steps)
+        # Built once: Resample caches its sinc kernel (pitch_shifts caches its own resamplers)
+        self.resamplers = {rate: T.Resample(sample_rate, int(sample_rate * rate)) for rate in stretch_rates}
+
+    def _choose(self, batch_size, num_options):
+        """
+        Per clip: -1 (not augmented) or the index of one of `num_options` settings.
+        """
+        choice = torch.randint(num_options, (batch_size,)) if num_options else torch.zeros(batch_size, dtype=torch.long)
+        return torch.where(torch.rand(batch_size) < self.p, choice, torch.full_like(choice, -1))
+
+    def _stretch(self, waveforms, lengths, fixed_length):
+        choice = self._choose(len(waveforms), len(self.resamplers))
+        if not (choice >= 0).any():
+            return waveforms, lengths
+
+        # Each rate is applied once to the sub-batch that drew it
+        stretched = {}
+        lengths = lengths.clone()
+        for k, (rate, resampler) in enumerate(self.resamplers.items()):
+            idx = torch.nonzero(choice == k).flatten()
+            if len(idx):
+                stretched[k] = (idx, resampler(waveforms[idx]))
+                lengths[idx] = torch.ceil(lengths[idx] * rate).long()
+
+        out_length = waveforms.size(-1) if fixed_length else int(lengths.max())
+        out = torch.nn.functional.pad(waveforms, (0, max(0, out_length - waveforms.size(-1))))[..., :out_length].clone()
+        for idx, resampled in stretched.values():
+            resampled = resampled[..., :out_length]
+            out[idx] = torch.nn.functional.pad(resampled, (0, out_length - resampled.size(-1)))
+        return out, lengths.clamp(max=out_length)
+
+    def _pitch_shift(self, waveforms):
+        choice = self._choose(len(waveforms), len(self.pitch_steps))
+        waveforms = waveforms.clone()
+        for k, n_steps in enumerate(self.pitch_steps):
+            idx = torch.nonzero(choice == k).flatten()
+            if len(idx):
+                waveforms[idx] = pitch_shifts(waveforms[idx], self.sample_rate, steps=(n_steps,))[n_steps]
+        return waveforms
+
+    def _time_shift(self, waveforms, lengths):
+        # Positive shifts crop the start of the clip, negative shifts crop its end (as augmentor.time_shift)
+        batch_size, _, length = waveforms.shape
+        fraction = (torch.rand(batch_size) * 2 - 1) * self.shift_max
+        fraction = torch.where(self._choose(batch_size, 0) >= 0, fraction, torch.zeros_like(fraction))
+        shifts = (fraction * lengths).long()
+        positions = torch.arange(length).unsqueeze(0) + shifts.clamp(min=0).unsqueeze(1)
+        shifted = torch.gather(waveforms, -1, positions.clamp(max=length - 1).unsqueeze(1).expand_as(waveforms))
+        return shifted, lengths - shifts.abs()
+
+    @staticmethod
+    def content_lengths(waveforms):
+        """
+        Per clip, the position just after its last non-zero sample: the clip's own length
+        inside a zero-padded fixed-length batch.
+        """
+        nonzero = (waveforms != 0).any(dim=1)
+        last = nonzero.size(-1) - nonzero.flip(-1).int().argmax(dim=-1)
+        return torch.where(nonzero.any(dim=-1), last, torch.ones_like(last))
+
+    def __call__(self, waveforms, lengths=None):
+        """
+        Args:
+        - waveforms (Tensor): (batch, 1, T) padded waveforms.
+        - lengths (Tensor): (batch,) unpadded lengths. None means fixed-length clips; the
+          output then keeps length T (as the 'flatten' architecture requires), and shifts
+          and stretches are relative to each clip's content before its zero padding.
+
+        Returns:
+        - waveforms (Tensor): (batch, 1, T') augmented waveforms, zero beyond each new length.
+        - lengths (Tensor): (batch,) new lengths.
+        """
+        fixed_length = lengths is None
+        if fixed_length:
+            # Short clips are mostly padding; a shift relative to T could crop away all their speech
+            lengths = self.content_lengths(waveforms)
+
+        with torch.no_grad():
+            waveforms, lengths = self._stretch(waveforms, lengths, fixed_length)
+            waveforms = self._pitch_shift(waveforms)
+            waveforms, lengths = self._time_shift(waveforms, lengths)
+
+            # Gain and noise are plain per-clip broadcasts
+            batch_size = waveforms.size(0)
+            apply_gain = self._choose(batch_size, 0) >= 0
+            gain_db = (torch.rand(batch_size) * 2 - 1) * self.gain_db * apply_gain
+            waveforms = waveforms * (10 ** (gain_db / 20)).view(-1, 1, 1)
+            apply_noise = (self._choose(batch_size, 0) >= 0).float().view(-1, 1, 1)
+            waveforms = waveforms + torch.randn_like(waveforms) * self.noise_factor * apply_noise
+
+            # Keep padding silent so pooled encoders see the same clip regardless of batch length
+            waveforms = waveforms * lengths_to_mask(lengths, waveforms.size(-1)).unsqueeze(1)
+        return waveforms, lengths
+
+# ---------------------------------------------------
+# Section 2: Collate Wrapper
+# ---------------------------------------------------
+class AugmentingCollate:
+    def __init__(self, augmenter, collate_fn=default_collate, waveform_indices=(0, 1), length_indices=None, seed=None):
+        """
+        Runs a collate function and then augments the waveform fields of the batch, so the
+        work happens in the DataLoader workers. Pass only to the training loader.
+        Args:
+        - augmenter (BatchAugmenter): Augmenter applied to each waveform field.
+        - collate_fn (callable): Collate function producing the batch (e.g. pair_pad_collate).
+        - waveform_indices (tuple): Positions of the (batch, 1, T) waveform tensors in the batch.
+        - length_indices (tuple): Positions of the matching length tensors, if the collate
+          function returns them; they are updated and all waveform fields re-padded to one length.
+        - seed (int): If given, each batch is augmented from a seed derived from (seed, epoch, batch
+          index) instead of the process's RNG, so the augmentations do not depend on which worker
+          collates a batch (a resumed run matches an uninterrupted one). Needs set_epoch before each
+          epoch and non-persistent workers.
+        """
+        self.augmenter = augmenter
+        self.collate_fn = collate_fn
+        self.waveform_indices = waveform_indices
+        self.length_indices = length_indices
+        self.seed = seed
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch, start_batch=0):
+        # Workers start from a copy of this state, so each counts its own batches from zero
+        self.epoch = epoch
+        self.start_batch = start_batch
+        self._calls = 0
+
+    def _batch_index(self):
+        # Workers take batches round-robin: worker w collates batches w, w + num_workers, ...
+        worker = get_worker_info()
+        index = self._calls if worker is None else worker.id + worker.num_workers * self._calls
+        self._calls += 1
+        return self.start_batch + index
+
+    def __call__(self, batch):
+        batch = list(self.collate_fn(batch))
+        if self.seed is None:
+            return self._augment(batch)
+        # Seeded on a forked RNG, so the process's own stream (shuffles, dropout) is left untouched
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(hash((self.seed, self.epoch, self._batch_index())) & 0xFFFFFFFFFFFFFFFF)
+            return self._augment(batch)
+
+    def _augment(self, batch):
+        for i, w in enumerate(self.waveform_indices):
+            lengths = batch[self.length_indices[i]] if self.length_indices else None
+            batch[w], new_lengths = self.augmenter(batch[w], lengths)
+            if self.length_indices:
+                batch[self.length_indices[i]] = new_lengths
+
+        if self.length_indices:
+            max_length = max(batch[w].size(-1) for w in self.waveform_indices)
+            for w in self.waveform_indices:
+                batch[w] = torch.nn.functional.pad(batch[w], (0, max_length - batch[w].size(-1)))
+        return tuple(batch)
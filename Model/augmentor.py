@@ -1,79 +1,271 @@
 import torchaudio
 import torchaudio.transforms as T
+import torchaudio.functional as F
 import os
+import json
+import math
+import zlib
 import random
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 import torch
+from bucketing import audio_info
+
+# Output suffixes, in the order they are written: f"{word}_{name}.wav"
+AUGMENTATIONS = (
+    "original", "noisy", "pitch_shifted_female", "pitch_shifted_male",
+    "louder", "quieter", "stretched", "shifted",
+)
+MANIFEST_FILE = "augmentations.json"
+
+
+def source_word(audio_file):
+    """
+    The word an augmented file was made from: "Across_pitch_shifted_male.wav" -> "Across".
+    Files without an augmentation suffix map to their own name.
+    """
+    stem = os.path.splitext(os.path.basename(audio_file))[0]
+    # "pitch_shifted" is the single pitch shift written by earlier versions of this script
+    for name in AUGMENTATIONS + ("pitch_shifted",):
+        if stem.endswith(f"_{name}"):
+            return stem[:-len(name) - 1]
+    return stem
+
+# ---------------------------------------------------
+# Section 1: Augmentations (transforms are built once per process)
+# ---------------------------------------------------
+@lru_cache(maxsize=None)
+def _resampler(orig_freq, new_freq):
+    return T.Resample(orig_freq=orig_freq, new_freq=new_freq)
+
+
+@lru_cache(maxsize=None)
+def _vol(gain_dB):
+    return T.Vol(gain=gain_dB, gain_type='db')
 
-# Directory for original .wav files
-original_wav_dir = 'data/converted_audio/'
-# Directory for augmented files
-augmented_dir = 'data/augmented_audio/'
-# Ensure the augmented audio directory exists
-os.makedirs(augmented_dir, exist_ok=True)
 
 # Function to add background noise
 def add_background_noise(waveform, noise_factor=0.005):
     noise = torch.randn(waveform.size()) * noise_factor
     return waveform + noise
 
+# Function to pitch shift several amounts at once
+def pitch_shifts(waveform, sample_rate, steps=(2, -2), n_fft=512):
+    """
+    T.PitchShift(sample_rate, n_steps) for each of `steps`, but the STFT of the input is
+    computed once and shared: only the phase vocoder, inverse STFT and resampling are
+    repeated per shift. The intermediate rate is rounded to 100 Hz so the resampling
+    kernel stays small (T.PitchShift's is over 1 GB at 16 kHz); the shift is off by a few cents.
+    Args:
+    - waveform (Tensor): (..., time) batch of equal-length clips.
+    - sample_rate (int): Sample rate of the clips.
+    - steps (tuple): Semitone shifts.
+
+    Returns:
+    - shifted (dict): {n_steps: tensor shaped like waveform}.
+    """
+    hop_length = n_fft // 4
+    window = torch.hann_window(n_fft)
+    length = waveform.size(-1)
+    shape = waveform.shape
+    flat = waveform.reshape(-1, length)
+
+    spec = torch.stft(flat, n_fft=n_fft, hop_length=hop_length, window=window, return_complex=True)
+    phase_advance = torch.linspace(0, math.pi * hop_length, spec.shape[-2])[..., None]
+
+    shifted = {}
+    for n_steps in steps:
+        orig_freq = int(round(sample_rate * 2.0 ** (float(n_steps) / 12) / 100)) * 100
+        rate = sample_rate / orig_freq
+        stretched = F.phase_vocoder(spec, rate, phase_advance)
+        stretched = torch.istft(stretched, n_fft=n_fft, hop_length=hop_length, window=window,
+                                length=int(round(length / rate)))
+        out = _resampler(orig_freq, sample_rate)(stretched)
+        out = torch.nn.functional.pad(out, (0, max(0, length - out.size(-1))))[..., :length]
+        shifted[n_steps] = out.reshape(shape)
+    return shifted
+
 # Function to pitch shift
 def pitch_shift(waveform, sample_rate, n_steps=2):
-    return T.PitchShift(sample_rate, n_steps=n_steps)(waveform)
+    return pitch_shifts(waveform, sample_rate, steps=(n_steps,))[n_steps]
 
 # Function to adjust volume
 def adjust_volume(waveform, gain_dB):
     # Adjust gain in decibels (gain_type = 'db')
-    return T.Vol(gain=gain_dB, gain_type='db')(waveform)
+    return _vol(gain_dB)(waveform)
 
 # Function to time stretch
-def time_stretch(waveform, rate=1.1):
-    return T.Resample(orig_freq=16000, new_freq=int(16000 * rate))(waveform)
+def time_stretch(waveform, rate=1.1, sample_rate=16000):
+    return _resampler(sample_rate, int(sample_rate * rate))(waveform)
 
 # Function to time shift
 def time_shift(waveform, shift_max=0.1):
     shift = int(random.uniform(-shift_max, shift_max) * waveform.size(1))
     return waveform[:, shift:] if shift > 0 else waveform[:, :shift]
 
-# List all original .wav files
-for wav_file in os.listdir(original_wav_dir):
-    if wav_file.endswith('.wav'):
-        wav_file_path = os.path.join(original_wav_dir, wav_file)
-        
-        # Load the original audio
-        waveform, sample_rate = torchaudio.load(wav_file_path)
-
-        # Original file
-        torchaudio.save(os.path.join(augmented_dir, f"{wav_file[:-4]}_original.wav"), waveform, sample_rate)
-
-        # Augmentation 1: Add background noise
-        noisy_waveform = add_background_noise(waveform)
-        torchaudio.save(os.path.join(augmented_dir, f"{wav_file[:-4]}_noisy.wav"), noisy_waveform, sample_rate)
-
-        # Augmentation 2: Pitch shift (simulate both male and female speech)
-        # Female-like (higher pitch)
-        pitch_shifted_waveform_female = pitch_shift(waveform, sample_rate, n_steps=2)
-        torchaudio.save(os.path.join(augmented_dir, f"{wav_file[:-4]}_pitch_shifted_female.wav"), pitch_shifted_waveform_female, sample_rate)
-        # Male-like (lower pitch)
-        pitch_shifted_waveform_male = pitch_shift(waveform, sample_rate, n_steps=-2)
-        torchaudio.save(os.path.join(augmented_dir, f"{wav_file[:-4]}_pitch_shifted_male.wav"), pitch_shifted_waveform_male, sample_rate)
-
-        # Augmentation 3: Adjust volume
-        # Louder
-        louder_waveform = adjust_volume(waveform, gain_dB=3)
-        torchaudio.save(os.path.join(augmented_dir, f"{wav_file[:-4]}_louder.wav"), louder_waveform, sample_rate)
-        # Quieter
-        quieter_waveform = adjust_volume(waveform, gain_dB=-3)
-        torchaudio.save(os.path.join(augmented_dir, f"{wav_file[:-4]}_quieter.wav"), quieter_waveform, sample_rate)
-
-        # Augmentation 4: Time stretch
-        stretched_waveform = time_stretch(waveform, rate=1.1)
-        torchaudio.save(os.path.join(augmented_dir, f"{wav_file[:-4]}_stretched.wav"), stretched_waveform, sample_rate)
-
-        # Augmentation 5: Time shift
-        shifted_waveform = time_shift(waveform, shift_max=0.1)
-        torchaudio.save(os.path.join(augmented_dir, f"{wav_file[:-4]}_shifted.wav"), shifted_waveform, sample_rate)
-
-        print(f"Processed: {wav_file}")
+
+def augment_batch(waveforms, sample_rate, names=AUGMENTATIONS):
+    """
+    Applies the requested augmentations to a (batch, channels, time) stack of equal-length clips.
+
+    Returns:
+    - outputs (dict): {name: list of (channels, time) tensors, one per clip}.
+    """
+    outputs = {}
+    if "original" in names:
+        outputs["original"] = list(waveforms)
+    if "noisy" in names:
+        outputs["noisy"] = list(add_background_noise(waveforms))
+
+    # Female-like (higher pitch) and male-like (lower pitch) share one STFT
+    steps = [n for n, name in ((2, "pitch_shifted_female"), (-2, "pitch_shifted_male")) if name in names]
+    if steps:
+        shifted = pitch_shifts(waveforms, sample_rate, steps=tuple(steps))
+        for n, name in ((2, "pitch_shifted_female"), (-2, "pitch_shifted_male")):
+            if n in shifted:
+                outputs[name] = list(shifted[n])
+
+    if "louder" in names:
+        outputs["louder"] = list(adjust_volume(waveforms, gain_dB=3))
+    if "quieter" in names:
+        outputs["quieter"] = list(adjust_volume(waveforms, gain_dB=-3))
+    if "stretched" in names:
+        outputs["stretched"] = list(time_stretch(waveforms, rate=1.1, sample_rate=sample_rate))
+    if "shifted" in names:
+        # The crop is random per clip, so the outputs no longer share a length
+        outputs["shifted"] = [time_shift(w, shift_max=0.1) for w in waveforms]
+    return outputs
+
+# ---------------------------------------------------
+# Section 2: Worker Processing One Batch of Files
+# ---------------------------------------------------
+def _init_worker():
+    # Parallelism comes from the process pool; one thread per worker avoids oversubscription
+    torch.set_num_threads(1)
+
+
+def _save_atomic(path, waveform, sample_rate):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torchaudio.save(tmp_path, waveform, sample_rate, format="wav")
+    os.replace(tmp_path, path)
+
+
+def process_batch(wav_paths, needed, augmented_dir, seed=0):
+    """
+    Loads equal-length clips, stacks them, and writes each clip's missing augmentations.
+    Args:
+    - wav_paths (list): Source .wav files sharing length, channel count and sample rate.
+    - needed (list): For each source, the augmentation names to write.
+    - augmented_dir (str): Output directory.
+    - seed (int): Base seed; combined with the file names so reruns draw the same noise/shifts.
+
+    Returns:
+    - entries (dict): Manifest entries {output file: {"source": ..., "augmentation": ...}}.
+    """
+    seed = seed ^ zlib.crc32("\n".join(wav_paths).encode())
+    torch.manual_seed(seed)
+    random.seed(seed)
+
+    clips = [torchaudio.load(path) for path in wav_paths]
+    sample_rate = clips[0][1]
+    waveforms = torch.stack([waveform for waveform, _ in clips])
+    names = [name for name in AUGMENTATIONS if any(name in n for n in needed)]
+    outputs = augment_batch(waveforms, sample_rate, names)
+
+    entries = {}
+    for i, wav_path in enumerate(wav_paths):
+        wav_file = os.path.basename(wav_path)
+        for name in needed[i]:
+            out_file = f"{wav_file[:-4]}_{name}.wav"
+            _save_atomic(os.path.join(augmented_dir, out_file), outputs[name][i], sample_rate)
+            entries[out_file] = {"source": wav_file, "augmentation": name}
+    return entries
+
+# ---------------------------------------------------
+# Section 3: Parallel Pipeline
+# ---------------------------------------------------
+def augment_directory(original_wav_dir, augmented_dir, only=AUGMENTATIONS, skip_existing=False,
+                      workers=None, batch_size=16, seed=0):
+    """
+    Writes augmented copies of every .wav in original_wav_dir across a process pool.
+    Clips with the same length are batched through each transform together.
+    Args:
+    - original_wav_dir (str): Directory of converted .wav files.
+    - augmented_dir (str): Output directory; also holds the manifest.
+    - only (tuple): Subset of AUGMENTATIONS to write.
+    - skip_existing (bool): Do not rewrite outputs that already exist.
+    - workers (int): Worker processes (None uses every core).
+    - batch_size (int): Maximum clips per batch.
+    - seed (int): Base random seed.
+
+    Returns:
+    - manifest (dict): {output file: {"source": ..., "augmentation": ...}} for the whole directory.
+    """
+    os.makedirs(augmented_dir, exist_ok=True)
+    manifest_path = os.path.join(augmented_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    # Group sources by (frames, channels, sample rate) from the headers alone
+    groups = defaultdict(list)
+    for wav_file in sorted(os.listdir(original_wav_dir)):
+        if not wav_file.endswith('.wav'):
+            continue
+        needed = [name for name in only
+                  if not (skip_existing and os.path.exists(os.path.join(augmented_dir, f"{wav_file[:-4]}_{name}.wav")))]
+        if not needed:
+            continue
+        wav_path = os.path.join(original_wav_dir, wav_file)
+        info = audio_info(wav_path)
+        groups[(info.num_frames, info.num_channels, info.sample_rate)].append((wav_path, needed))
+
+    batches = [group[i:i + batch_size] for group in groups.values() for i in range(0, len(group), batch_size)]
+    print(f"{sum(len(b) for b in batches)} clips to augment in {len(batches)} batches")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        futures = {
+            executor.submit(process_batch, [p for p, _ in batch], [n for _, n in batch], augmented_dir, seed): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                manifest.update(future.result())
+            except Exception as e:
+                print(f"Failed to augment {[os.path.basename(p) for p, _ in batch]}: {e}")
+                continue
+            for wav_path, _ in batch:
+                print(f"Processed: {os.path.basename(wav_path)}")
+
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+# ---------------------------------------------------
+# Section 4: Main Execution Block
+# ---------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write augmented copies of the converted clips.")
+    # Directory for original .wav files
+    parser.add_argument("--input-dir", default='data/converted_audio/')
+    # Directory for augmented files
+    parser.add_argument("--output-dir", default='data/augmented_audio/')
+    parser.add_argument("--only", nargs="+", choices=AUGMENTATIONS, default=list(AUGMENTATIONS),
+                        help="Write only these augmentations")
+    parser.add_argument("--skip-existing", action="store_true", help="Keep outputs that already exist")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    augment_directory(args.input_dir, args.output_dir, only=tuple(args.only), skip_existing=args.skip_existing,
+                      workers=args.workers, batch_size=args.batch_size, seed=args.seed)
 
 
 
@@ -0,0 +1,213 @@
+import os
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import torch
+from augmentor import source_word
+from inference_server import SAMPLE_RATE, load_model, load_waveform
+from lexicon_decoder import LexiconDecoder, load_vocabulary
+
+# Regression run over many clips, e.g. the test split:
+#   python batch_transcribe.py data/test_set/ --out results.jsonl
+#   python batch_transcribe.py data/test_set/test.csv --audio-dir data/augmented_audio/ --vocab-csv data/a.csv --out results.csv
+
+# ---------------------------------------------------
+# Section 1: Inputs (Directory or Manifest)
+# ---------------------------------------------------
+def list_inputs(path, audio_dir=None):
+    """
+    Args:
+    - path (str): A directory of .wav files, a CSV manifest with a `file` column (and optionally
+      `enWord`, as written by test_set_genrator.py), or a text file with one path per line.
+    - audio_dir (str): Directory manifest paths are relative to (defaults to the manifest's directory).
+
+    Returns:
+    - items (list): (file path, label) tuples; the label comes from the manifest's enWord
+      column, else from the file name (augmented variants map to their source word).
+    """
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".wav"))
+        return [(file, source_word(os.path.basename(file))) for file in files]
+
+    base_dir = audio_dir or os.path.dirname(path)
+    if path.endswith(".csv"):
+        manifest = pd.read_csv(path)
+        labels = manifest['enWord'] if 'enWord' in manifest else [None] * len(manifest)
+        items = zip(manifest['file'], labels)
+    else:
+        with open(path) as f:
+            items = [(line.strip(), None) for line in f if line.strip()]
+    return [(os.path.join(base_dir, file), label if isinstance(label, str) else source_word(os.path.basename(file)))
+            for file, label in items]
+
+
+def load_item(path):
+    """
+    Reads, downmixes and resamples one file (runs on the thread pool).
+
+    Returns:
+    - waveform (array): Mono float32 at 16 kHz.
+    - load_ms (float): Time spent decoding and resampling.
+    """
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        waveform = load_waveform(f.read())
+    return waveform, (time.perf_counter() - started) * 1000
+
+
+def normalize_word(text):
+    # Case, surrounding spaces and Wav2Vec2's "|" word delimiter do not count as mistakes
+    return " ".join(text.replace("|", " ").split()).casefold()
+
+# ---------------------------------------------------
+# Section 2: Length-Sorted Padded Batches
+# ---------------------------------------------------
+@torch.inference_mode()
+def transcribe_batch(waveforms, model, processor, device, decoder=None):
+    """
+    Returns:
+    - transcriptions (list): One string per clip (the best vocabulary word with a decoder).
+    """
+    inputs = processor(waveforms, sampling_rate=SAMPLE_RATE, return_tensors="pt", padding=True)
+    kwargs = {}
+    if "attention_mask" in inputs:
+        kwargs["attention_mask"] = inputs.attention_mask.to(device)
+    logits = model(input_values=inputs.input_values.to(device), **kwargs).logits
+    if decoder is not None:
+        # Frames past each clip's end are padding
+        lengths = model._get_feat_extract_output_lengths(torch.tensor([len(w) for w in waveforms]))
+        return [candidates[0][0] if candidates else "" for candidates in decoder.decode(logits, lengths, top_k=1)]
+    return processor.batch_decode(torch.argmax(logits, dim=-1))
+
+
+def transcribe_items(items, model, processor, device, decoder=None, batch_size=16, workers=8, window_batches=16):
+    """
+    Decodes files on a thread pool and runs them through the model in length-sorted batches.
+    Files are handled in windows of window_batches x batch_size: each window is sorted by
+    duration so batches carry little padding, and the next window is decoded while the model
+    works on the current one, which bounds memory for any number of files.
+
+    Yields:
+    - result (dict): file, label, prediction, correct, seconds, load_ms, infer_ms (the file's
+      share of its batch) and latency_ms (load_ms + infer_ms), in input order per window.
+      A file that cannot be decoded or transcribed gets a row with only file, label and error
+      (the exception message) instead of stopping the run.
+    """
+    window = batch_size * window_batches
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(start):
+            return [executor.submit(load_item, path) for path, _ in items[start:start + window]]
+
+        pending = submit(0)
+        for start in range(0, len(items), window):
+            loaded, errors = [None] * len(pending), {}
+            for i, future in enumerate(pending):
+                try:
+                    loaded[i] = future.result()
+                except Exception as error:
+                    errors[i] = f"{type(error).__name__}: {error}"
+            pending = submit(start + window)  # Decode ahead while the model runs
+
+            order = sorted((i for i in range(len(loaded)) if i not in errors), key=lambda i: len(loaded[i][0]))
+            predictions, infer_ms = [None] * len(loaded), [0.0] * len(loaded)
+            for batch_start in range(0, len(order), batch_size):
+                batch = order[batch_start:batch_start + batch_size]
+                started = time.perf_counter()
+                try:
+                    transcriptions = transcribe_batch([loaded[i][0] for i in batch], model, processor, device, decoder)
+                except Exception:
+                    # Retry the batch one file at a time so only the offending file fails
+                    transcriptions = []
+                    for i in batch:
+                        try:
+                            transcriptions += transcribe_batch([loaded[i][0]], model, processor, device, decoder)
+                        except Exception as error:
+                            errors[i] = f"{type(error).__name__}: {error}"
+                            transcriptions.append(None)
+                share = (time.perf_counter() - started) * 1000 / len(batch)
+                for i, transcription in zip(batch, transcriptions):
+                    predictions[i], infer_ms[i] = transcription, share
+
+            for i, (path, label) in enumerate(items[start:start + window]):
+                if i in errors:
+                    yield {"file": path, "label": label, "error": errors[i]}
+                    continue
+                waveform, load_ms = loaded[i]
+                yield {"file": path, "label": label, "prediction": predictions[i],
+                       "correct": normalize_word(predictions[i]) == normalize_word(label) if label else None,
+                       "seconds": len(waveform) / SAMPLE_RATE, "load_ms": load_ms, "infer_ms": infer_ms[i],
+                       "latency_ms": load_ms + infer_ms[i]}
+
+# ---------------------------------------------------
+# Section 3: Writing Results and the Summary
+# ---------------------------------------------------
+RESULT_FIELDS = ["file", "label", "prediction", "correct", "seconds", "load_ms", "infer_ms", "latency_ms", "error"]
+
+
+def write_results(results, out_path):
+    """
+    Streams results to JSONL (one object per line) or, for a .csv path, to CSV.
+
+    Returns:
+    - results (list): Everything written, for the summary.
+    """
+    written = []
+    with open(out_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS) if out_path.endswith(".csv") else None
+        if writer:
+            writer.writeheader()
+        for result in results:
+            if writer:
+                writer.writerow(result)
+            else:
+                f.write(json.dumps(result) + "\n")
+            written.append(result)
+    return written
+
+
+def summarize(results, wall_seconds):
+    # Files that failed are reported separately and left out of the timings and the accuracy
+    failed = [r for r in results if r.get("error")]
+    results = [r for r in results if not r.get("error")]
+    labeled = [r for r in results if r["correct"] is not None]
+    audio_seconds = sum(r["seconds"] for r in results)
+    latencies = sorted(r["latency_ms"] for r in results)
+    print(f"Files: {len(results)}, audio: {audio_seconds / 60:.1f} min, wall time: {wall_seconds:.1f} s "
+          f"({len(results) / wall_seconds:.1f} files/s, real-time factor {wall_seconds / max(audio_seconds, 1e-9):.3f})")
+    if latencies:
+        print(f"Per-file latency: median {latencies[len(latencies) // 2]:.1f} ms, "
+              f"p95 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]:.1f} ms")
+    if failed:
+        print(f"Failed: {len(failed)} files (see the error column), e.g. {failed[0]['file']}: {failed[0]['error']}")
+    if labeled:
+        accuracy = sum(r["correct"] for r in labeled) / len(labeled)
+        print(f"Word accuracy: {accuracy * 100:.2f}% ({sum(r['correct'] for r in labeled)}/{len(labeled)})")
+        return accuracy
+    return None
+
+# ---------------------------------------------------
+# Section 4: Main Execution Block
+# ---------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe a directory or manifest of clips and score word accuracy.")
+    parser.add_argument("input", help="Directory of .wav files, CSV manifest (file[, enWord]) or text file of paths")
+    parser.add_argument("--audio-dir", help="Directory manifest paths are relative to")
+    parser.add_argument("--model-path", default='./trained_model')  # Adjust to your saved model path
+    parser.add_argument("--out", default='./transcriptions.jsonl', help=".jsonl or .csv")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=8, help="Threads decoding and resampling files")
+    parser.add_argument("--vocab-csv", help="Match against this CSV's enWord vocabulary (e.g. a.csv) instead of free decoding")
+    parser.add_argument("--limit", type=int, help="Only the first N files")
+    args = parser.parse_args()
+
+    items = list_inputs(args.input, args.audio_dir)[:args.limit]
+    model, processor, device = load_model(args.model_path)
+    decoder = LexiconDecoder.from_processor(load_vocabulary(args.vocab_csv), processor) if args.vocab_csv else None
+
+    started = time.perf_counter()
+    results = write_results(transcribe_items(items, model, processor, device, decoder, args.batch_size, args.workers), args.out)
+    summarize(results, time.perf_counter() - started)
+    print(f"Results written to {args.out}")
@@ -0,0 +1,151 @@
+import wave
+import random
+from collections import namedtuple
+import torch
+from torch.utils.data import Sampler
+try:
+    import soundfile
+except ImportError:  # Falls back to the standard library's wave module (PCM .wav only)
+    soundfile = None
+
+AudioInfo = namedtuple("AudioInfo", ["num_frames", "num_channels", "sample_rate"])
+
+# ---------------------------------------------------
+# Section 1: Clip Lengths
+# ---------------------------------------------------
+def audio_info(audio_path):
+    """
+    Frame count, channels and sample rate from an audio file's header, without decoding it.
+    (torchaudio.info was removed in torchaudio 2.9.)
+    """
+    if soundfile is not None:
+        info = soundfile.info(audio_path)
+        return AudioInfo(info.frames, info.channels, info.samplerate)
+    with wave.open(audio_path) as f:
+        return AudioInfo(f.getnframes(), f.getnchannels(), f.getframerate())
+
+
+def audio_lengths(audio_paths, sample_rate=16000):
+    """
+    Reads clip lengths from the file headers, without decoding the audio.
+    Args:
+    - audio_paths (list): Paths of the audio files.
+    - sample_rate (int): Rate the lengths are expressed in (clips are resampled to it on load).
+
+    Returns:
+    - lengths (list): Number of samples of each clip at `sample_rate`.
+    """
+    lengths = []
+    for audio_path in audio_paths:
+        info = audio_info(audio_path)
+        lengths.append(int(info.num_frames * sample_rate / info.sample_rate))
+    return lengths
+
+
+def lengths_to_mask(lengths, max_length):
+    """
+    (batch,) lengths -> (batch, max_length) bool mask, True on real samples.
+    """
+    return torch.arange(max_length, device=lengths.device).unsqueeze(0) < lengths.unsqueeze(1)
+
+# ---------------------------------------------------
+# Section 2: Length-Bucketed Batch Sampler
+# ---------------------------------------------------
+class LengthBucketSampler(Sampler):
+    def __init__(self, lengths, batch_size, bucket_size_multiplier=50, shuffle=True, drop_last=False, seed=0):
+        """
+        Yields batches of indices whose items have similar lengths, so padding to the
+        batch maximum wastes little compute. Use as DataLoader(batch_sampler=...).
+        Args:
+        - lengths (list): Length of each item in the dataset.
+        - batch_size (int): Items per batch.
+        - bucket_size_multiplier (int): Items are shuffled, cut into pools of
+          batch_size * multiplier, and sorted by length within each pool. Larger pools
+          pad less but make batches less random.
+        - shuffle (bool): Reshuffle pools and batch order every epoch.
+        - drop_last (bool): Drop the final incomplete batch.
+        - seed (int): Base seed; combined with the epoch set via set_epoch.
+        """
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.pool_size = batch_size * bucket_size_multiplier
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _indices(self):
+        return list(range(len(self.lengths)))
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        indices = self._indices()
+        if self.shuffle:
+            rng.shuffle(indices)
+
+        batches = []
+        for start in range(0, len(indices), self.pool_size):
+            pool = sorted(indices[start:start + self.pool_size], key=lambda i: self.lengths[i])
+            for b in range(0, len(pool), self.batch_size):
+                batch = pool[b:b + self.batch_size]
+                if len(batch) < self.batch_size and self.drop_last:
+                    continue
+                batches.append(batch)
+
+        if self.shuffle:
+            rng.shuffle(batches)
+        return iter(batches)
+
+    def __len__(self):
+        num_items = len(self._indices())
+        if self.drop_last:
+            # Every pool except possibly the last drops at most one partial batch
+            full_pools, rest = divmod(num_items, self.pool_size)
+            return full_pools * (self.pool_size // self.batch_size) + rest // self.batch_size
+        full_pools, rest = divmod(num_items, self.pool_size)
+        per_pool = -(-self.pool_size // self.batch_size)
+        return full_pools * per_pool + -(-rest // self.batch_size)
+
+# ---------------------------------------------------
+# Section 3: Collate Functions Padding to the Batch Maximum
+# ---------------------------------------------------
+def pad_batch(waveforms, max_length=None):
+    """
+    Right-pads (1, T_i) or (T_i,) tensors to the longest one in the batch.
+
+    Returns:
+    - padded (Tensor): (batch, 1, T_max) tensor, or (batch, C, T_max) for (C, T_i) features.
+    - lengths (Tensor): (batch,) unpadded lengths along the last axis.
+    """
+    waveforms = [w.unsqueeze(0) if w.dim() == 1 else w for w in waveforms]
+    lengths = torch.tensor([w.size(-1) for w in waveforms])
+    max_length = max_length or int(lengths.max())
+    padded = waveforms[0].new_zeros((len(waveforms), waveforms[0].size(0), max_length))
+    for i, w in enumerate(waveforms):
+        padded[i, :, :w.size(-1)] = w
+    return padded, lengths
+
+
+def pad_collate(batch):
+    """
+    For (waveform, label) datasets: returns (waveforms, labels, lengths).
+    """
+    waveforms, labels = zip(*batch)
+    padded, lengths = pad_batch(waveforms)
+    return padded, list(labels), lengths
+
+
+def pair_pad_collate(batch):
+    """
+    For PairDataset: returns (waveform1, waveform2, same, lengths1, lengths2), or
+    (waveform1, waveform2, same, word_id1, word_id2, lengths1, lengths2) with return_ids=True.
+    Both sides are padded to one common length so they can share a forward pass.
+    """
+    waveforms1, waveforms2, *fields = zip(*batch)
+    max_length = max(w.size(-1) for w in waveforms1 + waveforms2)
+    padded1, lengths1 = pad_batch(waveforms1, max_length)
+    padded2, lengths2 = pad_batch(waveforms2, max_length)
+    return (padded1, padded2, *[torch.tensor(field) for field in fields], lengths1, lengths2)
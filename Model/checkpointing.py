@@ -0,0 +1,164 @@
+import os
+import glob
+import itertools
+import random
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Sampler
+
+# ---------------------------------------------------
+# Section 1: RNG State
+# ---------------------------------------------------
+def capture_rng_state():
+    """
+    Python, NumPy and torch (CPU and CUDA) generator states, so a resumed run draws the
+    same shuffles, pairs and augmentations as an uninterrupted one.
+    """
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def restore_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+# ---------------------------------------------------
+# Section 2: Asynchronous, Atomic, Rotated Checkpoints
+# ---------------------------------------------------
+def snapshot(obj):
+    """
+    Copies every tensor in a nested state dict to the CPU, so training can keep updating the
+    originals while the copy is written in the background.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: snapshot(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(value) for value in obj)
+    return obj
+
+
+def atomic_save(obj, path):
+    # Write next to the target and rename, so a crash never leaves a truncated checkpoint
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class CheckpointManager:
+    def __init__(self, checkpoint_dir, keep_last=3):
+        """
+        Writes full training-state checkpoints from a background thread.
+        Args:
+        - checkpoint_dir (str): Directory of checkpoint-epochXXXX-stepXXXXXX.pt files.
+        - keep_last (int): Number of most recent checkpoints kept (at least 1); older ones are deleted.
+        """
+        if keep_last < 1:
+            raise ValueError(f"keep_last must be at least 1 to be able to resume, got {keep_last}")
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_last = keep_last
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        # One writer thread: saves happen in order and at most one is in flight
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    def _write(self, state, path):
+        atomic_save(state, path)
+        for old_path in self.checkpoints()[:-self.keep_last]:
+            os.remove(old_path)
+
+    def save(self, state, epoch, step):
+        """
+        Snapshots `state` now and writes it in the background.
+        Waits for the previous write first, so at most one extra copy of the state is held in memory.
+        """
+        self.wait()
+        path = os.path.join(self.checkpoint_dir, f"checkpoint-epoch{epoch:04d}-step{step:06d}.pt")
+        self._pending = self._executor.submit(self._write, snapshot(state), path)
+
+    def save_weights(self, state_dict, path):
+        """
+        Writes a plain state dict (e.g. ./best_model.pth) the same way: snapshot now, write in the background.
+        """
+        self.wait()
+        self._pending = self._executor.submit(atomic_save, snapshot(state_dict), path)
+
+    def wait(self):
+        # Re-raises any error from the background write
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def checkpoints(self):
+        # Zero-padded names sort chronologically
+        return sorted(glob.glob(os.path.join(self.checkpoint_dir, "checkpoint-epoch*-step*.pt")))
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def load_latest(self, map_location="cpu"):
+        """
+        Returns the newest checkpoint's state, or None if there is none.
+        """
+        self.wait()
+        path = self.latest()
+        if path is None:
+            return None
+        print(f"Resuming from {path}")
+        return torch.load(path, map_location=map_location, weights_only=False)
+
+# ---------------------------------------------------
+# Section 3: Resuming Mid-Epoch
+# ---------------------------------------------------
+class SkipBatchSampler(Sampler):
+    def __init__(self, batch_sampler, skip_batches, rng_state=None):
+        """
+        Yields the batches of `batch_sampler` after the first `skip_batches`. Only indices are
+        drawn for the skipped batches, so nothing is loaded or decoded for them.
+        Args:
+        - rng_state (dict): Optional capture_rng_state() result restored once the skipped batches
+          are drawn, i.e. just before the first remaining batch is loaded.
+        """
+        self.batch_sampler = batch_sampler
+        self.skip_batches = skip_batches
+        self.rng_state = rng_state
+
+    def __iter__(self):
+        batches = iter(self.batch_sampler)
+        for _ in itertools.islice(batches, self.skip_batches):
+            pass
+        if self.rng_state is not None:
+            restore_rng_state(self.rng_state)
+        yield from batches
+
+    def __len__(self):
+        return max(0, len(self.batch_sampler) - self.skip_batches)
+
+
+def resume_loader(loader, skip_batches, rng_state=None):
+    """
+    Copy of `loader` that starts at batch skip_batches + 1 of the epoch its sampler is set to.
+    Iterate it with the RNG state the original loader was iterated with: it draws the same
+    shuffle and worker seeds in the same order, so the remaining batches come in the same order.
+    `rng_state` (the state after the last trained batch) is then restored before the next batch
+    is loaded.
+    That restores the main process's RNG only. With num_workers > 0 the remaining batches go to
+    different workers than in the uninterrupted run, so randomness drawn in the workers (e.g.
+    augmentation in the collate function) only matches if it is seeded per batch, as
+    augmentation.AugmentingCollate(seed=...) is once set_epoch(epoch, skip_batches) is called.
+    """
+    options = {}
+    if loader.num_workers:
+        options = {"prefetch_factor": loader.prefetch_factor, "persistent_workers": loader.persistent_workers,
+                   "multiprocessing_context": loader.multiprocessing_context}
+    return DataLoader(loader.dataset, batch_sampler=SkipBatchSampler(loader.batch_sampler, skip_batches, rng_state),
+                      num_workers=loader.num_workers, collate_fn=loader.collate_fn, pin_memory=loader.pin_memory,
+                      timeout=loader.timeout, worker_init_fn=loader.worker_init_fn, generator=loader.generator, **options)
@@ -1,23 +1,151 @@
 from pydub import AudioSegment
 import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from hashing import file_hash
+from vad import SEGMENTS_FILE, detect_speech, load_segments, save_segments
 
-# Directory for downloaded audio files
-audio_dir = 'data/downloaded_audio/'
-# Directory for the converted files
-wav_dir = 'data/converted_audio/'
-os.makedirs(wav_dir, exist_ok=True)
+# {"<clip>.wav": {"source_hash": ..., "options": ...}} for every clip converted so far
+CONVERSIONS_FILE = "conversions.json"
 
-# Convert each .mp3 file to .wav at 16 kHz
-for mp3_file in os.listdir(audio_dir):
-    if mp3_file.endswith('.mp3'):
+# ---------------------------------------------------
+# Section 1: Converting One File
+# ---------------------------------------------------
+def convert_file(mp3_file_path, wav_file_path, sample_rate=16000, channels=None, target_dbfs=None):
+    """
+    Decodes one MP3, optionally resamples/downmixes/normalizes it, and writes it as .wav.
+    Runs inside a worker process.
+    Args:
+    - mp3_file_path (str): Source .mp3 file.
+    - wav_file_path (str): Destination .wav file.
+    - sample_rate (int): Output frame rate.
+    - channels (int): Output channel count (1 downmixes); None keeps the source layout.
+    - target_dbfs (float): Apply gain so the clip's average loudness is this many dBFS; None leaves it.
+
+    Returns:
+    - segment (tuple): (start, end) offsets of the speech in the clip, in samples at `sample_rate`.
+    - source_hash (str): Content hash of the MP3, recorded for incremental rebuilds.
+    """
+    # Load the MP3 file
+    audio = AudioSegment.from_mp3(mp3_file_path)
+
+    # Set frame rate to 16 kHz (plus the optional layout and loudness changes) and export as .wav
+    audio = audio.set_frame_rate(sample_rate)
+    if channels is not None:
+        audio = audio.set_channels(channels)
+    if target_dbfs is not None and audio.dBFS != float("-inf"):
+        audio = audio.apply_gain(target_dbfs - audio.dBFS)
+
+    # Export under a temporary name so an interrupted run never leaves a truncated .wav behind
+    tmp_path = f"{wav_file_path}.{os.getpid()}.tmp"
+    audio.export(tmp_path, format='wav')
+    os.replace(tmp_path, wav_file_path)
+
+    # Record where the speech is while the samples are already decoded
+    mono = audio.set_channels(1)
+    samples = np.array(mono.get_array_of_samples(), dtype=np.float32) / (1 << (8 * mono.sample_width - 1))
+    return detect_speech(samples, sample_rate), file_hash(mp3_file_path)
+
+# ---------------------------------------------------
+# Section 2: Incremental Conversion of a Directory
+# ---------------------------------------------------
+def is_up_to_date(mp3_file_path, wav_file_path, record, options):
+    """
+    A clip is skipped when its .wav is newer than the .mp3, or when the .mp3 was touched
+    (e.g. re-downloaded) but its content hash matches the one it was converted from.
+    A change of conversion options always forces a rebuild.
+    """
+    if record is None or record.get("options") != options or not os.path.exists(wav_file_path):
+        return False
+    if os.path.getmtime(wav_file_path) >= os.path.getmtime(mp3_file_path):
+        return True
+    if record.get("source_hash") == file_hash(mp3_file_path):
+        # Bump the .wav so the next run takes the cheap mtime path again
+        os.utime(wav_file_path)
+        return True
+    return False
+
+
+def convert_directory(audio_dir, wav_dir, sample_rate=16000, channels=None, target_dbfs=None, workers=None, force=False):
+    """
+    Converts every .mp3 in audio_dir across a process pool, redoing only changed files.
+    Args:
+    - audio_dir (str): Directory of downloaded .mp3 files.
+    - wav_dir (str): Output directory; also holds the speech offsets and the conversion record.
+    - sample_rate, channels, target_dbfs: See convert_file.
+    - workers (int): Worker processes (None uses every core).
+    - force (bool): Reconvert everything.
+
+    Returns:
+    - converted (list): Names of the .wav files written in this run.
+    """
+    os.makedirs(wav_dir, exist_ok=True)
+    options = {"sample_rate": sample_rate, "channels": channels, "target_dbfs": target_dbfs}
+
+    # Speech start/end offsets of every converted clip, used to skip leading/trailing silence
+    segments_path = os.path.join(wav_dir, SEGMENTS_FILE)
+    segments = load_segments(segments_path, sample_rate)
+    conversions_path = os.path.join(wav_dir, CONVERSIONS_FILE)
+    conversions = {}
+    if os.path.exists(conversions_path):
+        with open(conversions_path) as f:
+            conversions = json.load(f)
+
+    jobs = {}
+    for mp3_file in sorted(os.listdir(audio_dir)):
+        if not mp3_file.endswith('.mp3'):
+            continue
         mp3_file_path = os.path.join(audio_dir, mp3_file)
-        wav_file_path = os.path.join(wav_dir, f"{os.path.splitext(mp3_file)[0]}.wav")
-        
-        # Load the MP3 file
-        audio = AudioSegment.from_mp3(mp3_file_path)
-        
-        # Set frame rate to 16 kHz and export as .wav
-        audio = audio.set_frame_rate(16000)
-        audio.export(wav_file_path, format='wav')
-        
-        print(f"Converted: {mp3_file} to {wav_file_path} at 16 kHz")
+        wav_file = f"{os.path.splitext(mp3_file)[0]}.wav"
+        wav_file_path = os.path.join(wav_dir, wav_file)
+        if force or not is_up_to_date(mp3_file_path, wav_file_path, conversions.get(wav_file), options):
+            jobs[wav_file] = (mp3_file_path, wav_file_path)
+    print(f"{len(jobs)} of the clips in {audio_dir} need converting")
+
+    converted = []
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(convert_file, mp3_file_path, wav_file_path, sample_rate, channels, target_dbfs): wav_file
+                for wav_file, (mp3_file_path, wav_file_path) in jobs.items()
+            }
+            for future in as_completed(futures):
+                wav_file = futures[future]
+                try:
+                    segment, source_hash = future.result()
+                except Exception as e:
+                    print(f"Failed to convert {jobs[wav_file][0]}: {e}")
+                    continue
+                segments[wav_file] = segment
+                conversions[wav_file] = {"source_hash": source_hash, "options": options}
+                converted.append(wav_file)
+                print(f"Converted: {os.path.basename(jobs[wav_file][0])} to {jobs[wav_file][1]} at {sample_rate / 1000:g} kHz")
+
+    # Offsets are in --sample-rate samples; the rate is recorded so readers at 16 kHz can convert them
+    save_segments(segments_path, segments, sample_rate)
+    tmp_path = f"{conversions_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(conversions, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, conversions_path)
+    return converted
+
+# ---------------------------------------------------
+# Section 3: Main Execution Block
+# ---------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert downloaded .mp3 files to .wav, skipping up-to-date clips.")
+    # Directory for downloaded audio files
+    parser.add_argument("--audio-dir", default='data/downloaded_audio/')
+    # Directory for the converted files
+    parser.add_argument("--wav-dir", default='data/converted_audio/')
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    parser.add_argument("--mono", action="store_true", help="Downmix to a single channel")
+    parser.add_argument("--target-dbfs", type=float, help="Normalize loudness, e.g. -20")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--force", action="store_true", help="Reconvert every clip")
+    args = parser.parse_args()
+
+    convert_directory(args.audio_dir, args.wav_dir, sample_rate=args.sample_rate, channels=1 if args.mono else None,
+                      target_dbfs=args.target_dbfs, workers=args.workers, force=args.force)
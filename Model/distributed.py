@@ -0,0 +1,123 @@
+import os
+import random
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from bucketing import LengthBucketSampler
+
+# The trainers run as one process unless launched with torchrun, which sets RANK, WORLD_SIZE,
+# LOCAL_RANK and MASTER_ADDR/MASTER_PORT for every process:
+#   torchrun --nproc_per_node=4 siamese_train.py            (4 processes on this machine)
+#   torchrun --nnodes=2 --node_rank=<0 or 1> --master_addr=<host of node 0> --master_port=29500 \
+#            --nproc_per_node=8 main.py                     (run on each of 2 machines)
+
+# ---------------------------------------------------
+# Section 1: Process Group Helpers
+# ---------------------------------------------------
+def init_distributed(backend="gloo"):
+    """
+    Joins the process group when launched by torchrun. gloo works on CPU-only machines.
+
+    Returns:
+    - rank (int), world_size (int): (0, 1) for a plain single-process run.
+    """
+    if int(os.environ.get("WORLD_SIZE", 1)) > 1 and not dist.is_initialized():
+        dist.init_process_group(backend)
+    return get_rank(), get_world_size()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    # Only rank 0 logs and writes checkpoints
+    return get_rank() == 0
+
+
+def local_device():
+    # One GPU per local process when there are GPUs, otherwise the CPU
+    if torch.cuda.is_available():
+        return torch.device(f"cuda:{int(os.environ.get('LOCAL_RANK', 0))}")
+    return torch.device("cpu")
+
+
+def threads_per_process():
+    """
+    Splits the machine's cores between the processes launched on it, so they do not oversubscribe.
+    """
+    return max(1, (os.cpu_count() or 1) // int(os.environ.get("LOCAL_WORLD_SIZE", 1)))
+
+
+def wrap_model(model, **kwargs):
+    """
+    DistributedDataParallel when running distributed (gradients are averaged across ranks), else the model itself.
+    """
+    if not is_distributed():
+        return model
+    device = next(model.parameters()).device
+    if device.type == "cuda":
+        kwargs.setdefault("device_ids", [device.index])
+    return DistributedDataParallel(model, **kwargs)
+
+
+def unwrap_model(model):
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+def all_reduce_sum(*values):
+    """
+    Sums Python numbers across ranks (returned unchanged in a single-process run).
+    """
+    if not is_distributed():
+        return values
+    totals = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(totals)
+    return tuple(totals.tolist())
+
+
+def broadcast_object(obj, src=0):
+    """
+    Sends a picklable object from rank `src` to every rank (returned unchanged in a single-process run).
+    """
+    if not is_distributed():
+        return obj
+    objects = [obj if get_rank() == src else None]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
+
+# ---------------------------------------------------
+# Section 2: Rank-Sharded Length-Bucketed Sampler
+# ---------------------------------------------------
+class DistributedLengthBucketSampler(LengthBucketSampler):
+    def __init__(self, lengths, batch_size, num_replicas=None, rank=None, **kwargs):
+        """
+        LengthBucketSampler over this rank's share of the items. Every epoch the items are
+        shuffled with a seed shared by all ranks and dealt out round-robin, so the shards
+        are disjoint and change from epoch to epoch, like torch's DistributedSampler.
+        """
+        super().__init__(lengths, batch_size, **kwargs)
+        self.num_replicas = num_replicas or get_world_size()
+        self.rank = get_rank() if rank is None else rank
+
+    def _indices(self):
+        indices = list(range(len(self.lengths)))
+        if self.shuffle:
+            random.Random(self.seed + self.epoch).shuffle(indices)
+        # Repeat items so every rank gets the same number of batches; DDP steps must line up
+        total = -(-len(indices) // self.num_replicas) * self.num_replicas
+        indices = (indices * (-(-total // len(indices))))[:total]
+        return indices[self.rank::self.num_replicas]
@@ -1,28 +1,182 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import requests
-import os
+from requests.adapters import HTTPAdapter
+
+# Status codes worth retrying; anything else (e.g. 404) fails immediately
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MANIFEST_FILE = "manifest.json"
+
+# ---------------------------------------------------
+# Section 1: HTTP Session and Single-File Download
+# ---------------------------------------------------
+def make_session(pool_size=8):
+    """
+    One session shared by all worker threads, so connections are kept alive and reused.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def is_current(previous, url, dest_path):
+    """
+    True when `previous` is a successful manifest entry for this URL and the file on disk still
+    has its size.
+    """
+    return (
+        previous is not None
+        and previous.get("url") == url
+        and previous.get("size") is not None
+        and os.path.exists(dest_path)
+        and os.path.getsize(dest_path) == previous.get("size")
+    )
+
+
+def download_file(session, url, dest_path, previous=None, retries=3, backoff=0.5, timeout=30, chunk_size=1 << 16):
+    """
+    Streams one URL to disk, skipping it when the manifest shows the local copy is current.
+    Args:
+    - session (requests.Session): Pooled session to download with.
+    - url (str): Source URL.
+    - dest_path (str): Where to write the file.
+    - previous (dict): Manifest entry from an earlier run ({url, size, etag}), if any.
+    - retries (int): Extra attempts after a connection error or retryable status.
+    - backoff (float): First retry delay in seconds; doubles on every attempt.
+    - timeout (float): Connect/read timeout per request.
+    - chunk_size (int): Bytes written per chunk while streaming.
+
+    Returns:
+    - entry (dict): New manifest entry with "status" set to "downloaded", "unchanged" or "skipped".
+    """
+    headers = {}
+    if is_current(previous, url, dest_path):
+        # Drops the status (and any error) of the earlier run
+        previous = {key: previous.get(key) for key in ("url", "size", "etag")}
+        if not previous.get("etag"):
+            # Nothing to revalidate against; the size match is the best evidence we have
+            return dict(previous, status="skipped")
+        headers["If-None-Match"] = previous["etag"]
+
+    tmp_path = f"{dest_path}.part"
+    for attempt in range(retries + 1):
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304:
+                    return dict(previous, status="unchanged")
+                if response.status_code in RETRY_STATUSES and attempt < retries:
+                    raise requests.HTTPError(f"retryable status {response.status_code}")
+                response.raise_for_status()
+
+                # Write to a temporary file so an interrupted run never leaves a truncated .mp3
+                size = 0
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        size += len(chunk)
+                os.replace(tmp_path, dest_path)
+                return {"url": url, "size": size, "etag": response.headers.get("ETag"), "status": "downloaded"}
+        except requests.RequestException as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if attempt == retries or (isinstance(e, requests.HTTPError) and e.response is not None
+                                      and e.response.status_code not in RETRY_STATUSES):
+                raise
+            time.sleep(backoff * (2 ** attempt))
+
+# ---------------------------------------------------
+# Section 2: Parallel Download with Manifest
+# ---------------------------------------------------
+def load_manifest(manifest_path):
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def download_all(items, audio_dir, max_workers=8, session=None, manifest_path=None, **kwargs):
+    """
+    Downloads (filename, url) pairs concurrently over one pooled session.
+    Args:
+    - items (list): (filename, url) pairs, e.g. ("Across.mp3", "https://...").
+    - audio_dir (str): Output directory.
+    - max_workers (int): Concurrent downloads (and pooled connections).
+    - session (requests.Session): Optional session, e.g. pointed at a local test server.
+    - manifest_path (str): Defaults to <audio_dir>/manifest.json.
+    - kwargs: Passed to download_file (retries, backoff, timeout, ...).
+
+    Returns:
+    - manifest (dict): {filename: entry} for every file, including failures ("status": "failed").
+      A failed file that an earlier run downloaded keeps that run's url/size/etag, so the good
+      copy on disk is still reused.
+    """
+    os.makedirs(audio_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(audio_dir, MANIFEST_FILE)
+    manifest = load_manifest(manifest_path)
+    session = session or make_session(max_workers)
+
+    # Two downloads to one file would race on its .part file; keep the first URL for each name
+    urls = {}
+    for filename, url in items:
+        if urls.setdefault(filename, url) != url:
+            print(f"Skipping duplicate file name: {filename} ({url}; already downloading {urls[filename]})")
+    items = list(urls.items())
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(download_file, session, url, os.path.join(audio_dir, filename),
+                            manifest.get(filename), **kwargs): (filename, url)
+            for filename, url in items
+        }
+        for future in as_completed(futures):
+            filename, url = futures[future]
+            try:
+                entry = future.result()
+                print(f"{entry['status'].capitalize()}: {filename}")
+            except Exception as e:
+                previous = manifest.get(filename)
+                if is_current(previous, url, os.path.join(audio_dir, filename)):
+                    entry = dict(previous, status="failed", error=str(e))
+                else:
+                    entry = {"url": url, "status": "failed", "error": str(e)}
+                print(f"Failed to download: {url} ({e})")
+            manifest[filename] = entry
+
+    save_manifest(manifest_path, manifest)
+    return manifest
+
+# ---------------------------------------------------
+# Section 3: Main Execution Block
+# ---------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download the vocabulary audio listed in the CSV.")
+    parser.add_argument("--csv", default='/content/drive/My Drive/Colab_Notebooks/data/a.csv')
+    parser.add_argument("--out", default='/content/drive/My Drive/Colab_Notebooks/data/downloaded_audio/')
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=3)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv)
+
+    # Print the first few rows of the CSV to ensure it's loaded correctly
+    print(df.head())
+
+    # Save each file as .mp3 using 'enWord' as the filename
+    items = [(f"{row.enWord}.mp3", row.audioPath) for row in df.itertuples(index=False)]
+    manifest = download_all(items, args.out, max_workers=args.workers, retries=args.retries)
 
-# Update the path to the CSV file
-csv_file_path = '/content/drive/My Drive/Colab_Notebooks/data/a.csv'
-df = pd.read_csv(csv_file_path)
-
-# Print the first few rows of the CSV to ensure it's loaded correctly
-print(df.head())
-
-# Create a directory to save the audio files
-audio_dir = '/content/drive/My Drive/Colab_Notebooks/data/downloaded_audio/'
-os.makedirs(audio_dir, exist_ok=True)
-
-# Download each audio file based on 'enWord' and 'audioPath'
-for index, row in df.iterrows():
-    filename = row['enWord']  # This is the word used as the filename
-    url = row['audioPath']  # This is the URL from where the audio file is downloaded
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        # Save the file as .mp3 using 'enWord' as the filename
-        with open(os.path.join(audio_dir, f"{filename}.mp3"), 'wb') as f:
-            f.write(response.content)
-        print(f"Downloaded: {filename}.mp3")
-    else:
-        print(f"Failed to download: {url}")
+    statuses = [entry["status"] for entry in manifest.values()]
+    print({status: statuses.count(status) for status in sorted(set(statuses))})
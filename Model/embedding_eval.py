@@ -0,0 +1,154 @@
+import os
+import torch
+import torchaudio
+from torch.utils.data import DataLoader, Dataset
+from vad import detect_speech, trim_to_speech
+from hashing import file_hash
+
+# ---------------------------------------------------
+# Section 1: Dataset of Individual Test Clips
+# ---------------------------------------------------
+def file_label(audio_file):
+    """
+    Label convention used by the testers: the file name without its extension.
+    """
+    return audio_file.split('.')[0]
+
+
+class AudioClipDataset(Dataset):
+    def __init__(self, audio_dir, store=None, label_fn=file_label, target_length=160000, segments=None, detect_missing=False,
+                 files=None):
+        """
+        One item per test clip (instead of one per random pair) so every clip is embedded once.
+        Args:
+        - audio_dir (str): Directory where the test .wav files are stored.
+        - store (PackedAudioDataset): Optional store packed from audio_dir (see waveform_store.py).
+        - label_fn (callable): Maps a file name to the label used to decide same/different.
+        - target_length (int): Number of samples to pad or truncate to.
+        - segments (dict): Optional {file name: (start, end)} speech offsets from vad.py.
+        - detect_missing (bool): Crop clips without recorded offsets to the speech vad.detect_speech
+          finds, so every clip is trimmed the same way (word_index.py does this for its queries too).
+        - files (list): Optional file names in audio_dir to use instead of all of its .wav files,
+          e.g. test_set_genrator.read_manifest('test.csv').
+        """
+        self.audio_dir = audio_dir
+        self.store = store
+        self.target_length = target_length
+        self.segments = segments or {}
+        self.detect_missing = detect_missing
+        if files is not None:
+            self.audio_files = sorted(files)
+        elif store is not None:
+            self.audio_files = list(store.files)
+        else:
+            self.audio_files = sorted(f for f in os.listdir(audio_dir) if f.endswith(".wav"))
+        self.labels = [label_fn(f) for f in self.audio_files]
+
+    def __len__(self):
+        return len(self.audio_files)
+
+    def __getitem__(self, idx):
+        audio_file = self.audio_files[idx]
+        if self.store is not None:
+            return self.store.waveform(self.store.file_to_index[audio_file]), self.labels[idx]
+
+        waveform, sample_rate = torchaudio.load(os.path.join(self.audio_dir, audio_file))
+        if waveform.shape[0] > 1:
+            waveform = torch.mean(waveform, dim=0, keepdim=True)
+        segment = self.segments.get(audio_file)
+        if segment is None and self.detect_missing:
+            segment = detect_speech(waveform[0].numpy(), sample_rate)
+        waveform = trim_to_speech(waveform, segment)
+
+        original_size = waveform.size(1)
+        if original_size < self.target_length:
+            waveform = torch.nn.functional.pad(waveform, (0, self.target_length - original_size))
+        else:
+            waveform = waveform[:, :self.target_length]
+
+        return waveform, self.labels[idx]
+
+# ---------------------------------------------------
+# Section 2: Embedding Cache
+# ---------------------------------------------------
+def checkpoint_cache_key(model_path):
+    """
+    Cache key for a checkpoint: its content hash, so a checkpoint retrained in place under the
+    same path is not served the previous weights' embeddings.
+    """
+    return f"{os.path.basename(model_path)}:{file_hash(model_path)}"
+
+
+def compute_embeddings(model, dataset, device, batch_size=64, cache_path=None, cache_key=None, num_workers=0):
+    """
+    Runs model.forward_one over every clip exactly once, in large batches.
+    Args:
+    - model: SiameseNetwork (anything with forward_one).
+    - dataset (AudioClipDataset): Clips to embed.
+    - device: Device to run the model on.
+    - batch_size (int): Clips per forward pass.
+    - cache_path (str): Optional .pt file; reused when it was built for the same files and cache_key.
+    - cache_key (str): Identifies the weights, e.g. checkpoint_cache_key(model_path), so a retrained model is not served stale embeddings.
+    - num_workers (int): DataLoader workers used for decoding.
+
+    Returns:
+    - embeddings (Tensor): (N, embedding_dim) float32 tensor on the CPU.
+    """
+    if cache_path and os.path.exists(cache_path):
+        cached = torch.load(cache_path)
+        if cached["files"] == list(dataset.audio_files) and cached["cache_key"] == cache_key:
+            print(f"Loaded {len(cached['files'])} cached embeddings from {cache_path}")
+            return cached["embeddings"]
+
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    model.eval()
+    chunks = []
+    with torch.no_grad():
+        for waveforms, _ in loader:
+            chunks.append(model.forward_one(waveforms.to(device)).float().cpu())
+    embeddings = torch.cat(chunks)
+
+    if cache_path:
+        torch.save({"files": list(dataset.audio_files), "cache_key": cache_key, "embeddings": embeddings}, cache_path)
+
+    return embeddings
+
+# ---------------------------------------------------
+# Section 3: All-Pairs Distances and Metrics
+# ---------------------------------------------------
+def distance_matrix(embeddings):
+    """
+    Full N x N Euclidean distance matrix in one vectorized call.
+    """
+    return torch.cdist(embeddings, embeddings)
+
+
+def pair_distances(distances, labels, include_self=False):
+    """
+    Flattens the upper triangle of a distance matrix into pair distances and same/different labels.
+    Args:
+    - distances (Tensor): (N, N) distance matrix.
+    - labels (list): Label for each row of the matrix.
+    - include_self (bool): Keep the diagonal (a clip paired with itself). These distance-0
+      positives are trivially correct and would inflate the metrics, so they are left out by default.
+
+    Returns:
+    - pair_dists (Tensor): Distance of every pair.
+    - pair_labels (Tensor): 1 where both clips share a label, else 0.
+    """
+    # Map labels to ids so label equality is one broadcasted comparison
+    label_ids = {}
+    ids = torch.tensor([label_ids.setdefault(label, len(label_ids)) for label in labels])
+
+    rows, cols = torch.triu_indices(len(labels), len(labels), offset=0 if include_self else 1)
+    pair_dists = distances[rows, cols]
+    pair_labels = (ids[rows] == ids[cols]).long()
+    return pair_dists, pair_labels
+
+
+def pair_accuracy(pair_dists, pair_labels, threshold):
+    """
+    Fraction of pairs classified correctly as same (distance < threshold) or different.
+    """
+    predictions = (pair_dists < threshold).long()
+    return (predictions == pair_labels).float().mean().item()
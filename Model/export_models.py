@@ -0,0 +1,338 @@
+import os
+import copy
+import time
+import argparse
+import torch
+from torch import nn
+from siamese_train import MODEL_ARCHITECTURES
+
+# Produces CPU serving artifacts from the trained checkpoints:
+#   python export_models.py wav2vec2 --model-path ./trained_model --output-dir ./export
+#   python export_models.py siamese --model-path ./trained_siamese_model.pth --architecture flatten --output-dir ./export
+# Every exported graph is written to a temporary file and compared with the eager fp32 model on the
+# same inputs; it only replaces the output file if it is within the tolerances below, else it is deleted.
+PARITY_TOLERANCES = {
+    # Greedy CTC decoding only depends on the top token of each frame
+    "wav2vec2": {"min_argmax_agreement": 0.95},
+    # Pair decisions depend on the embeddings' geometry
+    "siamese": {"min_cosine": 0.98},
+}
+
+
+class ParityError(Exception):
+    pass
+
+# ---------------------------------------------------
+# Section 1: Dynamic int8 Quantization and Graph Export
+# ---------------------------------------------------
+def quantize_linear(model):
+    """
+    Returns a copy of `model` whose nn.Linear layers hold int8 weights and quantize their
+    activations on the fly. The Linear layers dominate both models' size (the flatten Siamese
+    fc1 alone is multi-GB in fp32), so this cuts memory about 4x; convolutions stay fp32.
+    Quantized kernels run on the CPU only.
+    """
+    return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model).cpu().eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def export_torchscript(module, example, path):
+    """
+    Traces `module` on `example`, freezes it (weights folded into the graph) and saves it to `path`.
+    Python control flow is recorded for the example's input kind, so trace with the input the
+    model will be served with (waveforms vs. features, no attention mask).
+
+    Returns:
+    - scripted (ScriptModule): The frozen graph, loadable with torch.jit.load.
+    """
+    with torch.inference_mode():
+        scripted = torch.jit.freeze(torch.jit.trace(module.eval(), example))
+    torch.jit.save(scripted, path)
+    return scripted
+
+
+def export_onnx(module, example, path, input_name, output_name, dynamic_axes):
+    """
+    Writes an fp32 ONNX graph for onnxruntime to `path` and a dynamically int8-quantized copy
+    next to it (".int8" inserted before the extension). Needs onnxruntime, which also runs the
+    graphs for the parity check.
+
+    Returns:
+    - paths (dict): "fp32" and "int8" -> written file.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    torch.onnx.export(module.eval(), (example,), path, input_names=[input_name], output_names=[output_name],
+                      dynamic_axes=dynamic_axes, opset_version=17, dynamo=False)
+    root, extension = os.path.splitext(path)
+    quantized_path = root + ".int8" + extension
+    quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+    return {"fp32": path, "int8": quantized_path}
+
+
+class OnnxModel:
+    def __init__(self, path):
+        """
+        Runs an ONNX graph with onnxruntime on the CPU behind the tensor -> tensor call the
+        parity check uses.
+        """
+        import onnxruntime
+        self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        return torch.from_numpy(self.session.run(None, {self.input_name: x.detach().cpu().numpy()})[0])
+
+
+def require_onnxruntime():
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        raise ImportError("--onnx needs onnxruntime to quantize the graph and check it against the eager model") from None
+
+# ---------------------------------------------------
+# Section 2: Parity and Latency Checks
+# ---------------------------------------------------
+@torch.inference_mode()
+def parity_check(reference, candidate, inputs, min_cosine=None, min_argmax_agreement=None):
+    """
+    Runs both models on the same inputs.
+    Args:
+    - reference (callable): The eager fp32 model.
+    - candidate (callable): The quantized / exported model.
+    - inputs (list): Input tensors, one model call each.
+    - min_cosine (float): Optional; raise ParityError if any row's cosine similarity is lower.
+    - min_argmax_agreement (float): Optional; raise ParityError if fewer rows agree on their top index.
+
+    Returns:
+    - report (dict): max_abs_diff, max_rel_diff (relative to the reference's largest value),
+      min_cosine (per row) and argmax_agreement (share of rows/frames with the same top index,
+      i.e. the same greedy CTC token for logits).
+    """
+    max_abs, max_rel, lowest_cosine, agree, total = 0.0, 0.0, 1.0, 0, 0
+    for x in inputs:
+        expected, actual = reference(x).float(), candidate(x).float()
+        diff = (expected - actual).abs().max().item()
+        max_abs = max(max_abs, diff)
+        max_rel = max(max_rel, diff / max(expected.abs().max().item(), 1e-12))
+        rows_expected, rows_actual = expected.reshape(-1, expected.size(-1)), actual.reshape(-1, actual.size(-1))
+        lowest_cosine = min(lowest_cosine, nn.functional.cosine_similarity(rows_expected, rows_actual, dim=-1).min().item())
+        agree += (rows_expected.argmax(-1) == rows_actual.argmax(-1)).sum().item()
+        total += rows_expected.size(0)
+    report = {"max_abs_diff": max_abs, "max_rel_diff": max_rel, "min_cosine": lowest_cosine, "argmax_agreement": agree / total}
+    failures = []
+    if min_cosine is not None and report["min_cosine"] < min_cosine:
+        failures.append(f"min_cosine {report['min_cosine']:.4g} < {min_cosine:.4g}")
+    if min_argmax_agreement is not None and report["argmax_agreement"] < min_argmax_agreement:
+        failures.append(f"argmax_agreement {report['argmax_agreement']:.4g} < {min_argmax_agreement:.4g}")
+    if failures:
+        raise ParityError(", ".join(failures))
+    return report
+
+
+@torch.inference_mode()
+def measure_latency(model, example, repeats=10, warmup=2):
+    """
+    Returns:
+    - milliseconds (float): Mean wall time of one call on `example`.
+    """
+    for _ in range(warmup):
+        model(example)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model(example)
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def report_export(name, reference, candidates, inputs, repeats=10, tolerances=None):
+    """
+    Checks every exported variant against the eager model and prints its parity, latency and
+    file size. Variants are written to a temporary path first: those within `tolerances` are
+    moved to their final path, the others are deleted.
+    Args:
+    - candidates (dict): variant name -> (model, temporary path or None, final path or None).
+    - tolerances (dict): parity_check keyword arguments, e.g. PARITY_TOLERANCES["siamese"].
+
+    Returns:
+    - written (list): Final paths of the variants that passed.
+
+    Raises:
+    - ParityError: If any variant is outside the tolerances (after the passing ones were written).
+    """
+    print(f"{name}: eager fp32 {measure_latency(reference, inputs[0], repeats):.1f} ms")
+    written, failed = [], []
+    for variant, (model, staged_path, path) in candidates.items():
+        try:
+            report = parity_check(reference, model, inputs, **(tolerances or {}))
+        except ParityError as error:
+            print(f"{name}: {variant} failed the parity check ({error})" + (f"; not writing {path}" if path else ""))
+            failed.append(variant)
+            if staged_path:
+                os.remove(staged_path)
+            continue
+        size = f", {os.path.getsize(staged_path) / 2 ** 20:.1f} MB" if staged_path else ""
+        print(f"{name}: {variant} {measure_latency(model, inputs[0], repeats):.1f} ms{size}, "
+              + ", ".join(f"{key} {value:.4g}" for key, value in report.items()))
+        if staged_path:
+            os.replace(staged_path, path)
+            written.append(path)
+            print(f"Wrote {path}")
+    if failed:
+        raise ParityError(f"{name}: {', '.join(failed)} outside the tolerances {tolerances}")
+    return written
+
+
+def staged(path):
+    # Exports are written here and only moved to `path` once they pass the parity check
+    return path + ".tmp"
+
+
+def onnx_candidates(reference, example, path, input_name, output_name, dynamic_axes):
+    """
+    Exports the fp32 and int8 ONNX graphs to temporary paths for report_export.
+    """
+    root, extension = os.path.splitext(path)
+    staged_paths = export_onnx(reference, example, root + ".tmp" + extension, input_name, output_name, dynamic_axes)
+    final_paths = {"fp32": path, "int8": root + ".int8" + extension}
+    return {f"{variant} onnx": (OnnxModel(staged_path), staged_path, final_paths[variant])
+            for variant, staged_path in staged_paths.items()}
+
+# ---------------------------------------------------
+# Section 3: Wav2Vec2 (CTC Logits)
+# ---------------------------------------------------
+class CTCLogits(nn.Module):
+    """
+    input_values -> logits, the tensor-only signature tracing and ONNX need.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_values):
+        return self.model(input_values, return_dict=False)[0]
+
+
+def export_wav2vec2(model_path='./trained_model', output_dir='./export', seconds=(1.0, 3.0), onnx=False, repeats=5,
+                    tolerances=PARITY_TOLERANCES["wav2vec2"]):
+    """
+    Writes wav2vec2_int8.pt (TorchScript, int8 Linear layers) and the processor to `output_dir`,
+    plus wav2vec2.onnx and wav2vec2.int8.onnx with onnx=True. inference_server.py serves the .pt
+    with --torchscript.
+    Args:
+    - seconds (tuple): Clip lengths the parity check runs on (the first one is traced), one at a
+      time and as one zero-padded batch, the way inference_server.py micro-batches them.
+    - tolerances (dict): parity_check limits every graph must meet to be written.
+    """
+    from inference_server import load_model
+    if onnx:
+        require_onnxruntime()
+    model, processor, _ = load_model(model_path, torch.device("cpu"))
+    os.makedirs(output_dir, exist_ok=True)
+    processor.save_pretrained(output_dir)
+
+    reference = CTCLogits(model).eval()
+    inputs = [torch.randn(1, int(s * 16000)) for s in seconds]
+    if len(inputs) > 1:
+        longest = max(x.size(1) for x in inputs)
+        inputs.append(torch.cat([nn.functional.pad(x, (0, longest - x.size(1))) for x in inputs]))
+    quantized = CTCLogits(quantize_linear(model))
+    path = os.path.join(output_dir, "wav2vec2_int8.pt")
+    candidates = {"int8 eager": (quantized, None, None),
+                  "int8 torchscript": (export_torchscript(quantized, inputs[0], staged(path)), staged(path), path)}
+    if onnx:
+        candidates.update(onnx_candidates(reference, inputs[0], os.path.join(output_dir, "wav2vec2.onnx"),
+                                          "input_values", "logits", {"input_values": {0: "batch", 1: "samples"},
+                                                                     "logits": {0: "batch", 1: "frames"}}))
+    report_export("wav2vec2", reference, candidates, inputs, repeats, tolerances)
+    return path
+
+# ---------------------------------------------------
+# Section 4: Siamese Embedding Network
+# ---------------------------------------------------
+class EmbeddingExport(nn.Module):
+    """
+    Exports a Siamese network's embedding branch: waveforms (batch, 1, samples) -> embeddings.
+    Both sides of a pair go through the same branch, so this is all a pair comparison needs.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model.forward_one(x)
+
+
+class ScriptedSiamese(nn.Module):
+    def __init__(self, path):
+        """
+        Loads an exported embedding graph behind the forward_one / forward(input1, input2)
+        interface the testers use, so it can replace the eager SiameseNetwork there.
+        """
+        super().__init__()
+        self.scripted = torch.jit.load(path, map_location="cpu")
+
+    def forward_one(self, x):
+        return self.scripted(x)
+
+    def forward(self, input1, input2):
+        return self.forward_one(input1), self.forward_one(input2)
+
+
+def export_siamese(model_path='./trained_siamese_model.pth', architecture='flatten', output_dir='./export',
+                   num_samples=160000, onnx=False, repeats=5, tolerances=PARITY_TOLERANCES["siamese"]):
+    """
+    Writes siamese_<architecture>_int8.pt (TorchScript, int8 Linear layers) to `output_dir`,
+    plus siamese_<architecture>.onnx and siamese_<architecture>.int8.onnx with onnx=True.
+    Args:
+    - num_samples (int): Clip length to trace with; the flatten architecture only accepts 160000.
+    - tolerances (dict): parity_check limits every graph must meet to be written.
+    """
+    if onnx:
+        require_onnxruntime()
+    model = MODEL_ARCHITECTURES[architecture]()
+    model.load_state_dict(torch.load(model_path, map_location="cpu"))
+    model.eval()
+    os.makedirs(output_dir, exist_ok=True)
+
+    reference = EmbeddingExport(model).eval()
+    inputs = [torch.randn(2, 1, num_samples) * 0.1 for _ in range(3)]
+    if architecture != 'flatten':
+        # The pooled encoders take any length; check a shorter clip than the traced one too
+        inputs.append(torch.randn(2, 1, num_samples // 2) * 0.1)
+    quantized = EmbeddingExport(quantize_linear(model))
+    path = os.path.join(output_dir, f"siamese_{architecture}_int8.pt")
+    candidates = {"int8 eager": (quantized, None, None),
+                  "int8 torchscript": (export_torchscript(quantized, inputs[0], staged(path)), staged(path), path)}
+    if onnx:
+        samples_axis = {} if architecture == 'flatten' else {2: "samples"}
+        candidates.update(onnx_candidates(reference, inputs[0], os.path.join(output_dir, f"siamese_{architecture}.onnx"),
+                                          "waveforms", "embeddings",
+                                          {"waveforms": {0: "batch", **samples_axis}, "embeddings": {0: "batch"}}))
+    report_export(f"siamese {architecture}", reference, candidates, inputs, repeats, tolerances)
+    return path
+
+# ---------------------------------------------------
+# Section 5: Main Execution Block
+# ---------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize, trace and parity-check the models for CPU serving.")
+    parser.add_argument("model", choices=["wav2vec2", "siamese"])
+    parser.add_argument("--model-path", help="Defaults to ./trained_model or ./trained_siamese_model.pth")
+    parser.add_argument("--architecture", choices=list(MODEL_ARCHITECTURES), default='flatten')
+    parser.add_argument("--output-dir", default='./export')
+    parser.add_argument("--onnx", action="store_true", help="Also write fp32 and int8 ONNX graphs (needs onnxruntime)")
+    parser.add_argument("--min-cosine", type=float, help="Override the parity check's minimum per-row cosine similarity")
+    parser.add_argument("--min-argmax-agreement", type=float, help="Override the minimum share of rows with the same top index")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed calls per latency measurement")
+    args = parser.parse_args()
+
+    tolerances = dict(PARITY_TOLERANCES[args.model])
+    for name in ("min_cosine", "min_argmax_agreement"):
+        if getattr(args, name) is not None:
+            tolerances[name] = getattr(args, name)
+    if args.model == "wav2vec2":
+        export_wav2vec2(args.model_path or './trained_model', args.output_dir, onnx=args.onnx, repeats=args.repeats,
+                        tolerances=tolerances)
+    else:
+        export_siamese(args.model_path or './trained_siamese_model.pth', args.architecture, args.output_dir,
+                       onnx=args.onnx, repeats=args.repeats, tolerances=tolerances)
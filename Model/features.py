@@ -0,0 +1,195 @@
+import os
+import math
+import json
+import torch
+import torchaudio
+from torch.utils.data import Dataset
+from waveform_store import load_clip
+from vad import trim_to_speech
+from hashing import file_hash
+
+# ---------------------------------------------------
+# Section 1: Feature Extractors
+# ---------------------------------------------------
+class LogMelExtractor:
+    def __init__(self, sample_rate=16000, n_mels=64, n_fft=400, hop_length=160):
+        """
+        Log-mel spectrogram with 25 ms windows and a 10 ms hop.
+        A 10 s clip becomes (n_mels, 1001) instead of 160000 raw samples.
+        """
+        self.key = f"logmel-sr{sample_rate}-m{n_mels}-f{n_fft}-h{hop_length}"
+        self.n_mels = n_mels
+        self.mel = torchaudio.transforms.MelSpectrogram(
+            sample_rate=sample_rate, n_fft=n_fft, hop_length=hop_length, n_mels=n_mels
+        )
+
+    def __call__(self, waveform):
+        # (..., time) -> (..., n_mels, frames)
+        return torch.log(self.mel(waveform) + 1e-6)
+
+    def silence_frame(self):
+        # What a frame of zero padding turns into, used to pad cached features
+        return torch.full((self.n_mels,), math.log(1e-6))
+
+
+class Wav2Vec2Normalizer:
+    def __init__(self):
+        """
+        Zero-mean, unit-variance normalization done by Wav2Vec2Processor (do_normalize=True),
+        so main.py can cache it instead of re-running the processor on every batch.
+        """
+        self.key = "wav2vec2-norm"
+
+    def __call__(self, waveform):
+        mean = waveform.mean(dim=-1, keepdim=True)
+        var = waveform.var(dim=-1, keepdim=True, unbiased=False)
+        return (waveform - mean) / torch.sqrt(var + 1e-7)
+
+# ---------------------------------------------------
+# Section 2: On-Disk Feature Cache
+# ---------------------------------------------------
+class FeatureCache:
+    def __init__(self, cache_dir, extractor, target_length=None, dtype=torch.float16, segments=None):
+        """
+        Computes features once per clip and stores them on disk keyed by content hash.
+        Args:
+        - cache_dir (str): Directory for the cached feature files.
+        - extractor: One of the extractors above (anything with `key` and `__call__`).
+        - target_length (int): Pad/truncate the waveform before extraction (None keeps the clip length).
+        - dtype (torch.dtype): Storage dtype; float16 halves the cache size.
+        - segments (dict): Optional {file name: (start, end)} speech offsets from vad.py; only
+          the voiced region is featurized.
+        """
+        self.cache_dir = cache_dir
+        self.extractor = extractor
+        self.target_length = target_length
+        self.dtype = dtype
+        self.segments = segments or {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Remembers (size, mtime) -> hash so unchanged files are not re-read just to hash them
+        self._hash_index_path = os.path.join(cache_dir, "hashes.json")
+        self._hash_index = {}
+        if os.path.exists(self._hash_index_path):
+            with open(self._hash_index_path) as f:
+                self._hash_index = json.load(f)
+        self._dirty = False
+        self._num_frames = {}  # feature path -> frame count of the features returned by get()
+
+    def _content_hash(self, audio_path):
+        stat = os.stat(audio_path)
+        entry = self._hash_index.get(os.path.abspath(audio_path))
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        digest = file_hash(audio_path)
+        self._hash_index[os.path.abspath(audio_path)] = [stat.st_size, stat.st_mtime_ns, digest]
+        self._dirty = True
+        return digest
+
+    def _feature_path(self, audio_path):
+        segment = self.segments.get(os.path.basename(audio_path))
+        crop = f"-{segment[0]}_{segment[1]}" if segment is not None else ""
+        key = f"{self._content_hash(audio_path)}-{self.extractor.key}-{self.target_length}{crop}"
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pt")
+
+    def get(self, audio_path):
+        feature_path = self._feature_path(audio_path)
+        if os.path.exists(feature_path):
+            features = torch.load(feature_path).float()
+            self._num_frames[feature_path] = features.size(-1)
+            return features
+
+        waveform, _ = load_clip(audio_path, None)
+        waveform = trim_to_speech(waveform, self.segments.get(os.path.basename(audio_path)))
+        if self.target_length is not None:
+            waveform = torch.nn.functional.pad(waveform, (0, max(0, self.target_length - waveform.size(1))))
+            waveform = waveform[:, :self.target_length]
+        with torch.no_grad():
+            features = self.extractor(waveform[0])  # Mono (time,) -> e.g. (n_mels, frames)
+
+        # Write to a temporary name first so concurrent workers never read a partial file
+        os.makedirs(os.path.dirname(feature_path), exist_ok=True)
+        tmp_path = f"{feature_path}.{os.getpid()}.tmp"
+        features = features.to(self.dtype).clone()
+        torch.save(features, tmp_path)
+        os.replace(tmp_path, feature_path)
+        self._num_frames[feature_path] = features.size(-1)
+        # Same values as a later cache hit, so training does not depend on whether the clip was cached
+        return features.float()
+
+    def num_frames(self, audio_path):
+        """
+        Frame count of the clip's features, without reading them again once get() or warm() has.
+        """
+        feature_path = self._feature_path(audio_path)
+        if feature_path not in self._num_frames:
+            self.get(audio_path)
+        return self._num_frames[feature_path]
+
+    def save_index(self):
+        if not self._dirty:
+            return
+        tmp_path = f"{self._hash_index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._hash_index, f)
+        os.replace(tmp_path, self._hash_index_path)
+        self._dirty = False
+
+    def warm(self, audio_paths):
+        """
+        Fills the cache up front (e.g. before training) and persists the hash index.
+        """
+        for audio_path in audio_paths:
+            self.get(audio_path)
+        self.save_index()
+
+# ---------------------------------------------------
+# Section 3: Dataset Reading Cached Features
+# ---------------------------------------------------
+class FeatureDataset(Dataset):
+    def __init__(self, audio_dir, labels, cache, max_frames=None, with_sample_rate=False):
+        """
+        Drop-in replacement for the waveform AudioDataset classes that returns cached features.
+        Args:
+        - audio_dir (str): Directory where the audio files are stored.
+        - labels (list): Labels; the file for each is f"{label}.wav".
+        - cache (FeatureCache): Cache the features are read from.
+        - max_frames (int): Pad/truncate the last axis so items can be stacked (None keeps it).
+        - with_sample_rate (bool): Return (features, 16000, label) like main.AudioDataset.
+        """
+        self.audio_dir = audio_dir
+        self.labels = labels
+        self.cache = cache
+        self.max_frames = max_frames
+        self.with_sample_rate = with_sample_rate
+        self._lengths = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def lengths(self):
+        # Frame counts for LengthBucketSampler (as served, so capped at max_frames), computed once
+        if self._lengths is None:
+            lengths = [self.cache.num_frames(os.path.join(self.audio_dir, f"{label}.wav")) for label in self.labels]
+            if self.max_frames is not None:
+                lengths = [min(length, self.max_frames) for length in lengths]
+            self._lengths = lengths
+        return self._lengths
+
+    def __getitem__(self, idx):
+        label = self.labels[idx]
+        features = self.cache.get(os.path.join(self.audio_dir, f"{label}.wav"))
+
+        if self.max_frames is not None:
+            num_frames = features.size(-1)
+            if num_frames < self.max_frames:
+                # Pad with silence frames so cached features match features of a zero-padded waveform
+                padding = self.cache.extractor.silence_frame().unsqueeze(-1).expand(-1, self.max_frames - num_frames)
+                features = torch.cat([features, padding], dim=-1)
+            else:
+                features = features[..., :self.max_frames]
+
+        if self.with_sample_rate:
+            return features, 16000, label
+        return features, label
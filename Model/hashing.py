@@ -0,0 +1,17 @@
+import hashlib
+
+# Kept free of torch so converter.py's pool workers can import it cheaply
+
+# ---------------------------------------------------
+# Section 1: Content Hashes
+# ---------------------------------------------------
+def file_hash(path, chunk_size=1 << 20):
+    """
+    SHA-1 of the file contents, so a re-converted clip invalidates its cached features
+    (and a changed source file or checkpoint invalidates whatever was derived from it).
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,344 @@
+import io
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+import numpy as np
+import torch
+import torchaudio
+from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+
+SAMPLE_RATE = 16000
+
+# Usage:
+#   python inference_server.py --model-path ./trained_model --port 8000
+#   curl --data-binary @Across.wav http://127.0.0.1:8000/transcribe   -> {"transcription": "ACROSS", ...}
+#   curl http://127.0.0.1:8000/stats                                  -> latency / throughput counters
+
+# ---------------------------------------------------
+# Section 1: Model, Loaded Once
+# ---------------------------------------------------
+def load_model(model_path='./trained_model', device=None):
+    """
+    Loads the fine-tuned Wav2Vec2ForCTC model (in eval mode) and its processor.
+
+    Returns:
+    - model, processor, device
+    """
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = Wav2Vec2ForCTC.from_pretrained(model_path)
+    processor = Wav2Vec2Processor.from_pretrained(model_path)
+    model.eval()
+    model.to(device)
+    return model, processor, device
+
+
+def load_waveform(data, sample_rate=SAMPLE_RATE):
+    """
+    Decodes audio file bytes (e.g. a WAV upload) to a mono float32 array at `sample_rate`.
+    """
+    waveform, source_rate = torchaudio.load(io.BytesIO(data))
+    waveform = waveform.mean(dim=0)  # Average the channels
+    if source_rate != sample_rate:
+        waveform = torchaudio.functional.resample(waveform, source_rate, sample_rate)
+    return waveform.numpy()
+
+
+class Transcriber:
+    def __init__(self, model_path='./trained_model', device=None, torchscript_path=None):
+        """
+        Greedy CTC transcription of batches of 16 kHz clips with a model loaded once.
+        Args:
+        - model_path (str): Fine-tuned model directory (or export_models.py's output directory).
+        - torchscript_path (str): Optional int8 graph written by export_models.py, run on the CPU
+          instead of the eager model; the processor still comes from model_path.
+        """
+        self.scripted = torchscript_path is not None
+        if self.scripted:
+            self.model = torch.jit.load(torchscript_path, map_location="cpu")
+            self.processor = Wav2Vec2Processor.from_pretrained(model_path)
+            self.device = torch.device("cpu")
+        else:
+            self.model, self.processor, self.device = load_model(model_path, device)
+
+    @torch.inference_mode()
+    def transcribe_batch(self, waveforms):
+        """
+        Args:
+        - waveforms (list): 1-D float arrays at 16 kHz, of any lengths.
+
+        Returns:
+        - transcriptions (list): One string per clip.
+        """
+        # The processor normalizes each clip and zero-pads the batch to its longest clip
+        inputs = self.processor(waveforms, sampling_rate=SAMPLE_RATE, return_tensors="pt", padding=True)
+        if self.scripted:
+            # The traced graph takes input_values only
+            if "attention_mask" not in inputs:
+                # Zero padding is what this model expects (its processor returns no mask)
+                logits = self.model(inputs.input_values)
+                return self.processor.batch_decode(torch.argmax(logits, dim=-1))
+            # Without the mask the padding would change the other clips' logits, so run them one at a time
+            predicted_ids = [torch.argmax(self.model(values[None, :length]), dim=-1)[0]
+                             for values, length in zip(inputs.input_values, inputs.attention_mask.sum(dim=-1).tolist())]
+            return self.processor.batch_decode(predicted_ids)
+        kwargs = {}
+        if "attention_mask" in inputs:
+            kwargs["attention_mask"] = inputs.attention_mask.to(self.device)
+        logits = self.model(input_values=inputs.input_values.to(self.device), **kwargs).logits
+        return self.processor.batch_decode(torch.argmax(logits, dim=-1))
+
+    def transcribe(self, waveform):
+        return self.transcribe_batch([waveform])[0]
+
+# ---------------------------------------------------
+# Section 2: Latency / Throughput Counters
+# ---------------------------------------------------
+class ServerStats:
+    def __init__(self, window=1000):
+        """
+        Thread-safe counters; percentiles are over the last `window` requests.
+        """
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_clips = 0
+        self.inference_seconds = 0.0
+        self.latencies = deque(maxlen=window)
+        self.queue_waits = deque(maxlen=window)
+
+    def record_batch(self, size, inference_seconds, queue_waits):
+        with self.lock:
+            self.batches += 1
+            self.batched_clips += size
+            self.inference_seconds += inference_seconds
+            self.queue_waits.extend(queue_waits)
+
+    def record_request(self, latency, ok=True):
+        with self.lock:
+            self.requests += 1
+            self.errors += not ok
+            self.latencies.append(latency)
+
+    def snapshot(self, queue_depth=0):
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            latencies = np.array(self.latencies) * 1000
+            queue_waits = np.array(self.queue_waits) * 1000
+            stats = {
+                "uptime_sec": uptime,
+                "requests": self.requests,
+                "errors": self.errors,
+                "requests_per_sec": self.requests / uptime if uptime else 0.0,
+                "batches": self.batches,
+                "mean_batch_size": self.batched_clips / self.batches if self.batches else 0.0,
+                "inference_ms_per_batch": self.inference_seconds * 1000 / self.batches if self.batches else 0.0,
+                "queue_depth": queue_depth,
+            }
+        for name, values in (("latency_ms", latencies), ("queue_wait_ms", queue_waits)):
+            if len(values):
+                stats[name] = {"mean": float(values.mean()),
+                               **{f"p{q}": float(np.percentile(values, q)) for q in (50, 95, 99)}}
+        return stats
+
+# ---------------------------------------------------
+# Section 3: Micro-Batching Queue
+# ---------------------------------------------------
+class MicroBatcher:
+    def __init__(self, transcriber, max_batch_size=8, max_wait_ms=20, stats=None):
+        """
+        Collects clips submitted from any thread and runs them through the model together.
+        A batch is run as soon as it is full, or `max_wait_ms` after its oldest clip arrived,
+        so a lone request waits at most that long and concurrent ones share a forward pass.
+        Args:
+        - transcriber: Object with transcribe_batch(list of waveforms) -> list of strings.
+        - max_batch_size (int): Clips per forward pass.
+        - max_wait_ms (float): Longest a clip waits for others to join its batch.
+        - stats (ServerStats): Optional counters to update.
+        """
+        self.transcriber = transcriber
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = stats
+        self.queue = queue.Queue()
+        self.closed = False
+        # One thread owns the model, so forward passes never compete for the CPU cores
+        self.thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, waveform):
+        """
+        Returns:
+        - future (Future): Resolves to the clip's transcription.
+        """
+        if self.closed:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self.queue.put((waveform, future, time.monotonic()))
+        return future
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Past the deadline, still take clips that are already waiting (they queued up
+                # during the previous forward pass) but do not wait for new ones
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch first, then stop
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            started = time.monotonic()
+            try:
+                transcriptions = self.transcriber.transcribe_batch([waveform for waveform, _, _ in batch])
+            except Exception as error:  # Fail this batch's requests, keep serving
+                for _, future, _ in batch:
+                    future.set_exception(error)
+                continue
+            if self.stats is not None:
+                self.stats.record_batch(len(batch), time.monotonic() - started,
+                                        [started - enqueued for _, _, enqueued in batch])
+            for (_, future, _), transcription in zip(batch, transcriptions):
+                future.set_result(transcription)
+
+    def close(self):
+        # Requests already queued are still answered
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+# ---------------------------------------------------
+# Section 4: HTTP Server
+# ---------------------------------------------------
+class InferenceHandler(BaseHTTPRequestHandler):
+    """
+    POST /transcribe  body: an audio file (WAV) -> {"transcription": ..., "latency_ms": ...}
+    GET  /stats       latency / throughput counters
+    GET  /health      {"status": "ok"}
+    """
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif path == "/stats":
+            self._send_json(200, self.server.stats.snapshot(self.server.batcher.queue.qsize()))
+        else:
+            self._send_json(404, {"error": f"unknown path {path}"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path != "/transcribe":
+            self._send_json(404, {"error": f"unknown path {path}"})
+            return
+        started = time.monotonic()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            self.server.stats.record_request(time.monotonic() - started, ok=False)
+            self._send_json(400, {"error": f"invalid Content-Length {self.headers.get('Content-Length')!r}"})
+            return
+        if not 0 < length <= self.server.max_body_bytes:
+            self.server.stats.record_request(time.monotonic() - started, ok=False)
+            self._send_json(413 if length > 0 else 400, {"error": f"expected an audio file of at most {self.server.max_body_bytes} bytes"})
+            return
+        try:
+            waveform = load_waveform(self.rfile.read(length))
+        except Exception as error:
+            self.server.stats.record_request(time.monotonic() - started, ok=False)
+            self._send_json(400, {"error": f"could not decode audio: {error}"})
+            return
+        try:
+            transcription = self.server.batcher.submit(waveform).result(timeout=self.server.request_timeout)
+        except Exception as error:
+            self.server.stats.record_request(time.monotonic() - started, ok=False)
+            self._send_json(500, {"error": str(error)})
+            return
+        latency = time.monotonic() - started
+        self.server.stats.record_request(latency)
+        self._send_json(200, {"transcription": transcription, "latency_ms": latency * 1000})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class InferenceServer(ThreadingHTTPServer):
+    # One thread per connection; they only decode audio and wait on the shared batcher
+    daemon_threads = True
+
+    def __init__(self, address, batcher, stats, max_body_bytes=10 * 1024 * 1024, request_timeout=60, verbose=False):
+        super().__init__(address, InferenceHandler)
+        self.batcher = batcher
+        self.stats = stats
+        self.max_body_bytes = max_body_bytes
+        self.request_timeout = request_timeout
+        self.verbose = verbose
+
+
+def serve(model_path='./trained_model', host="127.0.0.1", port=8000, max_batch_size=8, max_wait_ms=20, verbose=False,
+          torchscript_path=None):
+    """
+    Loads the model once and serves it until interrupted.
+    """
+    stats = ServerStats()
+    batcher = MicroBatcher(Transcriber(model_path, torchscript_path=torchscript_path), max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, stats=stats)
+    server = InferenceServer((host, port), batcher, stats, verbose=verbose)
+    print(f"Serving {model_path} on http://{host}:{server.server_address[1]} "
+          f"(batches of up to {max_batch_size}, {max_wait_ms} ms max wait)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+# ---------------------------------------------------
+# Section 5: Main Execution Block
+# ---------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP word transcription service with micro-batching.")
+    parser.add_argument("--model-path", default='./trained_model')  # Adjust to your saved model path
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=20)
+    parser.add_argument("--torchscript", help="Serve this int8 graph from export_models.py instead of the eager model")
+    parser.add_argument("--threads", type=int, help="Intra-op CPU threads for the model")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    serve(args.model_path, args.host, args.port, args.max_batch_size, args.max_wait_ms, args.verbose, args.torchscript)
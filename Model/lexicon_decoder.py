@@ -0,0 +1,207 @@
+import argparse
+import pandas as pd
+import torch
+
+# Learners always say a word from a.csv's enWord column, so instead of decoding characters
+# freely and matching strings afterwards, the CTC output is scored against that vocabulary
+# directly: every word's total probability over all CTC alignments, computed for all words at
+# once on a prefix trie (words sharing a prefix share its work) and for a whole batch of clips.
+
+# ---------------------------------------------------
+# Section 1: Vocabulary and Prefix Trie
+# ---------------------------------------------------
+def load_vocabulary(csv_path, column='enWord', max_words=None):
+    """
+    Returns:
+    - words (list): Unique words in file order (the first max_words if given).
+    """
+    words = pd.read_csv(csv_path)[column].dropna().astype(str).str.strip()
+    words = list(dict.fromkeys(word for word in words if word))
+    return words[:max_words] if max_words else words
+
+
+class LexiconTrie:
+    def __init__(self, words, token_to_id, delimiter="|", uppercase=True):
+        """
+        Prefix trie of the vocabulary over the model's character tokens. Node 0 is the root;
+        every other node is one character appended to its parent's prefix.
+        Args:
+        - words (list): Vocabulary words; spaces inside a word become the delimiter token.
+        - token_to_id (dict): The tokenizer's vocabulary (processor.tokenizer.get_vocab()).
+        - delimiter (str): Word delimiter token of the tokenizer.
+        - uppercase (bool): Case the words like the tokenizer's characters.
+        """
+        self.parents = [0]
+        self.tokens = [-1]
+        children = [{}]
+        self.terminal_nodes, self.words = [], []
+        self.skipped = []  # Words with characters the tokenizer does not know
+        for word in words:
+            text = (word.upper() if uppercase else word.lower()).replace(" ", delimiter)
+            if any(char not in token_to_id for char in text):
+                self.skipped.append(word)
+                continue
+            node = 0
+            for char in text:
+                token = token_to_id[char]
+                if token not in children[node]:
+                    children[node][token] = len(self.parents)
+                    self.parents.append(node)
+                    self.tokens.append(token)
+                    children.append({})
+                node = children[node][token]
+            if node not in self.terminal_nodes:  # Duplicates after casing keep their first spelling
+                self.terminal_nodes.append(node)
+                self.words.append(word)
+        if not self.words:
+            raise ValueError("no vocabulary word can be spelled with the tokenizer's characters")
+
+    def __len__(self):
+        return len(self.parents)
+
+# ---------------------------------------------------
+# Section 2: Batched Lexicon-Constrained CTC Scoring
+# ---------------------------------------------------
+class LexiconDecoder:
+    def __init__(self, words, token_to_id, blank_id, delimiter="|"):
+        """
+        Args:
+        - words (list): Vocabulary, e.g. load_vocabulary('a.csv').
+        - token_to_id (dict): The tokenizer's vocabulary.
+        - blank_id (int): CTC blank token id (the pad token for Wav2Vec2).
+        - delimiter (str): Word delimiter token; it may be emitted before a word and after its last
+          character, but not inside it.
+        """
+        letters = [token for token in token_to_id if len(token) == 1 and token.isalpha()]
+        self.trie = LexiconTrie(words, token_to_id, delimiter, uppercase=any(token.isupper() for token in letters))
+        self.blank_id = blank_id
+        self.delimiter_id = token_to_id.get(delimiter)
+
+        trie = self.trie
+        self.parents = torch.tensor(trie.parents)
+        self.tokens = torch.tensor(trie.tokens).clamp(min=0)
+        # A repeated character needs a blank between the two: "LL" cannot come from one run of L
+        self.repeat_of_parent = self.tokens == self.tokens[self.parents]
+        self.repeat_of_parent[0] = True
+        self.terminal_nodes = torch.tensor(trie.terminal_nodes)
+        # Where a trailing delimiter may follow: only a complete word, and once it is emitted the
+        # path cannot be extended (else "A|B" would count as an alignment of "AB" when "A" is a word)
+        self.word_end = torch.zeros(len(trie), dtype=torch.bool)
+        self.word_end[self.terminal_nodes] = True
+
+    @classmethod
+    def from_processor(cls, words, processor):
+        tokenizer = processor.tokenizer
+        return cls(words, tokenizer.get_vocab(), tokenizer.pad_token_id, tokenizer.word_delimiter_token)
+
+    @property
+    def words(self):
+        return self.trie.words
+
+    @torch.inference_mode()
+    def word_scores(self, logits, lengths=None, beam=None):
+        """
+        Args:
+        - logits (Tensor): (batch, frames, vocab) CTC logits (or log-probs).
+        - lengths (Tensor): Optional (batch,) valid frames per clip, for padded batches.
+        - beam (float): Optional; prefixes scoring more than `beam` below the clip's best prefix are
+          pruned after every frame. None keeps every prefix, i.e. the exact constrained scores.
+
+        Returns:
+        - scores (Tensor): (batch, num_words) log P(word | audio) summed over all CTC alignments.
+        """
+        log_probs = torch.log_softmax(logits.float(), dim=-1).cpu()
+        batch, frames, _ = log_probs.shape
+        lengths = torch.full((batch,), frames) if lengths is None else lengths.cpu()
+        num_nodes = len(self.trie)
+        neg_inf = torch.tensor(float("-inf"))
+
+        # Per node: log prob of having emitted its prefix, ending in a blank / in its own character /
+        # after the trailing delimiter of a complete word
+        ends_blank = torch.full((batch, num_nodes), float("-inf"))
+        ends_blank[:, 0] = 0.0
+        ends_char = torch.full((batch, num_nodes), float("-inf"))
+        ends_delimiter = torch.full((batch, num_nodes), float("-inf"))
+        for t in range(frames):
+            frame = log_probs[:, t]
+            total = torch.logaddexp(ends_blank, ends_char)
+            blank = frame[:, self.blank_id:self.blank_id + 1]
+            new_blank = total + blank
+            if self.delimiter_id is not None:
+                delimiter = frame[:, self.delimiter_id:self.delimiter_id + 1]
+                # A leading delimiter is as good as a blank before the word
+                new_blank[:, 0] = torch.logaddexp(new_blank[:, 0], total[:, 0] + delimiter[:, 0])
+                # Blanks and delimiters may follow a trailing delimiter
+                new_delimiter = torch.logaddexp(total + delimiter, ends_delimiter + torch.logaddexp(blank, delimiter))
+                new_delimiter = new_delimiter.masked_fill(~self.word_end, float("-inf"))
+            else:
+                new_delimiter = ends_delimiter
+
+            emit = frame[:, self.tokens]
+            parent_blank, parent_char = ends_blank[:, self.parents], ends_char[:, self.parents]
+            enter = torch.logaddexp(parent_blank, torch.where(self.repeat_of_parent, neg_inf, parent_char))
+            new_char = torch.logaddexp(ends_char, enter) + emit
+            new_char[:, 0] = float("-inf")  # The root has no character
+
+            if beam is not None:
+                new_total = torch.logaddexp(torch.logaddexp(new_blank, new_char), new_delimiter)
+                pruned = new_total < new_total.max(dim=1, keepdim=True).values - beam
+                new_blank = new_blank.masked_fill(pruned, float("-inf"))
+                new_char = new_char.masked_fill(pruned, float("-inf"))
+                new_delimiter = new_delimiter.masked_fill(pruned, float("-inf"))
+
+            # Clips shorter than the batch keep their final state
+            active = (t < lengths).unsqueeze(1)
+            ends_blank = torch.where(active, new_blank, ends_blank)
+            ends_char = torch.where(active, new_char, ends_char)
+            ends_delimiter = torch.where(active, new_delimiter, ends_delimiter)
+
+        return torch.logaddexp(torch.logaddexp(ends_blank, ends_char), ends_delimiter)[:, self.terminal_nodes]
+
+    def decode(self, logits, lengths=None, top_k=5, beam=None):
+        """
+        Returns:
+        - results (list): Per clip, the top_k (word, log_prob, posterior) tuples, best first.
+          posterior is the word's share of the probability over the whole vocabulary.
+        """
+        scores = self.word_scores(logits, lengths, beam)
+        posteriors = torch.softmax(scores, dim=1)
+        values, indices = scores.topk(min(top_k, scores.size(1)), dim=1)
+        # Words pruned by the beam score -inf and are left out
+        return [[(self.words[i], value, posteriors[row, i].item())
+                 for value, i in zip(row_values.tolist(), row_indices.tolist()) if value > float("-inf")]
+                for row, (row_values, row_indices) in enumerate(zip(values, indices))]
+
+# ---------------------------------------------------
+# Section 3: Main Execution Block
+# ---------------------------------------------------
+if __name__ == "__main__":
+    from inference_server import load_model, load_waveform
+
+    parser = argparse.ArgumentParser(description="Rank vocabulary words for .wav files with lexicon-constrained CTC decoding.")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--model-path", default='./trained_model')  # Adjust to your saved model path
+    parser.add_argument("--csv", default='/content/drive/My Drive/Colab_Notebooks/data/a.csv')
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--beam", type=float, help="Prune prefixes this far (in log prob) below the best")
+    args = parser.parse_args()
+
+    model, processor, device = load_model(args.model_path)
+    decoder = LexiconDecoder.from_processor(load_vocabulary(args.csv), processor)
+    if decoder.trie.skipped:
+        print(f"Skipping {len(decoder.trie.skipped)} words the tokenizer cannot spell")
+
+    waveforms = []
+    for path in args.files:
+        with open(path, "rb") as f:
+            waveforms.append(load_waveform(f.read()))
+    inputs = processor(waveforms, sampling_rate=16000, return_tensors="pt", padding=True)
+    kwargs = {}
+    if "attention_mask" in inputs:
+        kwargs["attention_mask"] = inputs.attention_mask.to(device)
+    with torch.inference_mode():
+        logits = model(input_values=inputs.input_values.to(device), **kwargs).logits
+    # Valid frames per clip: the conv feature extractor's output length of each unpadded clip
+    lengths = model._get_feat_extract_output_lengths(torch.tensor([len(w) for w in waveforms]))
+    for path, candidates in zip(args.files, decoder.decode(logits, lengths, args.top_k, args.beam)):
+        print(path + ": " + ", ".join(f"{word} ({posterior:.2f})" for word, _, posterior in candidates))
@@ -2,22 +2,50 @@ import os
 import pandas as pd
 import torch
 import torchaudio
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, DistributedSampler
 from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+from waveform_store import PackedAudioDataset
+from features import FeatureCache, FeatureDataset, Wav2Vec2Normalizer
+from bucketing import LengthBucketSampler, audio_lengths, lengths_to_mask
+from vad import SEGMENTS_FILE, load_segments, trim_to_speech
+from distributed import (DistributedLengthBucketSampler, cleanup, get_world_size, init_distributed, is_main_process,
+                         local_device, threads_per_process, unwrap_model, wrap_model)
 
 # ---------------------------------------------------
 # Section 1: Dataset Class Definition
 # ---------------------------------------------------
 class AudioDataset(Dataset):
-    def __init__(self, audio_dir, labels):
+    def __init__(self, audio_dir, labels, variable_length=False, segments=None):
         """
         Initializes the dataset with the directory of audio files and their corresponding labels.
         Args:
         - audio_dir (str): Directory where audio files are stored.
         - labels (list): List of strings corresponding to the labels for each audio file.
+        - variable_length (bool): Only truncate to 10 s instead of also padding; custom_collate_fn
+          then pads each batch to its longest clip.
+        - segments (dict): Optional {file name: (start, end)} speech offsets recorded by
+          converter.py / vad.py; each clip is cropped to its voiced region.
         """
         self.audio_dir = audio_dir
         self.labels = labels  # list of labels (strings)
+        self.variable_length = variable_length
+        self.segments = segments or {}
+        self._lengths = None
+
+    @property
+    def lengths(self):
+        """
+        Clip lengths read from the file headers, used by LengthBucketSampler.
+        """
+        if self._lengths is None:
+            paths = [os.path.join(self.audio_dir, f"{label}.wav") for label in self.labels]
+            lengths = audio_lengths(paths)
+            for i, label in enumerate(self.labels):
+                segment = self.segments.get(f"{label}.wav")
+                if segment is not None:
+                    lengths[i] = segment[1] - segment[0]
+            self._lengths = [min(length, 160000) for length in lengths]
+        return self._lengths
 
     def __len__(self):
         """
@@ -49,14 +77,18 @@ class AudioDataset(Dataset):
         if waveform.shape[0] > 1:  # More than 1 channel
             waveform = torch.mean(waveform, dim=0, keepdim=True)  # Convert to mono
 
+        # Drop leading/trailing silence if speech offsets were recorded for this clip
+        waveform = trim_to_speech(waveform, self.segments.get(f"{label}.wav"))
+
         # Pad or truncate the waveform to a fixed size (160,000 samples = 10 seconds at 16kHz)
         target_length = 160000  # Target length (for 10s of audio at 16kHz)
         original_size = waveform.size(1)
 
         if original_size < target_length:
             # Pad the waveform if it's shorter than the target length
-            padding = target_length - original_size
-            waveform = torch.nn.functional.pad(waveform, (0, padding))  # Right pad
+            if not self.variable_length:
+                padding = target_length - original_size
+                waveform = torch.nn.functional.pad(waveform, (0, padding))  # Right pad
         else:
             # Truncate the waveform if it's longer than the target length
             waveform = waveform[:, :target_length]
@@ -74,50 +106,87 @@ def custom_collate_fn(batch):
     - batch: List of samples from the dataset.
 
     Returns:
-    - waveforms_padded (Tensor): Padded audio waveforms.
+    - waveforms_padded (Tensor): (batch, max_length) audio padded to the longest clip in the batch.
     - sample_rates (tuple): Original sample rates of the audio files.
     - labels (tuple): Corresponding labels for each sample.
+    - attention_mask (Tensor): (batch, max_length), 1 on real samples and 0 on padding.
     """
     # Unpack the batch into separate lists
     waveforms, sample_rates, labels = zip(*batch)
 
+    # Drop the channel axis so pad_sequence pads along time
+    waveforms = [w.reshape(-1) for w in waveforms]
+
     # Pad the waveforms in the batch to the same length
     waveforms_padded = torch.nn.utils.rnn.pad_sequence(waveforms, batch_first=True)
+    lengths = torch.tensor([w.size(0) for w in waveforms])
+    attention_mask = lengths_to_mask(lengths, waveforms_padded.size(1)).long()
 
-    return waveforms_padded, sample_rates, labels
+    return waveforms_padded, sample_rates, labels, attention_mask
 
 # ---------------------------------------------------
 # Section 2: DataLoader Creation
 # ---------------------------------------------------
-def create_dataloader(csv_file_path, audio_dir, batch_size=4):
+def create_dataloader(csv_file_path, audio_dir, batch_size=4, packed_store_path=None, feature_cache_dir=None, variable_length=False):
     """
     Creates a DataLoader for the dataset.
     Args:
     - csv_file_path (str): Path to the CSV file containing labels.
     - audio_dir (str): Directory where the audio files are stored.
     - batch_size (int): Number of samples per batch.
+    - packed_store_path (str): Optional store written by waveform_store.py. When set,
+      waveforms are read from the memory-mapped store instead of decoding each file.
+    - feature_cache_dir (str): Optional directory where the processor's normalization of each
+      clip is cached, so train_model can skip the processor (pass prenormalized=True).
+    - variable_length (bool): Group clips of similar duration into batches with LengthBucketSampler
+      and pad each batch only to its longest clip instead of to 10 s.
+
+    When running distributed (see distributed.py) each rank loads only its shard of the clips.
 
     Returns:
     - dataloader: DataLoader object for the dataset.
     """
-    # Load labels from the CSV file
-    df = pd.read_csv(csv_file_path)
-
-    # Convert the 'enWord' column to a list of strings
-    labels = df['enWord'].tolist()
-
-    # Create the dataset
-    dataset = AudioDataset(audio_dir, labels)
+    # Written by converter.py / vad.py; missing file means no cropping
+    segments = load_segments(os.path.join(audio_dir, SEGMENTS_FILE))
+
+    if packed_store_path:
+        # Labels come from the store's index, which was packed from the same CSV
+        dataset = PackedAudioDataset(packed_store_path, with_sample_rate=True, variable_length=variable_length)
+    elif feature_cache_dir:
+        labels = pd.read_csv(csv_file_path)['enWord'].tolist()
+
+        # Normalize the padded 10 s clip once, exactly as the processor would on every batch
+        cache = FeatureCache(feature_cache_dir, Wav2Vec2Normalizer(), target_length=None if variable_length else 160000,
+                             segments=segments)
+        cache.warm(os.path.join(audio_dir, f"{label}.wav") for label in labels)
+        dataset = FeatureDataset(audio_dir, labels, cache, with_sample_rate=True)
+    else:
+        # Load labels from the CSV file
+        df = pd.read_csv(csv_file_path)
+
+        # Convert the 'enWord' column to a list of strings
+        labels = df['enWord'].tolist()
+
+        # Create the dataset
+        dataset = AudioDataset(audio_dir, labels, variable_length=variable_length, segments=segments)
 
     # Create a DataLoader with the custom collate function
-    dataloader = DataLoader(dataset, batch_size=batch_size, collate_fn=custom_collate_fn, shuffle=True)
+    distributed = get_world_size() > 1
+    if variable_length:
+        bucket_sampler = DistributedLengthBucketSampler if distributed else LengthBucketSampler
+        sampler = bucket_sampler(dataset.lengths, batch_size=batch_size)
+        dataloader = DataLoader(dataset, batch_sampler=sampler, collate_fn=custom_collate_fn)
+    elif distributed:
+        dataloader = DataLoader(dataset, batch_size=batch_size, collate_fn=custom_collate_fn, sampler=DistributedSampler(dataset))
+    else:
+        dataloader = DataLoader(dataset, batch_size=batch_size, collate_fn=custom_collate_fn, shuffle=True)
     
     return dataloader
 
 # ---------------------------------------------------
 # Section 3: Training Loop
 # ---------------------------------------------------
-def train_model(dataloader, processor, model, device, num_epochs=3, learning_rate=1e-5):
+def train_model(dataloader, processor, model, device, num_epochs=3, learning_rate=1e-5, prenormalized=False):
     """
     Trains the Wav2Vec2 model on the provided dataset.
     Args:
@@ -127,6 +196,10 @@ def train_model(dataloader, processor, model, device, num_epochs=3, learning_rat
     - device: Device to perform training (CPU or GPU).
     - num_epochs (int): Number of epochs to train.
     - learning_rate (float): Learning rate for the optimizer.
+    - prenormalized (bool): The dataloader already yields normalized input values
+      (create_dataloader with feature_cache_dir), so the processor is not re-run.
+
+    The model may be wrapped with distributed.wrap_model; only rank 0 then prints losses.
     """
     # Define the optimizer
     optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
@@ -134,24 +207,38 @@ def train_model(dataloader, processor, model, device, num_epochs=3, learning_rat
     # Set model to training mode
     model.train()
 
+    # wav2vec2-base style checkpoints are trained without an attention mask and expect plain zero padding
+    use_attention_mask = processor.feature_extractor.return_attention_mask
+
     # Training loop
     for epoch in range(num_epochs):
+        # Length-bucketed batches (and distributed shards) are reshuffled every epoch
+        for sampler in (dataloader.batch_sampler, dataloader.sampler):
+            if hasattr(sampler, "set_epoch"):
+                sampler.set_epoch(epoch)
+
         for batch in dataloader:
             # Unpack the batch
-            waveforms, sample_rates, labels = batch
-
-            # Move the waveforms to the appropriate device
-            waveforms = waveforms.to(device)
+            waveforms, sample_rates, labels, attention_mask = batch
 
-            # Tokenize the inputs (convert raw audio waveforms to model-compatible format)
-            inputs = processor(waveforms.squeeze().numpy(), sampling_rate=16000, return_tensors="pt", padding=True).input_values.to(device)
+            if prenormalized:
+                # Cached input values are already normalized per clip
+                inputs = waveforms.to(device)
+            else:
+                # Tokenize the inputs (convert raw audio waveforms to model-compatible format).
+                # Passing the unpadded clips lets the processor normalize each one over its real samples only.
+                clips = [w[:int(n)].numpy() for w, n in zip(waveforms, attention_mask.sum(dim=1))]
+                inputs = processor(clips, sampling_rate=16000, return_tensors="pt", padding=True).input_values.to(device)
 
             # Convert the labels to tokenized form (this may need adjustment based on label format)
             with processor.as_target_processor():
                 labels = processor(labels, return_tensors="pt", padding=True).input_ids.to(device)
 
             # Forward pass
-            outputs = model(input_values=inputs, labels=labels)
+            if use_attention_mask:
+                outputs = model(input_values=inputs, attention_mask=attention_mask.to(device), labels=labels)
+            else:
+                outputs = model(input_values=inputs, labels=labels)
             loss = outputs.loss
 
             # Backward pass and optimization
@@ -160,7 +247,8 @@ def train_model(dataloader, processor, model, device, num_epochs=3, learning_rat
             optimizer.step()        # Update model weights
 
             # Print loss for this batch
-            print(f"Epoch: {epoch + 1}, Loss: {loss.item()}")
+            if is_main_process():
+                print(f"Epoch: {epoch + 1}, Loss: {loss.item()}")
 
 # ---------------------------------------------------
 # Section 4: Main Function (Setup and Execution)
@@ -169,21 +257,35 @@ if __name__ == "__main__":
     # Paths to CSV file and audio directory
     csv_file_path = '/content/drive/My Drive/Colab_Notebooks/data/a.csv'  # Update as needed
     audio_dir = '/content/drive/My Drive/Colab_Notebooks/data/converted_audio/'  # Update as needed
+    packed_store_path = None  # Optional store built with waveform_store.py
+    feature_cache_dir = None  # Optional cache of normalized input values, e.g. '.../data/feature_cache/'
+    variable_length = True  # Bucket clips by duration instead of padding everything to 10 s
+
+    # Joins the process group when launched with torchrun (see distributed.py); otherwise a single process
+    rank, world_size = init_distributed(backend="gloo")
+    if world_size > 1:
+        torch.set_num_threads(threads_per_process())
 
     # Create DataLoader
-    dataloader = create_dataloader(csv_file_path, audio_dir, batch_size=4)
+    dataloader = create_dataloader(csv_file_path, audio_dir, batch_size=4, packed_store_path=packed_store_path,
+                                   feature_cache_dir=feature_cache_dir, variable_length=variable_length)
 
     # Load the pre-trained Wav2Vec2Processor and Wav2Vec2ForCTC model
     processor = Wav2Vec2Processor.from_pretrained("facebook/wav2vec2-base-960h")
     model = Wav2Vec2ForCTC.from_pretrained("facebook/wav2vec2-base-960h")
 
     # Move the model to the appropriate device (GPU if available, otherwise CPU)
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    device = local_device()
     model.to(device)
+    # Parts of Wav2Vec2 (e.g. the masked-time embedding) can go unused in a step, so DDP must look for them
+    model = wrap_model(model, find_unused_parameters=True)
 
     # Train the model
-    train_model(dataloader, processor, model, device, num_epochs=3, learning_rate=1e-5)
+    train_model(dataloader, processor, model, device, num_epochs=3, learning_rate=1e-5,
+                prenormalized=feature_cache_dir is not None and packed_store_path is None)
 
     # Save the trained model and processor
-    model.save_pretrained('./trained_model')
-    processor.save_pretrained('./trained_model')
+    if is_main_process():
+        unwrap_model(model).save_pretrained('./trained_model')
+        processor.save_pretrained('./trained_model')
+    cleanup()
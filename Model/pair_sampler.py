@@ -0,0 +1,121 @@
+import random
+from collections import defaultdict
+import torch
+from torch.utils.data import DataLoader
+from augmentor import source_word
+from bucketing import pad_collate
+from word_index import WordIndex
+
+# ---------------------------------------------------
+# Section 1: Embedding a Training Dataset
+# ---------------------------------------------------
+def embed_dataset(model, dataset, device, batch_size=64):
+    """
+    Embeds every item of a (waveform, label) dataset with model.embed.
+    Works for fixed- and variable-length datasets; lengths are only passed to the model
+    when a batch actually contains padding.
+
+    Returns:
+    - embeddings (Tensor): (N, embedding_dim) float32 tensor on the CPU.
+    """
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, collate_fn=pad_collate)
+    chunks = []
+    for waveforms, _, lengths in loader:
+        lengths = None if lengths.min() == lengths.max() else lengths.to(device)
+        chunks.append(model.embed(waveforms.to(device), lengths).float().cpu())
+    return torch.cat(chunks)
+
+# ---------------------------------------------------
+# Section 2: O(N) Pair / Triplet Sampler with Hard Negatives
+# ---------------------------------------------------
+class PairSampler:
+    def __init__(self, labels, word_fn=source_word, hard_fraction=0.5, num_candidates=10, refresh_every=1, seed=0):
+        """
+        Draws one (anchor, positive, negative) triplet per clip in O(N).
+        Args:
+        - labels (list): Clip labels of the dataset, e.g. "Across_noisy" for augmented clips.
+        - word_fn (callable): Maps a label to its word; clips of the same word are positives.
+        - hard_fraction (float): Share of negatives taken from the anchor's nearest other-word
+          clips once embeddings have been mined (see refresh); the rest are uniform.
+        - num_candidates (int): Nearest other-word clips kept per anchor as hard negatives.
+        - refresh_every (int): Re-mine hard negatives every this many epochs (0 disables mining).
+        - seed (int): Base seed, combined with the epoch.
+        """
+        self.labels = list(labels)
+        self.words = [word_fn(label) for label in self.labels]
+        self.hard_fraction = hard_fraction
+        self.num_candidates = num_candidates
+        self.refresh_every = refresh_every
+        self.seed = seed
+
+        # word -> clip positions, built in one pass
+        self.word_to_indices = defaultdict(list)
+        for idx, word in enumerate(self.words):
+            self.word_to_indices[word].append(idx)
+        single = sum(1 for indices in self.word_to_indices.values() if len(indices) == 1)
+        if single:
+            print(f"Warning: {single} of {len(self.word_to_indices)} words have a single clip; their positive "
+                  "pairs repeat the anchor (train on augmentor.py's variants to get real positives)")
+        self.hard_negatives = None  # anchor position -> candidate positions, after refresh()
+
+    def should_refresh(self, epoch):
+        # The first epoch uses uniform negatives; an untrained model's neighbours are noise
+        return self.refresh_every > 0 and self.hard_fraction > 0 and epoch > 0 and epoch % self.refresh_every == 0
+
+    def refresh(self, model, dataset, device, batch_size=64, num_lists=0):
+        """
+        Embeds the dataset with the current model and keeps, for every clip, its nearest
+        clips of other words. num_lists > 0 uses an IVF index for large vocabularies.
+        """
+        index = WordIndex(embed_dataset(model, dataset, device, batch_size), list(range(len(self.labels))))
+        if num_lists:
+            index.build_ivf(num_lists)
+
+        # Extra neighbours cover the anchor's own variants, which are skipped
+        k = self.num_candidates + max(len(indices) for indices in self.word_to_indices.values())
+        self.hard_negatives = []
+        for start in range(0, len(self.labels), 1024):
+            _, rows = index.search(index.embeddings[start:start + 1024], k=k)
+            for anchor, neighbours in enumerate(rows.tolist(), start):
+                candidates = [index.labels[row] for row in neighbours if row >= 0]
+                candidates = [c for c in candidates if self.words[c] != self.words[anchor]]
+                self.hard_negatives.append(candidates[:self.num_candidates])
+
+    def _negative(self, anchor, rng):
+        candidates = self.hard_negatives[anchor] if self.hard_negatives is not None else None
+        if candidates and rng.random() < self.hard_fraction:
+            return rng.choice(candidates)
+        # Rejection sampling: expected O(1) draws unless one word dominates the dataset
+        for _ in range(100):
+            negative = rng.randrange(len(self.labels))
+            if self.words[negative] != self.words[anchor]:
+                return negative
+        raise ValueError("need clips of at least two different words to draw negatives")
+
+    def triplets(self, epoch=0):
+        """
+        Returns:
+        - triplets (list): (anchor, positive, negative) labels, one per clip. The positive is
+          another clip of the same word when there is one, else the anchor itself.
+        """
+        rng = random.Random(self.seed + epoch)
+        triplets = []
+        for anchor, word in enumerate(self.words):
+            variants = self.word_to_indices[word]
+            positive = anchor
+            if len(variants) > 1:
+                while positive == anchor:
+                    positive = rng.choice(variants)
+            negative = self._negative(anchor, rng)
+            triplets.append((self.labels[anchor], self.labels[positive], self.labels[negative]))
+        return triplets
+
+    def pairs(self, epoch=0):
+        """
+        One positive and one negative pair per clip, in create_pairs order.
+        """
+        pairs = []
+        for anchor, positive, negative in self.triplets(epoch):
+            pairs.append((anchor, positive))
+            pairs.append((anchor, negative))
+        return pairs
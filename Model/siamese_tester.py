@@ -146,15 +146,29 @@ import random
 import torch
 import torchaudio
 from torch.utils.data import DataLoader, Dataset
-from torch import nn
+from waveform_store import PackedAudioDataset
+from siamese_train import MODEL_ARCHITECTURES
+from vad import SEGMENTS_FILE, load_segments
+from augmentor import source_word
+from test_set_genrator import read_manifest
+from export_models import ScriptedSiamese
+from embedding_eval import AudioClipDataset, checkpoint_cache_key, compute_embeddings, distance_matrix, pair_distances, pair_accuracy
 
 # ---------------------------------------------------
 # Section 1: Dataset Class Definition for Test Set (Returns Pairs)
 # ---------------------------------------------------
 class AudioTestDataset(Dataset):
-    def __init__(self, audio_dir):
+    def __init__(self, audio_dir, store=None, files=None):
         self.audio_dir = audio_dir
-        self.audio_files = [f for f in os.listdir(audio_dir) if f.endswith(".wav")]
+        # Optional PackedAudioDataset packed from this directory (see waveform_store.py)
+        self.store = store
+        # Optional file names from a test_set_genrator.py manifest instead of the whole directory
+        if files is not None:
+            self.audio_files = list(files)
+        elif store is not None:
+            self.audio_files = list(store.files)
+        else:
+            self.audio_files = [f for f in os.listdir(audio_dir) if f.endswith(".wav")]
 
     def __len__(self):
         return len(self.audio_files)
@@ -173,6 +187,12 @@ class AudioTestDataset(Dataset):
         audio_path1 = os.path.join(self.audio_dir, audio_file1)
         audio_path2 = os.path.join(self.audio_dir, audio_file2)
 
+        # Packed clips are already mono and fixed-length
+        if self.store is not None:
+            waveform1 = self.store.waveform(self.store.file_to_index[audio_file1])
+            waveform2 = self.store.waveform(self.store.file_to_index[audio_file2])
+            return waveform1, waveform2, label
+
         waveform1, sample_rate1 = torchaudio.load(audio_path1)
         waveform2, sample_rate2 = torchaudio.load(audio_path2)
 
@@ -199,40 +219,7 @@ class AudioTestDataset(Dataset):
         return waveform
 
 # ---------------------------------------------------
-# Section 2: Siamese Network Definition
-# ---------------------------------------------------
-class SiameseNetwork(nn.Module):
-    def __init__(self):
-        super(SiameseNetwork, self).__init__()
-        self.conv1 = nn.Conv1d(1, 32, kernel_size=5)
-        self.pool = nn.MaxPool1d(2)
-        self.conv2 = nn.Conv1d(32, 64, kernel_size=5)
-
-        self.fc1_input_size = self._get_fc1_input_size()
-        self.fc1 = nn.Linear(self.fc1_input_size, 256)
-        self.fc2 = nn.Linear(256, 128)
-
-    def _get_fc1_input_size(self):
-        x = torch.zeros(1, 1, 160000)
-        x = self.pool(nn.functional.relu(self.conv1(x)))
-        x = self.pool(nn.functional.relu(self.conv2(x)))
-        return x.numel()
-
-    def forward_one(self, x):
-        x = self.pool(nn.functional.relu(self.conv1(x)))
-        x = self.pool(nn.functional.relu(self.conv2(x)))
-        x = x.view(x.size(0), -1)
-        x = nn.functional.relu(self.fc1(x))
-        x = self.fc2(x)
-        return x
-
-    def forward(self, input1, input2):
-        output1 = self.forward_one(input1)
-        output2 = self.forward_one(input2)
-        return output1, output2
-
-# ---------------------------------------------------
-# Section 3: Testing the Model on the Test Set
+# Section 2: Testing the Model on the Test Set
 # ---------------------------------------------------
 def test_model(test_loader, model, device):
     model.eval()
@@ -268,23 +255,57 @@ def test_model(test_loader, model, device):
     accuracy = total_correct / total_samples
     print(f"Test Accuracy: {accuracy * 100:.2f}%")
 
+def test_model_all_pairs(clip_dataset, model, device, threshold=0.0225, batch_size=64, cache_path=None, cache_key=None):
+    # Embed every clip once, then score every pair of different clips from a single distance matrix
+    embeddings = compute_embeddings(model, clip_dataset, device, batch_size=batch_size,
+                                    cache_path=cache_path, cache_key=cache_key)
+    distances = distance_matrix(embeddings)
+    pair_dists, pair_labels = pair_distances(distances, clip_dataset.labels, include_self=False)
+
+    accuracy = pair_accuracy(pair_dists, pair_labels, threshold)
+    print(f"Clips: {len(clip_dataset)}, Pairs: {pair_labels.numel()}, Positive pairs: {pair_labels.sum().item()}")
+    print(f"Test Accuracy: {accuracy * 100:.2f}%")
+    return accuracy
+
 # ---------------------------------------------------
-# Section 4: Main Execution Block
+# Section 3: Main Execution Block
 # ---------------------------------------------------
 if __name__ == "__main__":
     test_audio_dir = '/content/drive/My Drive/Colab_Notebooks/data/test_set/'  # Update to your test set path
-
-    # Create test dataset and loader
-    test_dataset = AudioTestDataset(test_audio_dir)
-    test_loader = DataLoader(test_dataset, batch_size=2, shuffle=False)
+    packed_store_path = None  # Optional store packed from test_audio_dir with waveform_store.py
+    # Or test.csv from `test_set_genrator.py --mode manifest`; test_audio_dir is then the augmented audio directory
+    test_manifest_path = None
+    model_path = './trained_siamese_model.pth'
+    # Or an int8 graph written by export_models.py, e.g. './export/siamese_flatten_int8.pt' (runs on the CPU)
+    exported_model_path = None
+    architecture = 'flatten'  # Or 'compact' / 'mel', matching the setting used in siamese_train.py
+    all_pairs = True  # Embed each clip once and score every pair; False keeps the random pair sampling
+    embedding_cache_path = './siamese_tester_embeddings.pt'  # Each tool keeps its own cache
+
+    store = PackedAudioDataset(packed_store_path) if packed_store_path else None
+    test_files = read_manifest(test_manifest_path) if test_manifest_path else None
 
     # Load the trained model
-    model = SiameseNetwork()
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-    # Load model and map to correct device
-    model.load_state_dict(torch.load('./trained_siamese_model.pth', map_location=device))
-    model.to(device)
+    if exported_model_path:
+        model = ScriptedSiamese(exported_model_path)
+        device = torch.device("cpu")
+        model_path = exported_model_path  # Keys the embedding cache
+    else:
+        model = MODEL_ARCHITECTURES[architecture]()
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+        # Load model and map to correct device
+        model.load_state_dict(torch.load(model_path, map_location=device))
+        model.to(device)
 
     # Test the model
-    test_model(test_loader, model, device)
+    if all_pairs:
+        # Speech offsets recorded with vad.py for the test clips, if any
+        segments = load_segments(os.path.join(test_audio_dir, SEGMENTS_FILE))
+        # Variants of one word (test_set_genrator.py keeps them together) count as the same label
+        clip_dataset = AudioClipDataset(test_audio_dir, store=store, label_fn=source_word, segments=segments, files=test_files)
+        test_model_all_pairs(clip_dataset, model, device, cache_path=embedding_cache_path, cache_key=checkpoint_cache_key(model_path))
+    else:
+        test_dataset = AudioTestDataset(test_audio_dir, store=store, files=test_files)
+        test_loader = DataLoader(test_dataset, batch_size=2, shuffle=False)
+        test_model(test_loader, model, device)
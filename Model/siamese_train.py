@@ -208,7 +208,6 @@
 # from torch import nn, optim
 # import random
 # from torch.cuda.amp import GradScaler, autocast  # Mixed precision imports
-
 # # ---------------------------------------------------
 # # Section 1: Dataset Class Definition
 # # ---------------------------------------------------
@@ -392,25 +391,58 @@
 ################################################################################################################
 
 import os
+import time
+import argparse
 import pandas as pd
 import torch
 import torchaudio
-from torch.utils.data import DataLoader, Dataset, random_split
+from torch.utils.data import DataLoader, Dataset, DistributedSampler, Subset
 from torch import nn, optim
+from torch.utils.checkpoint import checkpoint
 import random
-from torch.cuda.amp import GradScaler, autocast  # Mixed precision imports
+from collections import OrderedDict
+from waveform_store import PackedAudioDataset
+from features import LogMelExtractor, FeatureCache, FeatureDataset
+from bucketing import LengthBucketSampler, audio_lengths, lengths_to_mask, pair_pad_collate
+from vad import SEGMENTS_FILE, load_segments, trim_to_speech
+from augmentation import AugmentingCollate, BatchAugmenter
+from augmentor import source_word
+from pair_sampler import PairSampler
+from test_set_genrator import word_split
+from distributed import (DistributedLengthBucketSampler, all_reduce_sum, broadcast_object, cleanup, init_distributed, is_main_process,
+                         local_device, threads_per_process, unwrap_model, wrap_model)
+from checkpointing import CheckpointManager, atomic_save, capture_rng_state, restore_rng_state, resume_loader
+from contextlib import nullcontext
 
 # ---------------------------------------------------
 # Section 1: Dataset Class Definition
 # ---------------------------------------------------
 class AudioDataset(Dataset):
-    def __init__(self, audio_dir, labels):
+    def __init__(self, audio_dir, labels, variable_length=False, segments=None):
         self.audio_dir = audio_dir
         self.labels = labels
+        # Only truncate to 10 s instead of also padding; batches are then padded by pair_pad_collate
+        self.variable_length = variable_length
+        # Optional {file name: (start, end)} speech offsets from vad.py; clips are cropped to them
+        self.segments = segments or {}
+        self._lengths = None
 
     def __len__(self):
         return len(self.labels)
 
+    @property
+    def lengths(self):
+        # Read from the file headers once, for LengthBucketSampler
+        if self._lengths is None:
+            paths = [os.path.join(self.audio_dir, f"{label}.wav") for label in self.labels]
+            lengths = audio_lengths(paths)
+            for i, label in enumerate(self.labels):
+                segment = self.segments.get(f"{label}.wav")
+                if segment is not None:
+                    lengths[i] = segment[1] - segment[0]
+            self._lengths = [min(length, 160000) for length in lengths]
+        return self._lengths
+
     def __getitem__(self, idx):
         label = self.labels[idx]
         audio_path = os.path.join(self.audio_dir, f"{label}.wav")
@@ -420,44 +452,197 @@ class AudioDataset(Dataset):
         if waveform.shape[0] > 1:
             waveform = torch.mean(waveform, dim=0, keepdim=True)
 
+        waveform = trim_to_speech(waveform, self.segments.get(f"{label}.wav"))
+
         target_length = 160000
         original_size = waveform.size(1)
 
         if original_size < target_length:
-            padding = target_length - original_size
-            waveform = torch.nn.functional.pad(waveform, (0, padding))
+            if not self.variable_length:
+                padding = target_length - original_size
+                waveform = torch.nn.functional.pad(waveform, (0, padding))
         else:
             waveform = waveform[:, :target_length]
 
         return waveform, label
 
+# LRU cache of decoded waveforms, bounded by a byte budget
+class WaveformCache:
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        """
+        Args:
+        - max_bytes (int): Upper bound on the total size of the cached tensors.
+          With 160000-sample float32 clips (640 KB each) the default keeps ~800 words.
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, loader):
+        """
+        Returns the cached value for `key`, calling `loader()` to decode it on a miss.
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)  # Mark as most recently used
+            self.hits += 1
+            return self._entries[key]
+
+        self.misses += 1
+        waveform = loader()
+        size = waveform.element_size() * waveform.nelement()
+        if size > self.max_bytes:
+            return waveform  # Never cache something larger than the whole budget
+
+        # Evict least recently used entries until the new waveform fits
+        while self._entries and self.current_bytes + size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.element_size() * evicted.nelement()
+
+        self._entries[key] = waveform
+        self.current_bytes += size
+        return waveform
+
 # Dataset for Pairs
 class PairDataset(Dataset):
-    def __init__(self, dataset, pairs):
+    def __init__(self, dataset, pairs, cache_bytes=512 * 1024 * 1024, sampler=None, return_ids=False):
+        """
+        Args:
+        - dataset: Clip dataset with a `labels` list.
+        - pairs (list): (label1, label2) pairs.
+        - cache_bytes (int): Budget of the decoded waveform cache (0 disables it).
+        - sampler (PairSampler): Optional; pairs count as "same" when their words match
+          (augmented variants of one word), and resample_pairs draws new pairs from it.
+        - return_ids (bool): Also return an integer word id for each side, which the in-batch
+          all-pairs loss uses to compare every clip of the batch with every other one.
+        """
         self.dataset = dataset
         self.pairs = pairs
+        self.sampler = sampler
+        self.return_ids = return_ids
+        self.label_to_word = dict(zip(sampler.labels, sampler.words)) if sampler is not None else None
+        words = sampler.words if sampler is not None else dataset.labels
+        self.word_to_id = {word: i for i, word in enumerate(sorted(set(words)))}
+
+        # Dict lookup instead of a linear labels.index() scan per pair side.
+        # setdefault keeps the first occurrence, matching list.index().
+        self.label_to_index = {}
+        for idx, label in enumerate(dataset.labels):
+            self.label_to_index.setdefault(label, idx)
+
+        # Shared by both sides of every pair; each DataLoader worker gets its own copy
+        self.cache = WaveformCache(cache_bytes) if cache_bytes else None
 
     def __len__(self):
         return len(self.pairs)
 
+    def _load_waveform(self, label):
+        idx = self.label_to_index[label]
+        if self.cache is None:
+            return self.dataset[idx][0]
+        return self.cache.get(idx, lambda: self.dataset[idx][0])
+
     def __getitem__(self, idx):
         label1, label2 = self.pairs[idx]
-        waveform1, _ = self.dataset[self.dataset.labels.index(label1)]
-        waveform2, _ = self.dataset[self.dataset.labels.index(label2)]
-        return waveform1, waveform2, (label1 == label2)
+        waveform1 = self._load_waveform(label1)
+        waveform2 = self._load_waveform(label2)
+        word1, word2 = label1, label2
+        if self.label_to_word is not None:
+            word1, word2 = self.label_to_word[label1], self.label_to_word[label2]
+        if self.return_ids:
+            return waveform1, waveform2, (word1 == word2), self.word_to_id[word1], self.word_to_id[word2]
+        return waveform1, waveform2, (word1 == word2)
+
+    def resample_pairs(self, epoch, model, device):
+        """
+        Draws this epoch's pairs from the sampler, re-mining hard negatives with the
+        current model when the sampler is due for a refresh.
+        """
+        if self.sampler is None:
+            return
+        if self.sampler.should_refresh(epoch):
+            # Mined once on rank 0 and sent to the other ranks, which would all compute the same lists
+            if is_main_process():
+                clips = Subset(self.dataset, [self.label_to_index[label] for label in self.sampler.labels])
+                self.sampler.refresh(model, clips, device)
+            self.sampler.hard_negatives = broadcast_object(self.sampler.hard_negatives)
+        self.pairs = self.sampler.pairs(epoch)
+
+    def state_dict(self):
+        # This epoch's pairs and the mined hard negatives, so a resumed run continues with the same pairs
+        return {"pairs": self.pairs, "hard_negatives": self.sampler.hard_negatives if self.sampler is not None else None}
+
+    def load_state_dict(self, state):
+        self.pairs = state["pairs"]
+        if self.sampler is not None:
+            self.sampler.hard_negatives = state["hard_negatives"]
+
+    def pair_lengths(self):
+        # A pair is padded to its longer side, so that is the length to bucket by
+        clip_lengths = self.dataset.lengths
+        return [max(clip_lengths[self.label_to_index[label1]], clip_lengths[self.label_to_index[label2]])
+                for label1, label2 in self.pairs]
 
 def create_pairs(labels):
-    pairs = []
-    for label in labels:
-        pairs.append((label, label))  # Same class (positive pair)
-        different_label = random.choice([l for l in labels if l != label])
-        pairs.append((label, different_label))  # Different class (negative pair)
-    return pairs
+    # One (label, label) positive and one random negative per label, drawn in O(N)
+    # by rejection sampling instead of rebuilding the list of other labels each time
+    return PairSampler(labels, word_fn=str, refresh_every=0, seed=random.randrange(2 ** 32)).pairs()
 
 # ---------------------------------------------------
 # Section 2: Siamese Network Definition
 # ---------------------------------------------------
-class SiameseNetwork(nn.Module):
+# Shared by the encoders below, which only define forward_one
+class EmbeddingNetwork(nn.Module):
+    # Recompute the conv stack's activations during backward instead of keeping them in memory
+    checkpoint_activations = False
+
+    def _encode(self, encoder, x):
+        if self.checkpoint_activations and self.training and torch.is_grad_enabled():
+            return checkpoint(encoder, x, use_reentrant=False)
+        return encoder(x)
+
+    def forward(self, input1, input2, lengths1=None, lengths2=None):
+        """
+        Encodes both sides of the pairs in one pass: the sides are concatenated into a single
+        batch, so every conv/linear kernel launches once at twice the batch size.
+        """
+        if input1.shape[1:] != input2.shape[1:]:
+            # Sides padded to different lengths cannot share a batch
+            return self._forward_one(input1, lengths1), self._forward_one(input2, lengths2)
+        lengths = torch.cat([lengths1, lengths2]) if lengths1 is not None else None
+        output = self._forward_one(torch.cat([input1, input2]), lengths)
+        return output[:input1.size(0)], output[input1.size(0):]
+
+    def _forward_one(self, x, lengths=None):
+        return self.forward_one(x) if lengths is None else self.forward_one(x, lengths)
+
+    def embed(self, x, lengths=None):
+        """
+        Embedding-only inference: dropout off and no autograd bookkeeping.
+        Args:
+        - x (Tensor): (batch, 1, samples) waveforms, (batch, samples) or (samples,) waveforms,
+          or (batch, n_mels, frames) features for the mel encoder.
+        - lengths (Tensor): Optional (batch,) unpadded lengths for the pooled encoders.
+
+        Returns:
+        - embeddings (Tensor): (batch, embedding_dim).
+        """
+        if x.dim() == 1:
+            x = x.unsqueeze(0)
+        if x.dim() == 2:
+            x = x.unsqueeze(1)
+        was_training = self.training
+        self.eval()
+        with torch.inference_mode():
+            embeddings = self._forward_one(x, lengths)
+        self.train(was_training)
+        return embeddings
+
+class SiameseNetwork(EmbeddingNetwork):
     def __init__(self):
         super(SiameseNetwork, self).__init__()
         self.conv1 = nn.Conv1d(1, 32, kernel_size=5)
@@ -476,19 +661,115 @@ class SiameseNetwork(nn.Module):
         x = self.pool(nn.functional.relu(self.conv2(x)))
         return x.numel()
 
-    def forward_one(self, x):
+    def _conv_stack(self, x):
         x = self.pool(nn.functional.relu(self.conv1(x)))
-        x = self.pool(nn.functional.relu(self.conv2(x)))
+        return self.pool(nn.functional.relu(self.conv2(x)))
+
+    def forward_one(self, x):
+        x = self._encode(self._conv_stack, x)
         x = x.view(x.size(0), -1)
         x = nn.functional.relu(self.fc1(x))
         x = self.dropout(x)  # Apply dropout
         x = self.fc2(x)
         return x
 
-    def forward(self, input1, input2):
-        output1 = self.forward_one(input1)
-        output2 = self.forward_one(input2)
-        return output1, output2
+# Normalizes each frame over its channels. Unlike BatchNorm it does not depend on the batch size,
+# and unlike GroupNorm its statistics do not include the zero padding of variable-length batches.
+class FrameLayerNorm(nn.LayerNorm):
+    def forward(self, x):
+        return super().forward(x.transpose(1, 2)).transpose(1, 2)
+
+def attentive_stats_pool(x, attention, frame_lengths=None):
+    # (batch, channels, frames) -> (batch, 2 * channels): attention-weighted mean and std over frames
+    scores = attention(x)
+    if frame_lengths is not None:
+        # Padding frames of variable-length batches get zero weight
+        mask = lengths_to_mask(frame_lengths.clamp(min=1), x.size(2)).unsqueeze(1)
+        scores = scores.masked_fill(~mask, float("-inf"))
+    weights = torch.softmax(scores, dim=2)
+    mean = (x * weights).sum(dim=2)
+    std = ((x ** 2 * weights).sum(dim=2) - mean ** 2).clamp(min=1e-6).sqrt()
+    return torch.cat([mean, std], dim=1)
+
+# Compact encoder: strided convolutions + attentive statistics pooling.
+# fc1 above sees 64 x 39997 features (~655M weights); this network has ~0.2M parameters
+# and its output size does not depend on the clip length.
+class CompactSiameseNetwork(EmbeddingNetwork):
+    def __init__(self, embedding_dim=128):
+        super(CompactSiameseNetwork, self).__init__()
+        # Total stride 5 * 4 * 2 * 2 * 2 = 160 samples, i.e. one frame every 10 ms at 16 kHz
+        channels = [1, 32, 64, 128, 128, 128]
+        kernels = [10, 8, 4, 4, 4]
+        strides = [5, 4, 2, 2, 2]
+        layers = []
+        for i in range(len(kernels)):
+            layers += [
+                nn.Conv1d(channels[i], channels[i + 1], kernel_size=kernels[i], stride=strides[i]),
+                FrameLayerNorm(channels[i + 1]),
+                nn.ReLU(),
+            ]
+        self.encoder = nn.Sequential(*layers)
+
+        # One attention score per frame; pooled mean and std are weighted by it
+        self.attention = nn.Conv1d(channels[-1], 1, kernel_size=1)
+        self.dropout = nn.Dropout(0.5)
+        self.fc = nn.Linear(2 * channels[-1], embedding_dim)
+
+    def _frame_lengths(self, lengths):
+        # Number of valid output frames for each unpadded input length
+        for layer in self.encoder:
+            if isinstance(layer, nn.Conv1d):
+                lengths = torch.div(lengths - layer.kernel_size[0], layer.stride[0], rounding_mode="floor") + 1
+        return lengths
+
+    def forward_one(self, x, lengths=None):
+        x = self._encode(self.encoder, x)
+        frame_lengths = self._frame_lengths(lengths) if lengths is not None else None
+        x = self.dropout(attentive_stats_pool(x, self.attention, frame_lengths))
+        return self.fc(x)
+
+# Small CNN over log-mel frames (see features.py). Takes either cached features of shape
+# (batch, n_mels, frames) or raw (batch, 1, samples) waveforms, which it converts itself,
+# so the testers can feed it waveforms unchanged.
+class MelSiameseNetwork(EmbeddingNetwork):
+    def __init__(self, n_mels=64, embedding_dim=128):
+        super(MelSiameseNetwork, self).__init__()
+        self.frontend = LogMelExtractor(n_mels=n_mels)
+        channels = [n_mels, 128, 128, 128]
+        strides = [1, 2, 2]
+        layers = []
+        for i in range(len(strides)):
+            layers += [
+                nn.Conv1d(channels[i], channels[i + 1], kernel_size=3, stride=strides[i], padding=1),
+                FrameLayerNorm(channels[i + 1]),
+                nn.ReLU(),
+            ]
+        self.encoder = nn.Sequential(*layers)
+        self.attention = nn.Conv1d(channels[-1], 1, kernel_size=1)
+        self.dropout = nn.Dropout(0.5)
+        self.fc = nn.Linear(2 * channels[-1], embedding_dim)
+
+    def forward_one(self, x, lengths=None):
+        # `lengths` are in samples for waveform input and in frames for feature input
+        if x.size(1) == 1:
+            self.frontend.mel.to(x.device)
+            x = self.frontend(x.squeeze(1))
+            if lengths is not None:
+                lengths = torch.div(lengths, self.frontend.mel.hop_length, rounding_mode="floor") + 1
+        x = self._encode(self.encoder, x)
+        if lengths is not None:
+            for layer in self.encoder:
+                if isinstance(layer, nn.Conv1d):
+                    lengths = torch.div(lengths + 2 * layer.padding[0] - layer.kernel_size[0], layer.stride[0], rounding_mode="floor") + 1
+        x = self.dropout(attentive_stats_pool(x, self.attention, lengths))
+        return self.fc(x)
+
+# Selectable with the `architecture` setting in the training and tester scripts
+MODEL_ARCHITECTURES = {
+    "flatten": SiameseNetwork,
+    "compact": CompactSiameseNetwork,
+    "mel": MelSiameseNetwork,
+}
 
 # Contrastive Loss Function
 def contrastive_loss(output1, output2, label):
@@ -497,100 +778,380 @@ def contrastive_loss(output1, output2, label):
            (label) * torch.pow(torch.clamp(1 - euclidean_distance, min=0.0), 2)
     return loss.mean()
 
+# Contrastive loss over every pair of clips in the batch, from one distance matrix.
+# Uses the same per-pair terms as contrastive_loss, with label 1 where the word ids match.
+def all_pairs_contrastive_loss(embeddings, word_ids):
+    sq_norms = (embeddings ** 2).sum(dim=1)
+    sq_distances = sq_norms.unsqueeze(1) - 2 * embeddings @ embeddings.T + sq_norms.unsqueeze(0)
+    distances = sq_distances.clamp(min=1e-12).sqrt()  # Clamped so identical clips get a finite gradient
+
+    rows, cols = torch.triu_indices(len(word_ids), len(word_ids), offset=1, device=embeddings.device)
+    distances = distances[rows, cols]
+    same = word_ids[rows] == word_ids[cols]
+    terms = torch.where(same, torch.pow(torch.clamp(1 - distances, min=0.0), 2), torch.pow(distances, 2))
+
+    # Different-word pairs far outnumber same-word ones; weight both groups equally, as create_pairs does
+    means = [terms[mask].mean() for mask in (same, ~same) if mask.any()]
+    return torch.stack(means).mean()
+
 # ---------------------------------------------------
 # Section 3: Training Loop with Validation
 # ---------------------------------------------------
-def train_model(train_loader, val_loader, model, device, num_epochs=10, learning_rate=1e-6):  # Increased epochs and reduced learning rate
+def configure_threads(intra_op_threads=None, inter_op_threads=None):
+    """
+    Sizes torch's CPU thread pools (None keeps torch's default). Call before training starts:
+    the inter-op pool can only be sized before its first use.
+    """
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            print(f"Inter-op threads left unchanged: {e}")
+
+
+def dataloader_options(num_workers=0, pin_memory=False, persistent_workers=False, prefetch_factor=2):
+    """
+    DataLoader keyword arguments; the worker-only options are dropped when num_workers is 0.
+    """
+    options = {"num_workers": num_workers, "pin_memory": pin_memory}
+    if num_workers > 0:
+        options.update(persistent_workers=persistent_workers, prefetch_factor=prefetch_factor)
+    return options
+
+
+def cpu_supports_bf16():
+    # Native bf16 (AVX512-BF16 or AMX); elsewhere bf16 autocast is emulated and slower than float32
+    checks = ("_is_avx512_bf16_supported", "_is_amx_tile_supported")
+    return any(getattr(torch.cpu, check, lambda: False)() for check in checks)
+
+
+def resolve_precision(device, precision="auto"):
+    """
+    Maps a precision setting to the autocast dtype for `device` (None means plain float32).
+    - "auto": float16 on CUDA, bfloat16 on CPUs with native bf16 support, else float32.
+    - "fp32", "bf16", "fp16": forced.
+    """
+    dtypes = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+    if precision == "auto":
+        if device.type == "cuda":
+            return torch.float16
+        return torch.bfloat16 if cpu_supports_bf16() else None
+    if precision not in dtypes:
+        raise ValueError(f"precision must be 'auto' or one of {list(dtypes)}, got {precision!r}")
+    return dtypes[precision]
+
+
+def batch_loss(model, batch, device, amp_dtype=None, all_pairs=False):
+    """
+    Loss of one (waveform1, waveform2, same[, word_id1, word_id2][, lengths1, lengths2]) batch.
+    With all_pairs the batch must carry word ids (PairDataset(return_ids=True)), and every clip
+    is compared with every other clip of the batch instead of only its partner.
+    """
+    waveform1, waveform2 = batch[0].to(device, non_blocking=True), batch[1].to(device, non_blocking=True)
+    labels = batch[2].float().to(device)
+    # Variable-length batches (pair_pad_collate) also carry the unpadded lengths
+    lengths = [length.to(device) for length in batch[5 if all_pairs else 3:]]
+
+    with torch.autocast(device.type, dtype=amp_dtype, enabled=amp_dtype is not None):  # Mixed precision context
+        output1, output2 = model(waveform1, waveform2, *lengths)
+    output1, output2 = output1.float(), output2.float()
+
+    if all_pairs:
+        word_ids = torch.cat([batch[3], batch[4]]).to(device)
+        return all_pairs_contrastive_loss(torch.cat([output1, output2]), word_ids)
+    return contrastive_loss(output1, output2, labels)
+
+
+def train_step(model, batch, optimizer, scaler, device, amp_dtype=None, all_pairs=False):
+    """
+    One optimizer step on one batch; returns the loss.
+    """
+    optimizer.zero_grad()
+    loss = batch_loss(model, batch, device, amp_dtype, all_pairs)
+    scaler.scale(loss).backward()  # Scale the loss (a no-op unless training in float16 on CUDA)
+    scaler.step(optimizer)  # Update weights
+    scaler.update()  # Update the scale for next iteration
+    return loss.item()
+
+
+def training_state(model, optimizer, scaler, dataset, epoch, step, **bookkeeping):
+    """
+    Everything needed to continue a run exactly where it stopped.
+    Args:
+    - epoch, step (int): Position in the run; `step` batches of `epoch` are already trained on.
+    - bookkeeping: Loss totals, early-stopping state and RNG states.
+    """
+    return {"model": model.state_dict(), "optimizer": optimizer.state_dict(), "scaler": scaler.state_dict(),
+            "dataset": dataset.state_dict() if hasattr(dataset, "state_dict") else None,
+            "epoch": epoch, "step": step, "rng_state": capture_rng_state(), **bookkeeping}
+
+
+def train_model(train_loader, val_loader, model, device, num_epochs=10, learning_rate=1e-6, precision="auto",  # Increased epochs and reduced learning rate
+                accumulation_steps=1, all_pairs=False, checkpoint_activations=False,
+                checkpoint_dir=None, resume=False, checkpoint_interval=300, keep_checkpoints=3):
+    """
+    Args:
+    - accumulation_steps (int): Batches whose gradients are summed per optimizer step, so the
+      effective batch size is accumulation_steps x the loader's batch size.
+    - all_pairs (bool): Use the in-batch all-pairs loss (needs PairDataset(return_ids=True)).
+    - checkpoint_activations (bool): Trade recomputation for memory in the conv stack.
+    - checkpoint_dir (str): Write full training-state checkpoints here (None only keeps ./best_model.pth).
+    - resume (bool): Continue from the newest checkpoint in checkpoint_dir, if there is one.
+    - checkpoint_interval (float): Seconds between mid-epoch checkpoints (None: only at the end of each epoch).
+    - keep_checkpoints (int): Number of most recent checkpoints kept.
+
+    The model may be wrapped with distributed.wrap_model; losses are then averaged over all
+    ranks and only rank 0 logs and writes checkpoints (every rank reads them on resume).
+    """
     optimizer = optim.Adam(model.parameters(), lr=learning_rate)
-    scaler = GradScaler()  # Initialize the GradScaler for mixed precision
+    amp_dtype = resolve_precision(device, precision)
+    # Loss scaling only matters for float16 gradients; bfloat16 has float32's exponent range
+    scaler = torch.amp.GradScaler("cuda", enabled=device.type == "cuda" and amp_dtype == torch.float16)
+    base_model = unwrap_model(model)
+    base_model.checkpoint_activations = checkpoint_activations
+    if is_main_process():
+        print(f"Training on {device} with {amp_dtype or torch.float32} autocast, {torch.get_num_threads()} threads, "
+              f"{accumulation_steps} batches per step")
 
     model.train()
     best_val_loss = float('inf')
     patience = 3  # Early stopping patience
     patience_counter = 0
 
-    for epoch in range(num_epochs):
-        total_loss = 0
-        for waveform1, waveform2, labels in train_loader:
-            waveform1, waveform2 = waveform1.to(device), waveform2.to(device)
-            labels = labels.float().to(device)
-
-            optimizer.zero_grad()
-
-            with autocast():  # Mixed precision context
-                output1, output2 = model(waveform1, waveform2)
-                loss = contrastive_loss(output1, output2, labels)
+    # Checkpoints are copied to the CPU on the training thread and written by a background thread
+    checkpoints = CheckpointManager(checkpoint_dir, keep_checkpoints) if checkpoint_dir else None
+    resumed = checkpoints.load_latest() if checkpoints is not None and resume else None
+    start_epoch, start_step = 0, 0
+    if resumed is not None:
+        base_model.load_state_dict(resumed["model"])
+        optimizer.load_state_dict(resumed["optimizer"])
+        if resumed["scaler"]:  # Empty when the scaler is disabled
+            scaler.load_state_dict(resumed["scaler"])
+        if resumed["dataset"] is not None:
+            train_loader.dataset.load_state_dict(resumed["dataset"])
+        best_val_loss, patience_counter = resumed["best_val_loss"], resumed["patience_counter"]
+        start_epoch, start_step = resumed["epoch"], resumed["step"]
+        if not start_step:
+            restore_rng_state(resumed["rng_state"])
+        if resumed["finished"]:
+            start_epoch = num_epochs
+    last_save = time.monotonic()
+
+    for epoch in range(start_epoch, num_epochs):
+        # A checkpoint taken mid-epoch resumes with that epoch's pairs, batch order and RNG state
+        skip_batches = start_step if epoch == start_epoch else 0
+
+        # Fresh pairs (and periodically re-mined hard negatives) every epoch
+        # (every rank draws the same pairs: the sampler is seeded by the epoch)
+        if hasattr(train_loader.dataset, "resample_pairs"):
+            if not skip_batches:
+                train_loader.dataset.resample_pairs(epoch, base_model, device)
+            if hasattr(train_loader.batch_sampler, "lengths"):
+                train_loader.batch_sampler.lengths = train_loader.dataset.pair_lengths()
+
+        # Length-bucketed batches (and distributed shards) are reshuffled every epoch
+        for sampler in (train_loader.batch_sampler, train_loader.sampler):
+            if hasattr(sampler, "set_epoch"):
+                sampler.set_epoch(epoch)
+        # Augmentation is seeded per (epoch, batch), so it does not depend on which worker loads a batch
+        if hasattr(train_loader.collate_fn, "set_epoch"):
+            train_loader.collate_fn.set_epoch(epoch, skip_batches)
+
+        # The loader draws its shuffle and worker seeds from the global RNG when iteration starts
+        if skip_batches:
+            restore_rng_state(resumed["epoch_rng_state"])
+        epoch_rng_state = capture_rng_state()
+        # Mid-epoch, the batches already trained on are skipped in the sampler instead of being
+        # loaded, and the checkpoint's RNG state is restored before the next batch
+        batches = resume_loader(train_loader, skip_batches, resumed["rng_state"]) if skip_batches else train_loader
+
+        total_loss = resumed["total_loss"] if skip_batches else 0
+        optimizer.zero_grad()
+        for step, batch in enumerate(batches, skip_batches + 1):
+            stepping = step % accumulation_steps == 0 or step == len(train_loader)
+            # Under DDP, gradients are only all-reduced on the batch that completes an accumulation window
+            with model.no_sync() if hasattr(model, "no_sync") and not stepping else nullcontext():
+                loss = batch_loss(model, batch, device, amp_dtype, all_pairs)
+                # Averaged over the accumulated batches, so the learning rate means the same as without accumulation
+                scaler.scale(loss / accumulation_steps).backward()
+            total_loss += loss.item()
 
-            scaler.scale(loss).backward()  # Scale the loss
-            scaler.step(optimizer)  # Update weights
-            scaler.update()  # Update the scale for next iteration
+            if stepping:
+                scaler.step(optimizer)  # Update weights
+                scaler.update()  # Update the scale for next iteration
+                optimizer.zero_grad()
 
-            total_loss += loss.item()
+                # Mid-epoch checkpoints between optimizer steps, so no accumulated gradients are lost
+                if (checkpoints is not None and checkpoint_interval is not None and is_main_process()
+                        and time.monotonic() - last_save >= checkpoint_interval):
+                    checkpoints.save(training_state(base_model, optimizer, scaler, train_loader.dataset, epoch, step,
+                                                    total_loss=total_loss, epoch_rng_state=epoch_rng_state,
+                                                    best_val_loss=best_val_loss, patience_counter=patience_counter,
+                                                    finished=False), epoch, step)
+                    last_save = time.monotonic()
 
-        print(f"Epoch: {epoch + 1}, Training Loss: {total_loss / len(train_loader)}")
+        total_loss, num_batches = all_reduce_sum(total_loss, len(train_loader))
+        if is_main_process():
+            print(f"Epoch: {epoch + 1}, Training Loss: {total_loss / num_batches}")
 
         # Validation Phase
         model.eval()
         total_val_loss = 0
         with torch.no_grad():
-            for waveform1, waveform2, labels in val_loader:
-                waveform1, waveform2 = waveform1.to(device), waveform2.to(device)
-                labels = labels.float().to(device)
-
-                output1, output2 = model(waveform1, waveform2)
-                val_loss = contrastive_loss(output1, output2, labels)
+            for batch in val_loader:
+                total_val_loss += batch_loss(model, batch, device, amp_dtype, all_pairs).item()
 
-                total_val_loss += val_loss.item()
-
-        print(f"Epoch: {epoch + 1}, Validation Loss: {total_val_loss / len(val_loader)}")
+        # Every rank sees the same summed loss, so they all take the same early-stopping decision
+        total_val_loss, num_val_batches = all_reduce_sum(total_val_loss, len(val_loader))
+        if is_main_process():
+            print(f"Epoch: {epoch + 1}, Validation Loss: {total_val_loss / num_val_batches}")
 
         # Early stopping logic
         if total_val_loss < best_val_loss:
             best_val_loss = total_val_loss
             patience_counter = 0
             # Save model checkpoint if desired
-            torch.save(model.state_dict(), './best_model.pth')
+            if is_main_process():
+                if checkpoints is not None:
+                    checkpoints.save_weights(base_model.state_dict(), './best_model.pth')
+                else:
+                    atomic_save(base_model.state_dict(), './best_model.pth')
         else:
             patience_counter += 1
-            if patience_counter >= patience:
+        stopping = patience_counter >= patience
+
+        # End-of-epoch checkpoint: a resumed run starts the next epoch
+        if checkpoints is not None and is_main_process():
+            checkpoints.save(training_state(base_model, optimizer, scaler, train_loader.dataset, epoch + 1, 0,
+                                            best_val_loss=best_val_loss, patience_counter=patience_counter,
+                                            finished=stopping), epoch + 1, 0)
+            last_save = time.monotonic()
+        if stopping:
+            if is_main_process():
                 print("Early stopping triggered")
-                break
+            break
 
         model.train()  # Set the model back to training mode
 
-        # Clear cache to free up memory
-        torch.cuda.empty_cache()
+        # Clear cache to free up memory (there is no allocator cache to clear on the CPU)
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+
+    # Let the last background write finish before the caller exits
+    if checkpoints is not None:
+        checkpoints.wait()
 
 # ---------------------------------------------------
 # Section 4: Main Function (Setup and Execution)
 # ---------------------------------------------------
 if __name__ == "__main__":
-    csv_file_path = '/content/drive/My Drive/Colab_Notebooks/data/a.csv'
-    audio_dir = '/content/drive/My Drive/Colab_Notebooks/data/converted_audio/'
-
-    df = pd.read_csv(csv_file_path)
-    labels = df['enWord'].tolist()
-
-    # Create dataset and pairs
-    dataset = AudioDataset(audio_dir, labels)
-    pairs = create_pairs(labels)
-    pair_dataset = PairDataset(dataset, pairs)
-
-    # Split the dataset into training and validation sets
-    train_size = int(0.8 * len(pair_dataset))
-    val_size = len(pair_dataset) - train_size
-    train_dataset, val_dataset = random_split(pair_dataset, [train_size, val_size])
-
-    train_loader = DataLoader(train_dataset, batch_size=2, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=2, shuffle=False)
+    parser = argparse.ArgumentParser(description="Train the Siamese network (launch with torchrun for several processes).")
+    parser.add_argument("--checkpoint-dir", default='/content/drive/My Drive/Colab_Notebooks/data/checkpoints/')
+    parser.add_argument("--resume", action="store_true", help="Continue from the newest checkpoint in --checkpoint-dir")
+    parser.add_argument("--checkpoint-interval", type=float, default=300, help="Seconds between mid-epoch checkpoints")
+    parser.add_argument("--keep-checkpoints", type=int, default=3)
+    args = parser.parse_args()
+
+    # Clips of augmentor.py's output ("Across_noisy", ...) are grouped by source_word, so every word has
+    # several variants to pair as positives. Point audio_dir at converted_audio/ and set csv_file_path to
+    # a.csv to train on the one recording per enWord instead (positives then repeat the anchor).
+    audio_dir = '/content/drive/My Drive/Colab_Notebooks/data/augmented_audio/'
+    csv_file_path = None  # e.g. '/content/drive/My Drive/Colab_Notebooks/data/a.csv'
+    # Optional store built once with waveform_store.py (e.g. '/content/drive/My Drive/Colab_Notebooks/data/packed/train')
+    packed_store_path = None
+    architecture = 'flatten'  # 'compact' trains the pooled encoder (tens of MB smaller, ms per clip on CPU)
+    # With architecture 'mel', log-mel features are computed once per clip and cached here
+    feature_cache_dir = '/content/drive/My Drive/Colab_Notebooks/data/feature_cache/'
+    # Bucket pairs by duration and pad each batch only to its longest clip (compact/mel architectures)
+    variable_length = False
+    # Written by converter.py / vad.py; clips are cropped to their voiced region when present
+    segments = load_segments(os.path.join(audio_dir, SEGMENTS_FILE))
+    # Random noise/gain/shift/stretch/pitch per training batch instead of augmentor.py's copies on disk
+    augment = True
+
+    if csv_file_path:
+        labels = pd.read_csv(csv_file_path)['enWord'].tolist()
+    else:
+        labels = sorted(os.path.splitext(name)[0] for name in os.listdir(audio_dir) if name.endswith(".wav"))
+
+    # Clips per batch, and clip pairs per optimizer step (reached by accumulating gradients over batches)
+    batch_size = 2 if architecture == 'flatten' else 8
+    effective_batch_size = 32
+    accumulation_steps = max(1, effective_batch_size // batch_size)
+    # Recompute conv activations in backward to fit larger batches; compare all clips in each batch
+    checkpoint_activations = False
+    all_pairs_loss = True
+
+    # Create the clip dataset
+    if architecture == 'mel':
+        cache = FeatureCache(feature_cache_dir, LogMelExtractor(), segments=segments)
+        cache.warm(os.path.join(audio_dir, f"{label}.wav") for label in labels)
+        dataset = FeatureDataset(audio_dir, labels, cache, max_frames=None if variable_length else 1001)  # 1001 frames = 10 s
+    elif packed_store_path:
+        dataset = PackedAudioDataset(packed_store_path, variable_length=variable_length)
+    else:
+        dataset = AudioDataset(audio_dir, labels, variable_length=variable_length, segments=segments)
+    # Views into the memory-mapped store are already free, so skip the decode cache
+    cache_bytes = 0 if packed_store_path and architecture != 'mel' else 512 * 1024 * 1024
+
+    # Split by word into training, validation and test words, so no word (or augmented variant of it)
+    # is on two sides; test words (test_set_genrator.py's held-out split) are not trained or validated on
+    sides = [word_split(source_word(label), test_size=0.2, val_size=0.1) for label in dataset.labels]
+    train_labels = [label for label, side in zip(dataset.labels, sides) if side == "train"]
+    val_labels = [label for label, side in zip(dataset.labels, sides) if side == "val"]
+
+    # Positives pair different variants of a word; after the first epoch half the negatives are
+    # the anchor's nearest other words under the current model, re-mined every epoch
+    train_pair_sampler = PairSampler(train_labels, hard_fraction=0.5, refresh_every=1)
+    val_pair_sampler = PairSampler(val_labels, refresh_every=0)
+    train_dataset = PairDataset(dataset, train_pair_sampler.pairs(), cache_bytes=cache_bytes, sampler=train_pair_sampler, return_ids=all_pairs_loss)
+    val_dataset = PairDataset(dataset, val_pair_sampler.pairs(), cache_bytes=cache_bytes, sampler=val_pair_sampler, return_ids=all_pairs_loss)
+
+    # Precision ('auto' uses bf16 autocast on CPUs that support it), CPU threads and loader workers.
+    # Under torchrun (see distributed.py) each process trains on its shard with its share of the cores.
+    rank, world_size = init_distributed(backend="gloo")
+    device = local_device()
+    precision = 'auto'
+    configure_threads(intra_op_threads=threads_per_process() if world_size > 1 else None, inter_op_threads=None)
+    loader_options = dataloader_options(num_workers=2, pin_memory=device.type == "cuda", persistent_workers=True, prefetch_factor=2)
+    # Persistent workers keep their copy of the dataset, so they would never see the pairs resampled each epoch
+    train_loader_options = dict(loader_options, persistent_workers=False) if loader_options["num_workers"] else loader_options
+
+    if variable_length:
+        if architecture == 'flatten':
+            raise ValueError("variable_length needs an architecture with pooling ('compact' or 'mel')")
+        bucket_sampler = DistributedLengthBucketSampler if world_size > 1 else LengthBucketSampler
+        train_sampler = bucket_sampler(train_dataset.pair_lengths(), batch_size=batch_size)
+        val_sampler = bucket_sampler(val_dataset.pair_lengths(), batch_size=batch_size, shuffle=False)
+        train_collate = pair_pad_collate
+        if augment and architecture != 'mel':
+            train_collate = AugmentingCollate(BatchAugmenter(), pair_pad_collate, length_indices=(5, 6) if all_pairs_loss else (3, 4), seed=rank)
+        train_loader = DataLoader(train_dataset, batch_sampler=train_sampler, collate_fn=train_collate, **train_loader_options)
+        val_loader = DataLoader(val_dataset, batch_sampler=val_sampler, collate_fn=pair_pad_collate, **loader_options)
+    else:
+        train_collate = AugmentingCollate(BatchAugmenter(), seed=rank) if augment and architecture != 'mel' else None
+        train_sampler = DistributedSampler(train_dataset) if world_size > 1 else None
+        val_sampler = DistributedSampler(val_dataset, shuffle=False) if world_size > 1 else None
+        train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=train_sampler is None, sampler=train_sampler,
+                                  collate_fn=train_collate, **train_loader_options)
+        val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, sampler=val_sampler, **loader_options)
 
     # Initialize the Siamese Network
-    model = SiameseNetwork()
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = MODEL_ARCHITECTURES[architecture]()
+    if is_main_process():
+        print(f"Architecture: {architecture}, Parameters: {sum(p.numel() for p in model.parameters())}, Processes: {world_size}")
     model.to(device)
+    model = wrap_model(model)
 
     # Train the model
-    train_model(train_loader, val_loader, model, device)
+    train_model(train_loader, val_loader, model, device, precision=precision, accumulation_steps=accumulation_steps,
+                all_pairs=all_pairs_loss, checkpoint_activations=checkpoint_activations,
+                checkpoint_dir=args.checkpoint_dir, resume=args.resume, checkpoint_interval=args.checkpoint_interval,
+                keep_checkpoints=args.keep_checkpoints)
 
     # Save the trained model
-    torch.save(model.state_dict(), './trained_siamese_model.pth')
+    if is_main_process():
+        atomic_save(unwrap_model(model).state_dict(), './trained_siamese_model.pth')
+    cleanup()
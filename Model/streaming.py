@@ -0,0 +1,367 @@
+import time
+import threading
+from collections import deque
+import numpy as np
+import torch
+import torchaudio
+from vad import frame_energies_db
+try:
+    import soundfile
+except ImportError:  # Falls back to torchaudio.load (which needs torchcodec in torchaudio >= 2.9)
+    soundfile = None
+
+# Streaming word transcription: audio blocks arrive in a ring buffer (from the microphone callback,
+# or from a file standing in for it), an energy VAD finds where each word starts and ends, and the
+# model runs on overlapping chunks while the word is still being spoken. Logits of finished chunks
+# are cached, so when the word ends only the last chunk is left to run.
+
+# ---------------------------------------------------
+# Section 1: Ring Buffer and Audio Sources
+# ---------------------------------------------------
+class RingBuffer:
+    def __init__(self, capacity):
+        """
+        Fixed-size float32 FIFO shared by a producer (audio callback) and a consumer.
+        When the consumer falls behind, the oldest unread samples are overwritten and counted in `overruns`.
+        """
+        self.data = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.start = 0  # Position of the oldest unread sample
+        self.size = 0
+        self.overruns = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1)[-self.capacity:]
+        with self.condition:
+            overflow = max(0, self.size + len(samples) - self.capacity)
+            if overflow:
+                self.overruns += overflow
+                self.start = (self.start + overflow) % self.capacity
+                self.size -= overflow
+            end = (self.start + self.size) % self.capacity
+            first = min(len(samples), self.capacity - end)
+            self.data[end:end + first] = samples[:first]
+            self.data[:len(samples) - first] = samples[first:]
+            self.size += len(samples)
+            self.condition.notify_all()
+
+    def read(self, timeout=None):
+        """
+        Returns all unread samples, waiting up to `timeout` seconds for some to arrive.
+        Returns None once the buffer is closed and drained.
+        """
+        with self.condition:
+            if not self.size and not self.closed:
+                self.condition.wait(timeout)
+            if not self.size:
+                return None if self.closed else np.zeros(0, dtype=np.float32)
+            indices = (self.start + np.arange(self.size)) % self.capacity
+            samples = self.data[indices]
+            self.start = (self.start + self.size) % self.capacity
+            self.size = 0
+            return samples
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class MicrophoneSource:
+    def __init__(self, sample_rate=16000, block_ms=20, capacity_seconds=30):
+        """
+        Microphone blocks written into a RingBuffer by the sounddevice callback, so recording
+        never waits for the model. Use as a context manager, then read() blocks.
+        """
+        self.sample_rate = sample_rate
+        self.block_size = int(sample_rate * block_ms / 1000)
+        self.buffer = RingBuffer(int(capacity_seconds * sample_rate))
+        self.stream = None
+
+    def _callback(self, indata, frames, time_info, status):
+        # Runs on the audio thread: copy the block and return immediately
+        self.buffer.write(indata[:, 0])
+
+    def start(self):
+        import sounddevice as sd  # Only needed for live input
+        self.stream = sd.InputStream(samplerate=self.sample_rate, channels=1, dtype='float32',
+                                     blocksize=self.block_size, callback=self._callback)
+        self.stream.start()
+        return self
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+        self.buffer.close()
+
+    def read(self, timeout=0.1):
+        return self.buffer.read(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class FileSource(MicrophoneSource):
+    def __init__(self, path, sample_rate=16000, block_ms=20, realtime=False, capacity_seconds=30):
+        """
+        Stands in for the microphone: a thread writes the file's blocks into the ring buffer
+        like the audio callback would, at recording pace when `realtime`, else as fast as possible.
+        """
+        super().__init__(sample_rate, block_ms, capacity_seconds)
+        if soundfile is not None:
+            samples, source_rate = soundfile.read(path, dtype="float32", always_2d=True)
+            waveform = torch.from_numpy(samples).mean(dim=1)  # (frames, channels); average the channels
+        else:
+            waveform, source_rate = torchaudio.load(path)
+            waveform = waveform.mean(dim=0)  # Average the channels
+        if source_rate != sample_rate:
+            waveform = torchaudio.functional.resample(waveform, source_rate, sample_rate)
+        self.samples = waveform.numpy()
+        self.realtime = realtime
+        self.thread = None
+
+    def _feed(self):
+        block_seconds = self.block_size / self.sample_rate
+        for start in range(0, len(self.samples), self.block_size):
+            if self.buffer.closed:
+                return
+            # The callback hands over (frames, channels) blocks
+            self._callback(self.samples[start:start + self.block_size, None], self.block_size, None, None)
+            if self.realtime:
+                time.sleep(block_seconds)
+        self.buffer.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._feed, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.buffer.close()
+        if self.thread is not None:
+            self.thread.join()
+
+# ---------------------------------------------------
+# Section 2: Streaming End-of-Word Detection
+# ---------------------------------------------------
+class StreamingVAD:
+    def __init__(self, sample_rate=16000, frame_ms=20, above_floor_db=12.0, min_level_db=-55.0,
+                 min_speech_ms=60, end_silence_ms=250, calibration_ms=200):
+        """
+        Frame-by-frame version of vad.detect_speech for live input. The noise floor is
+        estimated from the first `calibration_ms` and then tracked over non-speech frames.
+        Args:
+        - min_speech_ms (int): Shorter bursts (clicks, breaths) do not start a word.
+        - end_silence_ms (int): Silence after speech that ends the word.
+        """
+        self.frame_length = int(sample_rate * frame_ms / 1000)
+        self.above_floor_db = above_floor_db
+        self.min_level_db = min_level_db
+        self.min_speech_frames = max(1, int(np.ceil(min_speech_ms / frame_ms)))
+        self.end_silence_frames = max(1, int(np.ceil(end_silence_ms / frame_ms)))
+        self.calibration_frames = max(1, int(calibration_ms / frame_ms))
+        self.noise_floor = None
+        self.calibration = []
+        self.position = 0  # Samples analysed so far
+        self.reset()
+
+    def reset(self):
+        # Forget the current word; the noise floor estimate is kept
+        self.speech_start = None  # Sample offset of the word's first speech frame
+        self.speech_end = None  # Sample offset just after its last speech frame
+        self.speech_frames = 0
+        self.silence_frames = 0
+
+    @property
+    def in_speech(self):
+        # A word has started once its speech run is long enough
+        return self.speech_frames >= self.min_speech_frames
+
+    def _is_speech(self, energy_db):
+        if self.noise_floor is None:
+            self.calibration.append(energy_db)
+            if len(self.calibration) == self.calibration_frames:
+                self.noise_floor = float(np.median(self.calibration))
+            return False
+        speech = energy_db > max(self.noise_floor + self.above_floor_db, self.min_level_db)
+        if not speech:
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * energy_db
+        return speech
+
+    def process_frame(self, frame):
+        """
+        Args:
+        - frame (array): The next `frame_length` samples.
+
+        Returns:
+        - ended (bool): True when this frame completes the silence that ends the current word.
+        """
+        frame_start = self.position
+        self.position += len(frame)
+        if self._is_speech(frame_energies_db(frame, len(frame))[0]):
+            if self.speech_start is None:
+                self.speech_start = frame_start
+            self.speech_frames += 1
+            self.silence_frames = 0
+            self.speech_end = self.position
+            return False
+        if self.speech_start is None:
+            return False
+        if not self.in_speech:
+            self.reset()  # Too short to be a word
+            return False
+        self.silence_frames += 1
+        return self.silence_frames >= self.end_silence_frames
+
+# ---------------------------------------------------
+# Section 3: Chunked CTC with Cached Logits
+# ---------------------------------------------------
+class ChunkedCTC:
+    def __init__(self, logits_fn, sample_rate=16000, chunk_seconds=0.5, left_context_seconds=1.0,
+                 right_context_seconds=0.25, frame_stride=320):
+        """
+        Runs the model on overlapping windows as audio arrives and keeps only each window's
+        central chunk of logits, so every frame is computed once with context on both sides.
+        Args:
+        - logits_fn (callable): 1-D float32 samples -> (frames, vocab) logits, one frame per `frame_stride` samples.
+        - chunk_seconds (float): New audio per model call.
+        - left_context_seconds, right_context_seconds (float): Extra audio around each chunk whose logits are discarded.
+        - frame_stride (int): Samples per output frame (320 for Wav2Vec2's conv feature extractor).
+        """
+        def frames(seconds):
+            # Whole frames, so window starts line up with frame boundaries
+            return max(1, int(seconds * sample_rate) // frame_stride) * frame_stride
+        self.logits_fn = logits_fn
+        self.frame_stride = frame_stride
+        self.chunk = frames(chunk_seconds)
+        self.left_context = frames(left_context_seconds)
+        self.right_context = frames(right_context_seconds)
+        self.reset()
+
+    def reset(self):
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.done = 0  # Samples whose logits are cached
+        self.cached = []
+
+    def _run(self, end, final=False):
+        window_start = max(0, self.done - self.left_context)
+        window_end = len(self.audio) if final else end + self.right_context
+        logits = self.logits_fn(self.audio[window_start:window_end])
+        first = (self.done - window_start) // self.frame_stride
+        last = None if final else (end - window_start) // self.frame_stride
+        self.cached.append(logits[first:last])
+        self.done = len(self.audio) if final else end
+
+    def feed(self, samples):
+        self.audio = np.concatenate([self.audio, np.asarray(samples, dtype=np.float32).reshape(-1)])
+        while len(self.audio) - self.done >= self.chunk + self.right_context:
+            self._run(self.done + self.chunk)
+
+    def finalize(self):
+        """
+        Runs the remaining audio (no right context left to wait for).
+
+        Returns:
+        - logits (Tensor): (frames, vocab) for everything fed since the last reset.
+        """
+        if len(self.audio) > self.done:
+            self._run(len(self.audio), final=True)
+        return torch.cat(self.cached) if self.cached else torch.zeros(0, 0)
+
+
+def wav2vec2_logits_fn(model, processor, device, min_samples=400):
+    """
+    Wraps a Wav2Vec2ForCTC model and processor as a ChunkedCTC logits_fn.
+    Windows shorter than the conv receptive field (400 samples) are zero-padded.
+    """
+    @torch.inference_mode()
+    def logits_fn(samples):
+        if len(samples) < min_samples:
+            samples = np.pad(samples, (0, min_samples - len(samples)))
+        inputs = processor(samples, sampling_rate=16000, return_tensors="pt")
+        return model(input_values=inputs.input_values.to(device)).logits[0].float().cpu()
+    return logits_fn
+
+# ---------------------------------------------------
+# Section 4: Streaming Transcriber
+# ---------------------------------------------------
+class StreamingTranscriber:
+    def __init__(self, logits_fn, decode_fn, sample_rate=16000, pre_roll_ms=200, vad=None, **chunk_options):
+        """
+        Transcribes one word at a time from a continuous stream.
+        Args:
+        - logits_fn: See ChunkedCTC.
+        - decode_fn (callable): (frames, vocab) logits -> text, e.g. greedy argmax + processor.decode.
+        - pre_roll_ms (int): Audio kept from before the first speech frame, so soft onsets are not clipped.
+        - vad (StreamingVAD): Defaults to StreamingVAD(sample_rate).
+        - chunk_options: ChunkedCTC chunk / context settings.
+        """
+        self.decode_fn = decode_fn
+        self.vad = vad or StreamingVAD(sample_rate)
+        self.ctc = ChunkedCTC(logits_fn, sample_rate, **chunk_options)
+        frame_length = self.vad.frame_length
+        # Recent frames: enough to reach back pre_roll_ms before a word that is confirmed min_speech_ms late
+        self.history = deque(maxlen=-(-int(sample_rate * pre_roll_ms / 1000) // frame_length) + self.vad.min_speech_frames)
+        self.pre_roll = self.history.maxlen * frame_length - self.vad.min_speech_frames * frame_length
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.word_start = None  # Stream offset where the current word's audio starts
+
+    def _finish(self):
+        started = time.perf_counter()
+        text = self.decode_fn(self.ctc.finalize())
+        result = {"text": text, "start": self.word_start, "end": self.vad.position,
+                  "finalize_ms": (time.perf_counter() - started) * 1000}
+        self.ctc.reset()
+        self.vad.reset()
+        self.word_start = None
+        return result
+
+    def process(self, samples):
+        """
+        Returns:
+        - words (list): One dict per word that ended within `samples`: text, start/end sample
+          offsets and finalize_ms, the model time spent after the end of the word was detected.
+        """
+        frame_length = self.vad.frame_length
+        samples = np.concatenate([self.pending, np.asarray(samples, dtype=np.float32).reshape(-1)])
+        num_frames = len(samples) // frame_length
+        self.pending = samples[num_frames * frame_length:]
+
+        words = []
+        for frame in samples[:num_frames * frame_length].reshape(num_frames, frame_length):
+            self.history.append(frame)
+            ended = self.vad.process_frame(frame)
+            if self.word_start is not None:
+                self.ctc.feed(frame)
+            elif self.vad.in_speech:
+                # The word is confirmed: give the model its audio from pre_roll before the first speech frame
+                self.word_start = max(self.vad.speech_start - self.pre_roll, self.vad.position - len(self.history) * frame_length)
+                num_history = (self.vad.position - self.word_start) // frame_length
+                self.ctc.feed(np.concatenate(list(self.history)[-num_history:]))
+            if ended:
+                words.append(self._finish())
+        return words
+
+    def flush(self):
+        # End of stream: a word still in progress is finished where the audio stops
+        return [self._finish()] if self.word_start is not None else []
+
+
+def stream_words(source, transcriber, max_seconds=None):
+    """
+    Reads the source until it is exhausted (or `max_seconds` of audio) and yields each word's result.
+    """
+    read = 0
+    while max_seconds is None or read < max_seconds * source.sample_rate:
+        samples = source.read()
+        if samples is None:
+            break
+        read += len(samples)
+        yield from transcriber.process(samples)
+    yield from transcriber.flush()
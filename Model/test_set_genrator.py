@@ -1,28 +1,151 @@
 import os
-import random
+import zlib
 import shutil
+import argparse
+import pandas as pd
+from augmentor import source_word
 
-def create_test_set(augmented_data_dir, test_set_dir, test_size=0.2):
-    if not os.path.exists(test_set_dir):
-        os.makedirs(test_set_dir)
+SPLIT_MODES = ("manifest", "hardlink", "symlink", "copy")
 
-    all_files = os.listdir(augmented_data_dir)
-    test_count = int(len(all_files) * test_size)
+# ---------------------------------------------------
+# Section 1: Grouped, Deterministic Split
+# ---------------------------------------------------
+def is_test_word(word, test_size=0.2, seed=0):
+    """
+    Assigns a word to the test side from a hash of (seed, word), so the split is the same on
+    every run and adding new words never moves existing ones across the split.
+    """
+    return zlib.crc32(f"{seed}:{word}".encode()) < test_size * 2 ** 32
 
-    # Randomly select test_count files without replacement
-    test_files = random.sample(all_files, test_count)
 
-    # Copy selected files to the test set directory
-    for file in test_files:
-        src_file = os.path.join(augmented_data_dir, file)
-        dest_file = os.path.join(test_set_dir, file)
-        shutil.copy(src_file, dest_file)
+def word_split(word, test_size=0.2, val_size=0.1, seed=0, val_seed=None):
+    """
+    Three-way split for training: the words is_test_word holds out for the test set are
+    excluded first, then validation words are drawn from the rest with a different hash salt,
+    so validation never scores words the test set will use.
+    Args:
+    - test_size, seed: As passed to create_test_set (the test set's held-out words).
+    - val_size (float): Fraction of the remaining words used for validation.
+    - val_seed (int): Salt of the validation hash; defaults to seed + 1.
 
+    Returns:
+    - side (str): "train", "val" or "test".
+    """
+    if is_test_word(word, test_size, seed):
+        return "test"
+    return "val" if is_test_word(word, val_size, seed + 1 if val_seed is None else val_seed) else "train"
+
+
+def split_files(augmented_data_dir, test_size=0.2, seed=0):
+    """
+    Splits the .wav files by source word, so all variants of a word
+    (_original, _noisy, _pitch_shifted_*, ...) land on the same side.
+
+    Returns:
+    - train_files, test_files (list): Sorted file names.
+    """
+    train_files, test_files = [], []
+    # os.scandir streams directory entries instead of building the full listing up front
+    with os.scandir(augmented_data_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".wav") and entry.is_file():
+                side = test_files if is_test_word(source_word(entry.name), test_size, seed) else train_files
+                side.append(entry.name)
+    return sorted(train_files), sorted(test_files)
+
+# ---------------------------------------------------
+# Section 2: Writing the Split
+# ---------------------------------------------------
+def write_manifest(path, files):
+    """
+    CSV with the file name and its source word (enWord, as in a.csv).
+    """
+    pd.DataFrame({"file": files, "enWord": [source_word(f) for f in files]}).to_csv(path, index=False)
+
+
+def read_manifest(path):
+    """
+    File names listed in a manifest written by write_manifest (e.g. test.csv in "manifest" mode).
+    """
+    return pd.read_csv(path)['file'].tolist()
+
+
+def link_files(files, src_dir, dest_dir, mode="hardlink"):
+    """
+    Makes `files` from src_dir appear in dest_dir without duplicating them on disk.
+    Hard links fall back to symlinks across file systems; "copy" keeps the old behaviour.
+    Other .wav files in dest_dir (left by an earlier split) are removed, so it holds exactly `files`.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    keep = set(files)
+    with os.scandir(dest_dir) as entries:
+        stale = [entry.path for entry in entries if entry.name.endswith(".wav") and entry.name not in keep]
+    for path in stale:
+        os.remove(path)
+    if stale:
+        print(f"Removed {len(stale)} files of an earlier split from {dest_dir}")
+    for file in files:
+        src_file = os.path.join(src_dir, file)
+        dest_file = os.path.join(dest_dir, file)
+        if os.path.lexists(dest_file):
+            os.remove(dest_file)
+        if mode == "copy":
+            shutil.copy(src_file, dest_file)
+            continue
+        if mode == "hardlink":
+            try:
+                os.link(src_file, dest_file)
+                continue
+            except OSError:
+                pass
+        os.symlink(os.path.abspath(src_file), dest_file)
+
+
+def create_test_set(augmented_data_dir, test_set_dir, test_size=0.2, seed=0, mode="hardlink", train_set_dir=None):
+    """
+    Args:
+    - augmented_data_dir (str): Directory written by augmentor.py.
+    - test_set_dir (str): Receives the test files (links or copies), or train.csv/test.csv in "manifest" mode
+      (siamese_tester.py and threshold_tuner.py read test.csv with test_manifest_path set).
+    - test_size (float): Fraction of source words held out.
+    - seed (int): Changes which words are held out.
+    - mode (str): One of SPLIT_MODES.
+    - train_set_dir (str): Optionally also materialize the training side here.
+
+    Returns:
+    - test_files (list): File names on the test side.
+    """
+    if mode not in SPLIT_MODES:
+        raise ValueError(f"mode must be one of {SPLIT_MODES}, got {mode!r}")
+    train_files, test_files = split_files(augmented_data_dir, test_size, seed)
+
+    os.makedirs(test_set_dir, exist_ok=True)
+    if mode == "manifest":
+        write_manifest(os.path.join(test_set_dir, "train.csv"), train_files)
+        write_manifest(os.path.join(test_set_dir, "test.csv"), test_files)
+    else:
+        link_files(test_files, augmented_data_dir, test_set_dir, mode)
+        if train_set_dir:
+            link_files(train_files, augmented_data_dir, train_set_dir, mode)
+
+    print(f"{len(train_files)} train / {len(test_files)} test files "
+          f"({len(set(map(source_word, test_files)))} held-out words)")
     return test_files
 
-# Example usage
-augmented_data_dir = '/content/drive/My Drive/Colab_Notebooks/data/augmented_audio/'  # Update to your augmented data path
-test_set_dir = '/content/drive/My Drive/Colab_Notebooks/data/test_set/'  # Specify your test set path
-test_files = create_test_set(augmented_data_dir, test_set_dir)
+# ---------------------------------------------------
+# Section 3: Main Execution Block
+# ---------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split augmented clips into train/test sets by source word.")
+    parser.add_argument("--augmented-dir", default='/content/drive/My Drive/Colab_Notebooks/data/augmented_audio/')  # Update to your augmented data path
+    parser.add_argument("--test-dir", default='/content/drive/My Drive/Colab_Notebooks/data/test_set/')  # Specify your test set path
+    parser.add_argument("--train-dir", help="Also link the training files here")
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mode", choices=SPLIT_MODES, default="hardlink")
+    args = parser.parse_args()
+
+    test_files = create_test_set(args.augmented_dir, args.test_dir, test_size=args.test_size, seed=args.seed,
+                                 mode=args.mode, train_set_dir=args.train_dir)
 
-print("Selected test files:", test_files)
+    print("Selected test files:", test_files)
@@ -2,24 +2,9 @@ import os
 import torch
 import torchaudio
 import sounddevice as sd
-from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
 import numpy as np
-
-# Load the trained model and processor
-model_path = './trained_model'  # Adjust to your saved model path
-model = Wav2Vec2ForCTC.from_pretrained(model_path)
-processor = Wav2Vec2Processor.from_pretrained(model_path)
-
-# Set the model to evaluation mode
-model.eval()
-
-# Check if GPU is available and move model to GPU if so
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
-
-# Define output folder for recorded audio
-output_folder = './data/recorded_audio'  # Adjust to your desired output path
-os.makedirs(output_folder, exist_ok=True)  # Create the folder if it doesn't exist
+from inference_server import load_model
+from lexicon_decoder import LexiconDecoder, load_vocabulary
 
 # Function to record audio using the microphone
 def record_audio(duration=3, fs=16000, filename=None):
@@ -37,7 +22,8 @@ def record_audio(duration=3, fs=16000, filename=None):
     return np.squeeze(audio)
 
 # Function to transcribe recorded audio
-def transcribe_audio(audio):
+# With a LexiconDecoder the recording is matched against the vocabulary instead of decoded freely
+def transcribe_audio(audio, model, processor, device, decoder=None):
     # Tokenize the audio (convert to input for model)
     inputs = processor(audio, sampling_rate=16000, return_tensors="pt", padding=True).to(device)
 
@@ -46,21 +32,38 @@ def transcribe_audio(audio):
         logits = model(input_values=inputs.input_values).logits
         print("Logits:", logits)  # Debugging line to check logits
 
+    if decoder is not None:
+        candidates = decoder.decode(logits)[0]
+        print("Top words: " + ", ".join(f"{word} ({posterior:.2f})" for word, _, posterior in candidates))
+        return candidates[0][0]
+
     # Decode the logits to get the predicted text
     predicted_ids = torch.argmax(logits, dim=-1)
     transcription = processor.decode(predicted_ids[0])
 
     return transcription
 
-# Record the audio from the microphone and save it to a file
-audio_filename = os.path.join(output_folder, "recorded_audio.wav")  # Specify your desired file name here
-audio_data = record_audio(duration=5, fs=16000, filename=audio_filename)  # Increase duration for testing
+if __name__ == "__main__":
+    # Load the trained model and processor
+    model_path = './trained_model'  # Adjust to your saved model path
+    model, processor, device = load_model(model_path)
+    # The words learners practise (a.csv's enWord column); None decodes characters freely
+    vocab_csv_path = None
+    decoder = LexiconDecoder.from_processor(load_vocabulary(vocab_csv_path), processor) if vocab_csv_path else None
+
+    # Define output folder for recorded audio
+    output_folder = './data/recorded_audio'  # Adjust to your desired output path
+    os.makedirs(output_folder, exist_ok=True)  # Create the folder if it doesn't exist
+
+    # Record the audio from the microphone and save it to a file
+    audio_filename = os.path.join(output_folder, "recorded_audio.wav")  # Specify your desired file name here
+    audio_data = record_audio(duration=5, fs=16000, filename=audio_filename)  # Increase duration for testing
 
-# Debug: Check the recorded audio data
-print("Audio data shape:", audio_data.shape)
-print("Audio data sample:", audio_data[:10])  # Print first 10 samples for reference
+    # Debug: Check the recorded audio data
+    print("Audio data shape:", audio_data.shape)
+    print("Audio data sample:", audio_data[:10])  # Print first 10 samples for reference
 
-# Test the model on the recorded audio
-prediction = transcribe_audio(audio_data)
+    # Test the model on the recorded audio
+    prediction = transcribe_audio(audio_data, model, processor, device, decoder)
 
-print(f"Predicted word: {prediction}")
+    print(f"Predicted word: {prediction}")
@@ -1,19 +1,9 @@
 import torch
 import torchaudio
-from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
-import torch.nn.functional as F
-
-# Load the trained model and processor
-model_path = './trained_model'  # Adjust to your saved model path
-model = Wav2Vec2ForCTC.from_pretrained(model_path)
-processor = Wav2Vec2Processor.from_pretrained(model_path)
-
-# Set the model to evaluation mode
-model.eval()
-
-# Check if GPU is available and move model to GPU if so
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
+import argparse
+from inference_server import load_model
+from lexicon_decoder import LexiconDecoder, load_vocabulary
+from streaming import FileSource, MicrophoneSource, StreamingTranscriber, stream_words, wav2vec2_logits_fn
 
 # Function to load audio from file
 def load_audio(filename):
@@ -23,7 +13,8 @@ def load_audio(filename):
     return waveform, sample_rate
 
 # Function to transcribe loaded audio
-def transcribe_audio_from_file(audio, sample_rate):
+# With a LexiconDecoder the clip is matched against the vocabulary instead of decoded freely
+def transcribe_audio_from_file(audio, sample_rate, model, processor, device, decoder=None):
     # Resample if necessary (to 16000 Hz in this case)
     if sample_rate != 16000:
         audio = torchaudio.functional.resample(audio, sample_rate, 16000)
@@ -56,23 +47,56 @@ def transcribe_audio_from_file(audio, sample_rate):
         print(f"Logits shape: {logits.shape}")  # Check logits shape
         print(f"Logits: {logits}")  # Print the logits to see their values
 
+    if decoder is not None:
+        candidates = decoder.decode(logits)[0]
+        print("Top words: " + ", ".join(f"{word} ({posterior:.2f})" for word, _, posterior in candidates))
+        return candidates[0][0]
+
     # Decode the logits to get the predicted text
     predicted_ids = torch.argmax(logits, dim=-1)
-    probabilities = F.softmax(logits, dim=-1)  # Get probabilities
     print(f"Predicted IDs: {predicted_ids}")  # Print predicted IDs
-    print(f"Probabilities: {probabilities}")  # Print probabilities
 
     transcription = processor.decode(predicted_ids[0])
 
     return transcription
 
-# Path to the audio file you want to test
-audio_filename = './data/test_audio/Across.wav'  # Specify the path to your .wav file here
-
-# Load the audio file
-audio_data, sample_rate = load_audio(audio_filename)
-
-# Test the model on the loaded audio
-prediction = transcribe_audio_from_file(audio_data, sample_rate)
-
-print(f"Predicted word: {prediction}")
+# Function to transcribe words as they are spoken (or as a file plays back in place of the microphone)
+def transcribe_stream(source, model, processor, device, max_seconds=None, decoder=None):
+    def decode(logits):
+        if decoder is not None:
+            return decoder.decode(logits.unsqueeze(0), top_k=1)[0][0][0]
+        return processor.decode(torch.argmax(logits, dim=-1))
+
+    transcriber = StreamingTranscriber(wav2vec2_logits_fn(model, processor, device), decode)
+    with source:
+        for word in stream_words(source, transcriber, max_seconds):
+            print(f"Predicted word: {word['text']} ({word['finalize_ms']:.0f} ms after the end of the word)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe a .wav file, or stream words from the microphone.")
+    parser.add_argument("--file", default='./data/test_audio/Across.wav')  # Specify the path to your .wav file here
+    parser.add_argument("--stream", action="store_true", help="Transcribe each word from the microphone as it ends")
+    parser.add_argument("--stream-file", help="Stream this file at recording pace instead of the microphone")
+    parser.add_argument("--seconds", type=float, help="Stop streaming after this much audio")
+    parser.add_argument("--vocab-csv", help="Match against this CSV's enWord vocabulary (e.g. a.csv) instead of free decoding")
+    args = parser.parse_args()
+
+    # Load the trained model and processor
+    model_path = './trained_model'  # Adjust to your saved model path
+    model, processor, device = load_model(model_path)
+    decoder = LexiconDecoder.from_processor(load_vocabulary(args.vocab_csv), processor) if args.vocab_csv else None
+
+    if args.stream or args.stream_file:
+        source = FileSource(args.stream_file, realtime=True) if args.stream_file else MicrophoneSource()
+        transcribe_stream(source, model, processor, device, args.seconds, decoder)
+    else:
+        # Path to the audio file you want to test
+        audio_filename = args.file
+
+        # Load the audio file
+        audio_data, sample_rate = load_audio(audio_filename)
+
+        # Test the model on the loaded audio
+        prediction = transcribe_audio_from_file(audio_data, sample_rate, model, processor, device, decoder)
+
+        print(f"Predicted word: {prediction}")
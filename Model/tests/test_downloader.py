@@ -0,0 +1,97 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from downloader import download_all, load_manifest
+
+# Run with: python -m pytest Model/tests  (or python -m unittest discover Model/tests)
+
+
+class AudioHandler(BaseHTTPRequestHandler):
+    # path -> (body, etag); anything else is a 404
+    files = {}
+
+    def do_GET(self):
+        if self.path not in self.files:
+            self.send_error(404)
+            return
+        body, etag = self.files[self.path]
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DownloadAllTest(unittest.TestCase):
+    def setUp(self):
+        AudioHandler.files = {"/Across.mp3": (b"across" * 100, None), "/Back.mp3": (b"back" * 50, '"v1"')}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), AudioHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.audio_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.audio_dir)
+
+    def items(self, *names):
+        return [(name, f"{self.base_url}/{name}") for name in names]
+
+    def download(self, items):
+        return download_all(items, self.audio_dir, max_workers=2, retries=0, backoff=0)
+
+    def test_downloads_and_reports_404(self):
+        manifest = self.download(self.items("Across.mp3", "Missing.mp3"))
+        self.assertEqual(manifest["Across.mp3"]["status"], "downloaded")
+        self.assertEqual(manifest["Across.mp3"]["size"], 600)
+        with open(os.path.join(self.audio_dir, "Across.mp3"), "rb") as f:
+            self.assertEqual(f.read(), b"across" * 100)
+        self.assertEqual(manifest["Missing.mp3"]["status"], "failed")
+        self.assertFalse(os.path.exists(os.path.join(self.audio_dir, "Missing.mp3")))
+        self.assertFalse(any(name.endswith(".part") for name in os.listdir(self.audio_dir)))
+
+    def test_rerun_skips_current_files(self):
+        self.download(self.items("Across.mp3", "Back.mp3"))
+        manifest = self.download(self.items("Across.mp3", "Back.mp3"))
+        # Without an ETag the size match is trusted; with one the server answers 304
+        self.assertEqual(manifest["Across.mp3"]["status"], "skipped")
+        self.assertEqual(manifest["Back.mp3"]["status"], "unchanged")
+        self.assertEqual(load_manifest(os.path.join(self.audio_dir, "manifest.json")), manifest)
+
+    def test_failure_keeps_earlier_download(self):
+        self.download(self.items("Back.mp3"))
+        AudioHandler.files = {}
+        manifest = self.download(self.items("Back.mp3"))
+        self.assertEqual(manifest["Back.mp3"]["status"], "failed")
+        self.assertEqual(manifest["Back.mp3"]["size"], 200)
+
+        AudioHandler.files = {"/Back.mp3": (b"back" * 50, '"v1"')}
+        manifest = self.download(self.items("Back.mp3"))
+        self.assertEqual(manifest["Back.mp3"]["status"], "unchanged")
+        self.assertNotIn("error", manifest["Back.mp3"])
+
+    def test_duplicate_file_names_download_once(self):
+        items = [("Across.mp3", f"{self.base_url}/Across.mp3"), ("Across.mp3", f"{self.base_url}/Back.mp3")]
+        manifest = self.download(items)
+        self.assertEqual(manifest["Across.mp3"]["url"], items[0][1])
+        with open(os.path.join(self.audio_dir, "Across.mp3"), "rb") as f:
+            self.assertEqual(f.read(), b"across" * 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
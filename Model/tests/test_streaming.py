@@ -0,0 +1,99 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import soundfile
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from streaming import ChunkedCTC, FileSource, RingBuffer, StreamingTranscriber, stream_words
+
+# Run with: python -m pytest Model/tests  (or python -m unittest discover Model/tests)
+
+SAMPLE_RATE = 16000
+TOKENS = ["", "A", "B"]  # Blank, then one "character" per tone
+
+
+def tone(seconds, frequency):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return 0.3 * np.sin(2 * np.pi * frequency * t)
+
+
+def silence(seconds):
+    return np.zeros(int(seconds * SAMPLE_RATE))
+
+
+def fake_logits(samples):
+    """
+    Frame-local stand-in for Wav2Vec2: 25 ms windows every 20 ms (its frame rate), blank on
+    silence, "A" on a low tone and "B" on a high one.
+    """
+    samples = np.asarray(samples)
+    num_frames = max(0, (len(samples) - 400) // 320 + 1)
+    logits = torch.zeros(num_frames, len(TOKENS))
+    for frame in range(num_frames):
+        window = samples[frame * 320:frame * 320 + 400]
+        loud = window[np.abs(window) > 0.02]
+        if len(loud) < 200:
+            logits[frame, 0] = 1
+        else:
+            crossings = np.count_nonzero(np.diff(np.sign(loud)))
+            logits[frame, 1 if crossings < 30 else 2] = 1
+    return logits
+
+
+def greedy_decode(logits):
+    text, previous = [], None
+    for token in logits.argmax(dim=-1).tolist():
+        if token != previous:
+            text.append(TOKENS[token])
+        previous = token
+    return "".join(text)
+
+
+class StreamingTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        # Two words: 300 Hz from 0.5 s to 1.1 s, 1 kHz from 1.7 s to 2.2 s
+        self.signal = np.concatenate([silence(0.5), tone(0.6, 300), silence(0.6), tone(0.5, 1000), silence(0.8)])
+        self.signal = (self.signal + rng.normal(0, 0.001, len(self.signal))).astype(np.float32)
+        self.audio_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.audio_dir, "two_words.wav")
+        soundfile.write(self.path, self.signal, SAMPLE_RATE)
+
+    def tearDown(self):
+        shutil.rmtree(self.audio_dir)
+
+    def test_file_source_yields_one_result_per_word(self):
+        transcriber = StreamingTranscriber(fake_logits, greedy_decode, chunk_seconds=0.3)
+        with FileSource(self.path) as source:
+            words = list(stream_words(source, transcriber))
+
+        self.assertEqual([word["text"] for word in words], ["A", "B"])
+        for word, (onset, offset) in zip(words, [(0.5, 1.1), (1.7, 2.2)]):
+            # Starts in the pre-roll before the onset, ends after the word once the silence is confirmed
+            self.assertLessEqual(word["start"], onset * SAMPLE_RATE)
+            self.assertGreaterEqual(word["start"], (onset - 0.3) * SAMPLE_RATE)
+            self.assertGreaterEqual(word["end"], offset * SAMPLE_RATE)
+            self.assertLessEqual(word["end"], (offset + 0.6) * SAMPLE_RATE)
+
+    def test_chunked_logits_match_the_whole_clip(self):
+        ctc = ChunkedCTC(fake_logits, chunk_seconds=0.3, left_context_seconds=0.2, right_context_seconds=0.1)
+        # Blocks that do not line up with the chunks or frames
+        for start in range(0, len(self.signal), 333):
+            ctc.feed(self.signal[start:start + 333])
+        whole = fake_logits(self.signal)
+        self.assertTrue(torch.equal(ctc.finalize(), whole))
+
+    def test_ring_buffer_keeps_newest_samples_on_overrun(self):
+        buffer = RingBuffer(10)
+        buffer.write(np.arange(7, dtype=np.float32))
+        buffer.write(np.arange(7, 14, dtype=np.float32))
+        self.assertEqual(buffer.read().tolist(), list(range(4, 14)))
+        self.assertEqual(buffer.overruns, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
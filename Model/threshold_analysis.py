@@ -0,0 +1,105 @@
+import torch
+
+# A pair is predicted "same" when its distance is below the threshold, as in the testers.
+CRITERIA = ("accuracy", "f1", "eer", "youden")
+
+# ---------------------------------------------------
+# Section 1: Threshold Sweep
+# ---------------------------------------------------
+def sweep_thresholds(distances, labels):
+    """
+    Evaluates every distinct threshold at once from a single sort of the distances.
+    Args:
+    - distances (Tensor or list): Distance of each pair.
+    - labels (Tensor or list): 1 for same-word pairs, 0 for different-word pairs.
+
+    Returns:
+    - sweep (dict): 1-D tensors indexed by candidate threshold
+      (thresholds, accuracy, far, frr, precision, recall, f1), plus scalar eer,
+      eer_threshold and auc.
+    """
+    distances = torch.as_tensor(distances, dtype=torch.float64).flatten()
+    labels = torch.as_tensor(labels).flatten().to(torch.float64)
+    if distances.numel() != labels.numel():
+        raise ValueError("distances and labels must have the same length")
+    if distances.numel() == 0:
+        raise ValueError("need at least one pair to sweep thresholds")
+
+    sorted_dists, order = torch.sort(distances)
+    sorted_labels = labels[order]
+
+    num_pairs = distances.numel()
+    num_pos = sorted_labels.sum()
+    num_neg = num_pairs - num_pos
+
+    # Accepting the k closest pairs: cumulative true/false positives for k = 0..N
+    zero = torch.zeros(1, dtype=torch.float64)
+    tp = torch.cat([zero, torch.cumsum(sorted_labels, 0)])
+    fp = torch.cat([zero, torch.cumsum(1 - sorted_labels, 0)])
+
+    # Tied distances cannot be split by a threshold, so only keep cut points between distinct values
+    keep = torch.ones(num_pairs + 1, dtype=torch.bool)
+    keep[1:-1] = sorted_dists[1:] > sorted_dists[:-1]
+    tp, fp = tp[keep], fp[keep]
+
+    # Threshold for each cut: midway between neighbours so `distance < threshold` accepts exactly k pairs
+    above_max = torch.nextafter(sorted_dists[-1:], torch.full((1,), float("inf"), dtype=torch.float64))
+    thresholds = torch.cat([sorted_dists[:1], (sorted_dists[:-1] + sorted_dists[1:]) / 2, above_max])[keep]
+
+    fn = num_pos - tp
+    tn = num_neg - fp
+
+    accuracy = (tp + tn) / num_pairs
+    far = fp / num_neg if num_neg > 0 else torch.zeros_like(fp)  # False accept rate
+    frr = fn / num_pos if num_pos > 0 else torch.zeros_like(fn)  # False reject rate
+    recall = 1 - frr
+    precision = torch.where(tp + fp > 0, tp / (tp + fp).clamp(min=1), torch.ones_like(tp))
+    f1 = torch.where(precision + recall > 0, 2 * precision * recall / (precision + recall).clamp(min=1e-12), torch.zeros_like(tp))
+
+    # Equal error rate: the cut where FAR and FRR cross
+    eer_idx = torch.argmin(torch.abs(far - frr))
+    eer = ((far[eer_idx] + frr[eer_idx]) / 2).item()
+
+    # ROC curve runs from (0, 0) at the smallest threshold to (1, 1) at the largest
+    auc = torch.trapezoid(recall, far).item()
+
+    return {
+        "thresholds": thresholds,
+        "accuracy": accuracy,
+        "far": far,
+        "frr": frr,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "eer": eer,
+        "eer_threshold": thresholds[eer_idx].item(),
+        "auc": auc,
+    }
+
+# ---------------------------------------------------
+# Section 2: Optimal Threshold Selection
+# ---------------------------------------------------
+def best_threshold(sweep, criterion="accuracy"):
+    """
+    Picks the optimal threshold from a sweep.
+    Args:
+    - sweep (dict): Output of sweep_thresholds.
+    - criterion (str): "accuracy", "f1", "eer" (FAR == FRR) or "youden" (max recall - FAR).
+
+    Returns:
+    - threshold (float): The selected threshold.
+    - metrics (dict): Scalar metrics at that threshold.
+    """
+    if criterion == "accuracy":
+        idx = torch.argmax(sweep["accuracy"])
+    elif criterion == "f1":
+        idx = torch.argmax(sweep["f1"])
+    elif criterion == "eer":
+        idx = torch.argmin(torch.abs(sweep["far"] - sweep["frr"]))
+    elif criterion == "youden":
+        idx = torch.argmax(sweep["recall"] - sweep["far"])
+    else:
+        raise ValueError(f"Unknown criterion '{criterion}', expected one of {CRITERIA}")
+
+    metrics = {name: sweep[name][idx].item() for name in ("accuracy", "far", "frr", "precision", "recall", "f1")}
+    return sweep["thresholds"][idx].item(), metrics
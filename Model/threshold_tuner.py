@@ -2,15 +2,29 @@ import os
 import torch
 import torchaudio
 from torch.utils.data import DataLoader, Dataset
-from torch import nn
+from waveform_store import PackedAudioDataset
+from siamese_train import MODEL_ARCHITECTURES
+from vad import SEGMENTS_FILE, load_segments
+from augmentor import source_word
+from test_set_genrator import read_manifest
+from embedding_eval import AudioClipDataset, checkpoint_cache_key, compute_embeddings, distance_matrix, pair_distances
+from threshold_analysis import CRITERIA, sweep_thresholds, best_threshold
 
 # ---------------------------------------------------
 # Section 1: Dataset Class Definition for Test Set (Returns Pairs)
 # ---------------------------------------------------
 class AudioTestDataset(Dataset):
-    def __init__(self, audio_dir):
+    def __init__(self, audio_dir, store=None, files=None):
         self.audio_dir = audio_dir
-        self.audio_files = [f for f in os.listdir(audio_dir) if f.endswith(".wav")]
+        # Optional PackedAudioDataset packed from this directory (see waveform_store.py)
+        self.store = store
+        # Optional file names from a test_set_genrator.py manifest instead of the whole directory
+        if files is not None:
+            self.audio_files = list(files)
+        elif store is not None:
+            self.audio_files = list(store.files)
+        else:
+            self.audio_files = [f for f in os.listdir(audio_dir) if f.endswith(".wav")]
 
     def __len__(self):
         return len(self.audio_files) // 2
@@ -26,6 +40,12 @@ class AudioTestDataset(Dataset):
         audio_path1 = os.path.join(self.audio_dir, audio_file1)
         audio_path2 = os.path.join(self.audio_dir, audio_file2)
 
+        # Packed clips are already mono and fixed-length
+        if self.store is not None:
+            waveform1 = self.store.waveform(self.store.file_to_index[audio_file1])
+            waveform2 = self.store.waveform(self.store.file_to_index[audio_file2])
+            return waveform1, waveform2, label
+
         waveform1, sample_rate1 = torchaudio.load(audio_path1)
         waveform2, sample_rate2 = torchaudio.load(audio_path2)
 
@@ -50,40 +70,7 @@ class AudioTestDataset(Dataset):
         return waveform
 
 # ---------------------------------------------------
-# Section 2: Siamese Network Definition
-# ---------------------------------------------------
-class SiameseNetwork(nn.Module):
-    def __init__(self):
-        super(SiameseNetwork, self).__init__()
-        self.conv1 = nn.Conv1d(1, 32, kernel_size=5)
-        self.pool = nn.MaxPool1d(2)
-        self.conv2 = nn.Conv1d(32, 64, kernel_size=5)
-
-        self.fc1_input_size = self._get_fc1_input_size()
-        self.fc1 = nn.Linear(self.fc1_input_size, 256)
-        self.fc2 = nn.Linear(256, 128)
-
-    def _get_fc1_input_size(self):
-        x = torch.zeros(1, 1, 160000)
-        x = self.pool(nn.functional.relu(self.conv1(x)))
-        x = self.pool(nn.functional.relu(self.conv2(x)))
-        return x.numel()
-
-    def forward_one(self, x):
-        x = self.pool(nn.functional.relu(self.conv1(x)))
-        x = self.pool(nn.functional.relu(self.conv2(x)))
-        x = x.view(x.size(0), -1)
-        x = nn.functional.relu(self.fc1(x))
-        x = self.fc2(x)
-        return x
-
-    def forward(self, input1, input2):
-        output1 = self.forward_one(input1)
-        output2 = self.forward_one(input2)
-        return output1, output2
-
-# ---------------------------------------------------
-# Section 3: Threshold Tuning Function
+# Section 2: Threshold Tuning Function
 # ---------------------------------------------------
 def tune_threshold(test_loader, model, device):
     model.eval()
@@ -102,28 +89,53 @@ def tune_threshold(test_loader, model, device):
 
     return distances_list, labels_list
 
+def tune_threshold_all_pairs(clip_dataset, model, device, batch_size=64, cache_path=None, cache_key=None):
+    # Same output as tune_threshold, but every clip is embedded once and all pairs are scored.
+    # The N^2 pairs stay tensors: sweep_thresholds sorts and accumulates them without Python lists
+    embeddings = compute_embeddings(model, clip_dataset, device, batch_size=batch_size,
+                                    cache_path=cache_path, cache_key=cache_key)
+    return pair_distances(distance_matrix(embeddings), clip_dataset.labels, include_self=False)
+
 # ---------------------------------------------------
-# Section 4: Main Execution Block
+# Section 3: Main Execution Block
 # ---------------------------------------------------
 if __name__ == "__main__":
     test_audio_dir = '/content/drive/My Drive/Colab_Notebooks/data/test_set/'  # Update to your test set path
+    packed_store_path = None  # Optional store packed from test_audio_dir with waveform_store.py
+    # Or test.csv from `test_set_genrator.py --mode manifest`; test_audio_dir is then the augmented audio directory
+    test_manifest_path = None
+    model_path = './trained_siamese_model.pth'
+    architecture = 'flatten'  # Or 'compact' / 'mel', matching the setting used in siamese_train.py
+    all_pairs = True  # Embed each clip once and score every pair; False keeps the neighbouring-file pairs
+    embedding_cache_path = './threshold_tuner_embeddings.pt'  # Each tool keeps its own cache
 
-    # Create test dataset and loader
-    test_dataset = AudioTestDataset(test_audio_dir)
-    test_loader = DataLoader(test_dataset, batch_size=2, shuffle=False)
+    store = PackedAudioDataset(packed_store_path) if packed_store_path else None
+    test_files = read_manifest(test_manifest_path) if test_manifest_path else None
 
     # Load the trained model
-    model = SiameseNetwork()
+    model = MODEL_ARCHITECTURES[architecture]()
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.load_state_dict(torch.load('./trained_siamese_model.pth', map_location=device))
+    model.load_state_dict(torch.load(model_path, map_location=device))
     model.to(device)
 
     # Tune threshold
-    distances, labels = tune_threshold(test_loader, model, device)
-
-    # Evaluate thresholds
-    thresholds = [0.01, 0.02, 0.03, 0.04, 0.05, 0.06, 0.07, 0.08, 0.09, 0.1]
-    for threshold in thresholds:
-        predictions = (torch.tensor(distances) < threshold).float()
-        accuracy = (predictions == torch.tensor(labels)).float().mean()
-        print(f"Threshold: {threshold}, Accuracy: {accuracy:.2%}")
+    if all_pairs:
+        # Speech offsets recorded with vad.py for the test clips, if any
+        segments = load_segments(os.path.join(test_audio_dir, SEGMENTS_FILE))
+        # Variants of one word (test_set_genrator.py keeps them together) count as the same label
+        clip_dataset = AudioClipDataset(test_audio_dir, store=store, label_fn=source_word, segments=segments, files=test_files)
+        distances, labels = tune_threshold_all_pairs(clip_dataset, model, device,
+                                                     cache_path=embedding_cache_path, cache_key=checkpoint_cache_key(model_path))
+    else:
+        test_dataset = AudioTestDataset(test_audio_dir, store=store, files=test_files)
+        test_loader = DataLoader(test_dataset, batch_size=2, shuffle=False)
+        distances, labels = tune_threshold(test_loader, model, device)
+
+    # Evaluate every threshold at once from a single sort of the distances
+    sweep = sweep_thresholds(distances, labels)
+    print(f"Pairs: {len(distances)}, ROC-AUC: {sweep['auc']:.4f}, EER: {sweep['eer']:.2%} at threshold {sweep['eer_threshold']:.6f}")
+    for criterion in CRITERIA:
+        threshold, metrics = best_threshold(sweep, criterion)
+        print(f"Best by {criterion}: Threshold: {threshold:.6f}, Accuracy: {metrics['accuracy']:.2%}, "
+              f"FAR: {metrics['far']:.2%}, FRR: {metrics['frr']:.2%}, "
+              f"Precision: {metrics['precision']:.2%}, Recall: {metrics['recall']:.2%}")
@@ -0,0 +1,110 @@
+import time
+import argparse
+import itertools
+import torch
+from torch import optim
+from torch.utils.data import DataLoader, Dataset
+from siamese_train import MODEL_ARCHITECTURES, dataloader_options, resolve_precision, train_step
+
+# ---------------------------------------------------
+# Section 1: Synthetic Pairs (no audio files needed)
+# ---------------------------------------------------
+class SyntheticPairDataset(Dataset):
+    def __init__(self, num_pairs=256, num_samples=160000):
+        """
+        Random (waveform1, waveform2, same) pairs shaped like PairDataset items.
+        """
+        self.num_pairs = num_pairs
+        self.num_samples = num_samples
+
+    def __len__(self):
+        return self.num_pairs
+
+    def __getitem__(self, idx):
+        generator = torch.Generator().manual_seed(idx)
+        waveforms = torch.randn(2, 1, self.num_samples, generator=generator) * 0.1
+        return waveforms[0], waveforms[1], idx % 2 == 0
+
+# ---------------------------------------------------
+# Section 2: Training Throughput per Configuration
+# ---------------------------------------------------
+def benchmark_config(make_model, dataset, device, precision="fp32", threads=None, batch_size=8,
+                     steps=20, warmup=3, collate_fn=None, **loader_settings):
+    """
+    Runs `warmup` + `steps` training steps and measures the timed ones.
+    Args:
+    - make_model (callable): Returns a fresh model.
+    - dataset: Pair dataset to train on.
+    - device: Device to train on.
+    - precision (str): See siamese_train.resolve_precision.
+    - threads (int): Intra-op threads (None keeps the current setting).
+    - loader_settings: num_workers / pin_memory / persistent_workers / prefetch_factor.
+
+    Returns:
+    - samples_per_sec (float): Clips encoded per second (two per pair).
+    """
+    if threads:
+        torch.set_num_threads(threads)
+    model = make_model().to(device)
+    model.train()
+    optimizer = optim.Adam(model.parameters(), lr=1e-6)
+    amp_dtype = resolve_precision(device, precision)
+    scaler = torch.amp.GradScaler("cuda", enabled=device.type == "cuda" and amp_dtype == torch.float16)
+
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, drop_last=True, collate_fn=collate_fn,
+                        **dataloader_options(**loader_settings))
+    batches = itertools.chain.from_iterable(itertools.repeat(loader))
+
+    for _ in range(warmup):
+        train_step(model, next(batches), optimizer, scaler, device, amp_dtype)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        train_step(model, next(batches), optimizer, scaler, device, amp_dtype)
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return steps * batch_size * 2 / (time.perf_counter() - start)
+
+
+def benchmark(make_model, dataset, device, precisions=("fp32",), threads=(None,), num_workers=(0,),
+              pin_memory=False, persistent_workers=False, prefetch_factor=2, **kwargs):
+    """
+    Benchmarks every combination of precision, thread count and loader workers and prints a table.
+
+    Returns:
+    - results (list): (precision, threads, num_workers, samples_per_sec) tuples.
+    """
+    results = []
+    print(f"{'precision':>9} {'threads':>7} {'workers':>7} {'samples/sec':>11}")
+    for precision, num_threads, workers in itertools.product(precisions, threads, num_workers):
+        rate = benchmark_config(make_model, dataset, device, precision=precision, threads=num_threads,
+                                num_workers=workers, pin_memory=pin_memory, persistent_workers=persistent_workers,
+                                prefetch_factor=prefetch_factor, **kwargs)
+        results.append((precision, num_threads or torch.get_num_threads(), workers, rate))
+        print(f"{precision:>9} {results[-1][1]:>7} {workers:>7} {rate:>11.1f}")
+    return results
+
+# ---------------------------------------------------
+# Section 3: Main Execution Block
+# ---------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure Siamese training throughput per precision/thread/worker setting.")
+    parser.add_argument("--architecture", choices=list(MODEL_ARCHITECTURES), default="compact")
+    parser.add_argument("--precision", nargs="+", default=["fp32", "auto"], choices=["auto", "fp32", "bf16", "fp16"])
+    parser.add_argument("--threads", nargs="+", type=int, default=[torch.get_num_threads()])
+    parser.add_argument("--workers", nargs="+", type=int, default=[0, 2])
+    parser.add_argument("--pin-memory", action="store_true")
+    parser.add_argument("--persistent-workers", action="store_true")
+    parser.add_argument("--prefetch-factor", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=10.0, help="Length of the synthetic clips")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dataset = SyntheticPairDataset(num_samples=int(args.seconds * 16000))
+    benchmark(MODEL_ARCHITECTURES[args.architecture], dataset, device, precisions=args.precision,
+              threads=args.threads, num_workers=args.workers, pin_memory=args.pin_memory,
+              persistent_workers=args.persistent_workers, prefetch_factor=args.prefetch_factor,
+              batch_size=args.batch_size, steps=args.steps)
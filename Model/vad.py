@@ -0,0 +1,139 @@
+import os
+import json
+import argparse
+import numpy as np
+
+# Speech offsets are stored as {"sample_rate": rate, "segments": {"<file>.wav": [start_sample, end_sample]}},
+# written once during conversion or packing and read by the datasets, which get them at 16 kHz.
+# (Files without "sample_rate", from before it was recorded, hold 16 kHz offsets.)
+SEGMENTS_FILE = "speech_segments.json"
+SEGMENTS_SAMPLE_RATE = 16000
+
+# ---------------------------------------------------
+# Section 1: Energy-Based Voice Activity Detection
+# ---------------------------------------------------
+def frame_energies_db(samples, frame_length):
+    """
+    RMS energy in dB of consecutive non-overlapping frames.
+    Args:
+    - samples (array): Mono float samples in [-1, 1].
+    - frame_length (int): Samples per frame.
+    """
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+    num_frames = len(samples) // frame_length
+    if num_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = samples[:num_frames * frame_length].reshape(num_frames, frame_length)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1) + 1e-12)
+    return 20 * np.log10(rms)
+
+
+def speech_frame_mask(energies_db, floor_percentile=10, above_floor_db=12.0, below_peak_db=35.0, min_level_db=-55.0):
+    """
+    Marks frames as speech when they stand out from the clip's own noise floor.
+    The threshold adapts per clip: at least `above_floor_db` over the quietest frames,
+    no lower than `below_peak_db` under the loudest frame, and never below `min_level_db`.
+    """
+    if len(energies_db) == 0:
+        return np.zeros(0, dtype=bool)
+    noise_floor = np.percentile(energies_db, floor_percentile)
+    threshold = max(noise_floor + above_floor_db, energies_db.max() - below_peak_db, min_level_db)
+    return energies_db > threshold
+
+
+def detect_speech(samples, sample_rate=16000, frame_ms=20, min_speech_ms=60, margin_ms=100):
+    """
+    Finds the voiced region of a clip.
+    Args:
+    - samples (array or Tensor): Mono samples, shape (T,) or (1, T).
+    - sample_rate (int): Sample rate of `samples`.
+    - frame_ms (int): Analysis frame length.
+    - min_speech_ms (int): Shorter bursts (clicks, breaths) are ignored.
+    - margin_ms (int): Padding kept around the detected speech so soft onsets are not clipped.
+
+    Returns:
+    - (start, end) (tuple): Sample offsets of the voiced region. The whole clip if no speech is found.
+    """
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+    frame_length = max(1, int(sample_rate * frame_ms / 1000))
+    speech = speech_frame_mask(frame_energies_db(samples, frame_length))
+
+    # Keep only runs of speech frames that are long enough
+    min_frames = max(1, int(np.ceil(min_speech_ms / frame_ms)))
+    voiced = np.flatnonzero(speech)
+    if len(voiced) == 0:
+        return 0, len(samples)
+    run_breaks = np.flatnonzero(np.diff(voiced) > 1)
+    run_starts = np.concatenate([[voiced[0]], voiced[run_breaks + 1]])
+    run_ends = np.concatenate([voiced[run_breaks], [voiced[-1]]]) + 1
+    long_runs = (run_ends - run_starts) >= min_frames
+    if not long_runs.any():
+        return 0, len(samples)
+
+    margin = int(sample_rate * margin_ms / 1000)
+    start = max(0, run_starts[long_runs][0] * frame_length - margin)
+    end = min(len(samples), run_ends[long_runs][-1] * frame_length + margin)
+    return int(start), int(end)
+
+
+def trim_to_speech(waveform, segment):
+    """
+    Crops a (channels, T) waveform to a (start, end) segment; returns it unchanged if segment is None.
+    """
+    if segment is None:
+        return waveform
+    start, end = segment
+    return waveform[..., start:end]
+
+# ---------------------------------------------------
+# Section 2: Reading and Writing Speech Offsets
+# ---------------------------------------------------
+def load_segments(path, sample_rate=SEGMENTS_SAMPLE_RATE):
+    """
+    Returns {file name: (start, end)} in samples at `sample_rate` (converted from the rate the
+    offsets were recorded at), or an empty dict if no offsets were recorded.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    if "segments" in data and "sample_rate" in data:
+        recorded_rate, data = data["sample_rate"], data["segments"]
+    else:
+        recorded_rate = SEGMENTS_SAMPLE_RATE
+    if recorded_rate == sample_rate:
+        return {name: tuple(segment) for name, segment in data.items()}
+    return {name: tuple(round(offset * sample_rate / recorded_rate) for offset in segment) for name, segment in data.items()}
+
+
+def save_segments(path, segments, sample_rate=SEGMENTS_SAMPLE_RATE):
+    """
+    Args:
+    - segments (dict): {file name: (start, end)} sample offsets.
+    - sample_rate (int): Rate the offsets are in; recorded so readers can convert them.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"sample_rate": sample_rate, "segments": {name: list(segment) for name, segment in segments.items()}}, f)
+    os.replace(tmp_path, path)
+
+# ---------------------------------------------------
+# Section 3: Command Line (for already converted clips)
+# ---------------------------------------------------
+if __name__ == "__main__":
+    from waveform_store import load_clip
+
+    parser = argparse.ArgumentParser(description="Record speech start/end offsets for a directory of .wav files.")
+    parser.add_argument("--audio-dir", default="data/converted_audio/")
+    parser.add_argument("--out", help=f"Defaults to <audio-dir>/{SEGMENTS_FILE}")
+    args = parser.parse_args()
+
+    out_path = args.out or os.path.join(args.audio_dir, SEGMENTS_FILE)
+    segments = load_segments(out_path)
+    for wav_file in sorted(os.listdir(args.audio_dir)):
+        if wav_file.endswith(".wav"):
+            waveform, _ = load_clip(os.path.join(args.audio_dir, wav_file), target_length=None)
+            segments[wav_file] = detect_speech(waveform[0].numpy())
+            start, end = segments[wav_file]
+            print(f"{wav_file}: speech {start / 16000:.2f}s - {end / 16000:.2f}s of {waveform.size(1) / 16000:.2f}s")
+    save_segments(out_path, segments)
@@ -0,0 +1,206 @@
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import torch
+import torchaudio
+from torch.utils.data import Dataset
+from vad import SEGMENTS_FILE, load_segments, trim_to_speech
+
+# A packed store is two files sharing one prefix:
+# - <prefix>.npy:  (num_clips, target_length) array of mono 16 kHz waveforms
+# - <prefix>.json: label index (labels, source files, original lengths, format)
+
+# ---------------------------------------------------
+# Section 1: Packing Audio Files into a Store
+# ---------------------------------------------------
+def load_clip(audio_path, target_length=160000, sample_rate=16000):
+    """
+    Loads one audio file the same way the training datasets do.
+    Args:
+    - audio_path (str): Path to the audio file.
+    - target_length (int): Number of samples to pad or truncate to; None keeps the clip length.
+    - sample_rate (int): Sample rate the clip is resampled to if needed.
+
+    Returns:
+    - waveform (Tensor): Mono waveform of shape (1, target_length).
+    - original_length (int): Number of samples before padding/truncation.
+    """
+    waveform, orig_sample_rate = torchaudio.load(audio_path)
+
+    if waveform.shape[0] > 1:
+        waveform = torch.mean(waveform, dim=0, keepdim=True)
+
+    if orig_sample_rate != sample_rate:
+        waveform = torchaudio.functional.resample(waveform, orig_sample_rate, sample_rate)
+
+    original_length = waveform.size(1)
+    if target_length is None:
+        return waveform, original_length
+
+    if original_length < target_length:
+        waveform = torch.nn.functional.pad(waveform, (0, target_length - original_length))
+    else:
+        waveform = waveform[:, :target_length]
+
+    return waveform, original_length
+
+
+def pack_waveforms(audio_paths, labels, store_path, dtype="float16", target_length=160000, sample_rate=16000, segments=None):
+    """
+    Decodes every clip once and writes them into one contiguous .npy file plus a label index.
+    Args:
+    - audio_paths (list): Paths of the audio files to pack.
+    - labels (list): Label for each audio file.
+    - store_path (str): Output prefix; writes <store_path>.npy and <store_path>.json.
+    - dtype (str): "float16" halves the size on disk and in the page cache, "float32" allows zero-copy reads.
+    - target_length (int): Number of samples per clip.
+    - sample_rate (int): Sample rate of the stored clips.
+    - segments (dict): Optional {file name: (start, end)} speech offsets from vad.py; clips
+      are cropped to their voiced region before padding.
+
+    Returns:
+    - index (dict): The label index written next to the array.
+    """
+    if len(audio_paths) != len(labels):
+        raise ValueError("audio_paths and labels must have the same length")
+
+    os.makedirs(os.path.dirname(os.path.abspath(store_path)), exist_ok=True)
+
+    # Write straight into a memmap so the whole corpus never has to fit in memory
+    array_path = f"{store_path}.npy"
+    tmp_array_path = f"{store_path}.tmp.npy"
+    data = np.lib.format.open_memmap(tmp_array_path, mode="w+", dtype=dtype, shape=(len(audio_paths), target_length))
+
+    segments = segments or {}
+    lengths = []
+    for i, audio_path in enumerate(audio_paths):
+        waveform, original_length = load_clip(audio_path, None, sample_rate)
+        waveform = trim_to_speech(waveform, segments.get(os.path.basename(audio_path)))
+        length = waveform.size(1)
+        data[i, :min(length, target_length)] = waveform[0, :target_length].numpy().astype(dtype)
+        lengths.append(length)
+        print(f"Packed: {audio_path}, Original size: {original_length}, Voiced size: {length}")
+
+    data.flush()
+    del data
+    os.replace(tmp_array_path, array_path)
+
+    index = {
+        "labels": list(labels),
+        "files": [os.path.basename(p) for p in audio_paths],
+        "lengths": lengths,
+        "sample_rate": sample_rate,
+        "target_length": target_length,
+        "dtype": dtype,
+    }
+    # Like the array, the index is written next to its target and renamed into place
+    tmp_index_path = f"{store_path}.tmp.json"
+    with open(tmp_index_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_index_path, f"{store_path}.json")
+
+    return index
+
+
+def pack_directory(audio_dir, store_path, labels=None, **kwargs):
+    """
+    Packs a directory of .wav files.
+    Args:
+    - audio_dir (str): Directory where the audio files are stored.
+    - store_path (str): Output prefix for the store.
+    - labels (list): If given, packs f"{label}.wav" for each label (training layout).
+      Otherwise packs every .wav file and uses the file name as label (test set layout).
+    """
+    if labels is not None:
+        audio_paths = [os.path.join(audio_dir, f"{label}.wav") for label in labels]
+    else:
+        files = sorted(f for f in os.listdir(audio_dir) if f.endswith(".wav"))
+        audio_paths = [os.path.join(audio_dir, f) for f in files]
+        labels = [f.split('.')[0] for f in files]
+
+    return pack_waveforms(audio_paths, labels, store_path, **kwargs)
+
+# ---------------------------------------------------
+# Section 2: Dataset Serving Views from a Store
+# ---------------------------------------------------
+class PackedAudioDataset(Dataset):
+    def __init__(self, store_path, with_sample_rate=False, variable_length=False):
+        """
+        Serves waveforms from a store written by pack_waveforms.
+        Args:
+        - store_path (str): Prefix the store was written with.
+        - with_sample_rate (bool): Return (waveform, sample_rate, label) like main.AudioDataset
+          instead of (waveform, label) like siamese_train.AudioDataset.
+        - variable_length (bool): Return each clip without its zero padding (still a view),
+          for batching with bucketing.LengthBucketSampler.
+        """
+        self.store_path = store_path
+        self.with_sample_rate = with_sample_rate
+        self.variable_length = variable_length
+
+        with open(f"{store_path}.json") as f:
+            index = json.load(f)
+        self.labels = index["labels"]
+        self.files = index["files"]
+        self.sample_rate = index["sample_rate"]
+        self.target_length = index["target_length"]
+        # The index records voiced lengths before truncation; a clip never serves more than target_length
+        self.lengths = [min(length, self.target_length) for length in index["lengths"]]
+        self.file_to_index = {name: i for i, name in enumerate(self.files)}
+
+        # Opened lazily so every DataLoader worker maps the file itself instead of
+        # receiving a pickled copy; all workers then share pages via the OS page cache.
+        self._data = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _array(self):
+        if self._data is None:
+            # Copy-on-write mapping: pages stay shared unless a caller writes to a view
+            self._data = np.load(f"{self.store_path}.npy", mmap_mode="c")
+        return self._data
+
+    def waveform(self, idx):
+        """
+        Returns the (1, target_length) waveform at `idx`. float32 stores return a
+        view into the mapped file; float16 stores are upcast, which copies.
+        """
+        end = self.lengths[idx] if self.variable_length else self.target_length
+        waveform = torch.from_numpy(self._array()[idx:idx + 1, :end])
+        if waveform.dtype != torch.float32:
+            waveform = waveform.float()
+        return waveform
+
+    def __getitem__(self, idx):
+        waveform = self.waveform(idx)
+        label = self.labels[idx]
+        if self.with_sample_rate:
+            return waveform, self.sample_rate, label
+        return waveform, label
+
+# ---------------------------------------------------
+# Section 3: Command Line Pack Step
+# ---------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack audio clips into a memory-mapped waveform store.")
+    parser.add_argument("--audio-dir", required=True, help="Directory of .wav files to pack")
+    parser.add_argument("--out", required=True, help="Output prefix, e.g. data/packed/train")
+    parser.add_argument("--csv", help="CSV with an 'enWord' column; packs <enWord>.wav in that order")
+    parser.add_argument("--dtype", choices=["float16", "float32"], default="float16")
+    parser.add_argument("--target-length", type=int, default=160000)
+    parser.add_argument("--no-trim", action="store_true", help=f"Ignore <audio-dir>/{SEGMENTS_FILE} and keep leading/trailing silence")
+    args = parser.parse_args()
+
+    labels = pd.read_csv(args.csv)['enWord'].tolist() if args.csv else None
+    segments = {} if args.no_trim else load_segments(os.path.join(args.audio_dir, SEGMENTS_FILE))
+    index = pack_directory(args.audio_dir, args.out, labels=labels, dtype=args.dtype,
+                           target_length=args.target_length, segments=segments)
+    print(f"Packed {len(index['labels'])} clips into {args.out}.npy")
@@ -0,0 +1,205 @@
+import os
+import json
+import argparse
+import numpy as np
+import torch
+from embedding_eval import AudioClipDataset, compute_embeddings
+from vad import SEGMENTS_FILE, detect_speech, load_segments, trim_to_speech
+
+# An index is stored as two files sharing one prefix:
+# - <prefix>.npy:  (num_words, embedding_dim) contiguous float32 embedding matrix
+# - <prefix>.json: word labels, plus IVF centroids/list offsets when partitioned
+
+# ---------------------------------------------------
+# Section 1: Exact and IVF Nearest-Neighbour Index
+# ---------------------------------------------------
+class WordIndex:
+    def __init__(self, embeddings, labels):
+        """
+        Args:
+        - embeddings (Tensor): (N, D) reference embeddings, one row per clip.
+        - labels (list): Word label for each row.
+        """
+        if len(labels) != embeddings.shape[0]:
+            raise ValueError("need one label per embedding row")
+        self.embeddings = torch.as_tensor(embeddings, dtype=torch.float32).contiguous()
+        self.labels = list(labels)
+        self.sq_norms = (self.embeddings ** 2).sum(dim=1)
+
+        # IVF state; None means exhaustive search
+        self.centroids = None
+        self.list_offsets = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _distances(self, queries, rows):
+        # ||q - x||^2 = ||q||^2 - 2 q.x + ||x||^2, so the whole comparison is one matmul
+        q_norms = (queries ** 2).sum(dim=1, keepdim=True)
+        sq = q_norms - 2 * queries @ self.embeddings[rows].T + self.sq_norms[rows]
+        return sq.clamp_(min=0).sqrt_()
+
+    def search(self, queries, k=5, nprobe=4):
+        """
+        Finds the k nearest reference clips for each query embedding.
+        Args:
+        - queries (Tensor): (B, D) or (D,) query embeddings.
+        - k (int): Number of neighbours to return.
+        - nprobe (int): Lists searched per query when the index is partitioned.
+
+        Returns:
+        - distances (Tensor): (B, k) Euclidean distances, closest first.
+        - indices (Tensor): (B, k) row indices into the index.
+        """
+        queries = torch.as_tensor(queries, dtype=torch.float32)
+        if queries.dim() == 1:
+            queries = queries.unsqueeze(0)
+
+        if self.centroids is None:
+            k = min(k, len(self))
+            distances = self._distances(queries, slice(None))
+            return torch.topk(distances, k, dim=1, largest=False)
+
+        # Partitioned search: only scan the nprobe lists whose centroids are closest
+        nprobe = min(nprobe, self.centroids.shape[0])
+        probe = torch.topk(torch.cdist(queries, self.centroids), nprobe, dim=1, largest=False).indices
+
+        # One matmul per probed list against all the queries probing it, merged into a running top k
+        all_distances = torch.full((queries.shape[0], k), float("inf"))
+        all_indices = torch.full((queries.shape[0], k), -1, dtype=torch.long)
+        for c in torch.unique(probe).tolist():
+            start, end = self.list_offsets[c], self.list_offsets[c + 1]
+            if start == end:
+                continue
+            probing = (probe == c).any(dim=1).nonzero().squeeze(1)
+            top = torch.topk(self._distances(queries[probing], slice(start, end)), min(k, end - start), dim=1, largest=False)
+            distances = torch.cat([all_distances[probing], top.values], dim=1)
+            indices = torch.cat([all_indices[probing], top.indices + start], dim=1)
+            best = torch.topk(distances, k, dim=1, largest=False)
+            all_distances[probing] = best.values
+            all_indices[probing] = indices.gather(1, best.indices)
+        return all_distances, all_indices
+
+    def lookup(self, queries, k=5, nprobe=4):
+        """
+        Same as search, but returns [(word, distance), ...] for each query.
+        """
+        distances, indices = self.search(queries, k=k, nprobe=nprobe)
+        return [
+            [(self.labels[j], d) for d, j in zip(row_d.tolist(), row_i.tolist()) if j >= 0]
+            for row_d, row_i in zip(distances, indices)
+        ]
+
+    def build_ivf(self, num_lists, iterations=20, seed=0):
+        """
+        Partitions the index with k-means so each query only scans a few lists.
+        Rows are reordered so every list is one contiguous slice of the matrix.
+        """
+        num_lists = min(num_lists, len(self))
+        generator = torch.Generator().manual_seed(seed)
+        centroids = self.embeddings[torch.randperm(len(self), generator=generator)[:num_lists]].clone()
+
+        for _ in range(iterations):
+            assignments = torch.cdist(self.embeddings, centroids).argmin(dim=1)
+            sums = torch.zeros_like(centroids).index_add_(0, assignments, self.embeddings)
+            counts = torch.bincount(assignments, minlength=num_lists).unsqueeze(1)
+            # Empty lists keep their previous centroid
+            centroids = torch.where(counts > 0, sums / counts.clamp(min=1), centroids)
+
+        assignments = torch.cdist(self.embeddings, centroids).argmin(dim=1)
+        order = torch.argsort(assignments, stable=True)
+        counts = torch.bincount(assignments, minlength=num_lists)
+
+        self.embeddings = self.embeddings[order].contiguous()
+        self.sq_norms = self.sq_norms[order]
+        self.labels = [self.labels[i] for i in order.tolist()]
+        self.centroids = centroids
+        self.list_offsets = [0] + torch.cumsum(counts, 0).tolist()
+
+    def save(self, index_path):
+        # Written to temporary names and renamed, so an interrupted save never leaves a truncated file
+        tmp_array_path = f"{index_path}.tmp.npy"
+        np.save(tmp_array_path, self.embeddings.numpy())
+        os.replace(tmp_array_path, f"{index_path}.npy")
+        meta = {"labels": self.labels}
+        if self.centroids is not None:
+            meta["centroids"] = self.centroids.tolist()
+            meta["list_offsets"] = self.list_offsets
+        tmp_meta_path = f"{index_path}.tmp.json"
+        with open(tmp_meta_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_meta_path, f"{index_path}.json")
+
+    @classmethod
+    def load(cls, index_path):
+        with open(f"{index_path}.json") as f:
+            meta = json.load(f)
+        index = cls(torch.from_numpy(np.load(f"{index_path}.npy")), meta["labels"])
+        if "centroids" in meta:
+            index.centroids = torch.tensor(meta["centroids"], dtype=torch.float32)
+            index.list_offsets = meta["list_offsets"]
+        return index
+
+# ---------------------------------------------------
+# Section 2: Building from Reference Clips
+# ---------------------------------------------------
+def build_word_index(model, audio_dir, device, store=None, batch_size=64, num_lists=0):
+    """
+    Embeds every reference clip (e.g. data/converted_audio/<enWord>.wav) once and indexes it.
+    Clips are cropped to their recorded speech offsets, or to the speech vad.detect_speech finds
+    when none were recorded, matching how queries are cropped.
+    Args:
+    - model: Trained SiameseNetwork.
+    - audio_dir (str): Directory of reference .wav files named after their word.
+    - device: Device to run the model on.
+    - store (PackedAudioDataset): Optional store packed from audio_dir.
+    - batch_size (int): Clips per forward pass.
+    - num_lists (int): Number of IVF lists; 0 keeps exhaustive search.
+    """
+    dataset = AudioClipDataset(audio_dir, store=store, segments=load_segments(os.path.join(audio_dir, SEGMENTS_FILE)),
+                               detect_missing=True)
+    embeddings = compute_embeddings(model, dataset, device, batch_size=batch_size)
+    index = WordIndex(embeddings, dataset.labels)
+    if num_lists:
+        index.build_ivf(num_lists)
+    return index
+
+# ---------------------------------------------------
+# Section 3: Main Execution Block
+# ---------------------------------------------------
+if __name__ == "__main__":
+    from siamese_train import MODEL_ARCHITECTURES
+    from waveform_store import load_clip
+
+    parser = argparse.ArgumentParser(description="Build or query the Siamese word recognition index.")
+    parser.add_argument("--model", default="./trained_siamese_model.pth")
+    parser.add_argument("--architecture", choices=sorted(MODEL_ARCHITECTURES), default="flatten")
+    parser.add_argument("--index", default="./word_index", help="Index prefix (<prefix>.npy / <prefix>.json)")
+    parser.add_argument("--build", metavar="AUDIO_DIR", help="Reference clips to index, e.g. data/converted_audio/")
+    parser.add_argument("--num-lists", type=int, default=0, help="IVF lists for large vocabularies (0 = exhaustive)")
+    parser.add_argument("--query", nargs="*", default=[], help=".wav files to recognise")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    model = MODEL_ARCHITECTURES[args.architecture]()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model.load_state_dict(torch.load(args.model, map_location=device))
+    model.to(device)
+    model.eval()
+
+    if args.build:
+        index = build_word_index(model, args.build, device, num_lists=args.num_lists)
+        index.save(args.index)
+        print(f"Indexed {len(index)} reference clips into {args.index}.npy")
+    else:
+        index = WordIndex.load(args.index)
+
+    for query_path in args.query:
+        # Same silence cropping as the reference clips (no offsets are recorded for queries), then the usual 10 s padding
+        waveform, _ = load_clip(query_path, target_length=None)
+        waveform = trim_to_speech(waveform, detect_speech(waveform[0].numpy()))[:, :160000]
+        waveform = torch.nn.functional.pad(waveform, (0, 160000 - waveform.size(1)))
+        with torch.no_grad():
+            query = model.forward_one(waveform.unsqueeze(0).to(device)).cpu()
+        matches = index.lookup(query, k=args.k)[0]
+        print(f"{query_path}: " + ", ".join(f"{word} ({distance:.4f})" for word, distance in matches))